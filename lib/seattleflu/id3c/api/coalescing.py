@@ -0,0 +1,319 @@
+"""
+Coalescing of concurrent identical exports into a single query.
+
+When several clients request the same export at once, e.g. Tableau extracts
+refreshing on the same schedule, only the first request queries the
+database.  The others attach to its query, or "flight", and receive the same
+rows.
+
+Rows are fanned out through a spool on disk rather than per-subscriber
+queues in memory.  The query runs in a background thread which appends rows
+to the spool, and each subscriber reads the spool at its own pace.  A slow
+client therefore never stalls the query or the other clients, and memory use
+is bounded by the rows between flushes.  The spool is bounded too: it's
+split into segments which are removed once every subscriber has read them,
+and a subscriber which falls more than ``MAX_LAG`` bytes (256 MiB by default)
+behind the query is dropped with an error.  Subscribers which attach after
+the first rows were produced still receive every row, as long as the first
+segment hasn't been removed yet; otherwise they start a new flight.
+
+A flight ends when its query is exhausted, or when every subscriber has gone
+away.  Requests arriving after that start a new flight, so coalesced exports
+are never staler than the requests sharing them.
+"""
+import logging
+import os
+import tempfile
+from functools import wraps
+from threading import Condition, Lock, Thread
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+LOG = logging.getLogger(__name__)
+
+
+# Number of rows appended to a spool between flushes, which makes them
+# visible to subscribers
+FLUSH_ROWS = int(os.environ.get("EXPORT_COALESCING_FLUSH_ROWS", 1000))
+
+# Size at which a spool segment is full and the next is started
+SEGMENT_SIZE = int(os.environ.get("EXPORT_COALESCING_SEGMENT_SIZE", 16 * 1024 * 1024))
+
+# Number of bytes a subscriber may fall behind a query before it's dropped
+MAX_LAG = int(os.environ.get("EXPORT_COALESCING_MAX_LAG", 256 * 1024 * 1024))
+
+# Size of the blocks in which subscribers read spools
+READ_SIZE = 64 * 1024
+
+FLIGHTS: Dict[Tuple[Any, ...], "Flight"] = {}
+FLIGHTS_LOCK = Lock()
+
+
+def coalesce(function: Callable[..., Iterable[Tuple[str]]]) -> Callable[..., Iterator[Tuple[str]]]:
+    """
+    Coalesces concurrent calls of a generator *function* which yields rows
+    of a single text column without newlines, such as JSON, and takes a
+    database session as its first argument.
+
+    Calls are identical if they're made by the same database user with the
+    same arguments, which must be hashable.
+
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> from threading import Event
+    >>> from time import sleep
+    >>> from types import SimpleNamespace
+    >>> session = SimpleNamespace(connection = SimpleNamespace(info = SimpleNamespace(user = "tableau")))
+    >>> queries, release = [], Event()
+    >>> @coalesce
+    ... def export(session, table):
+    ...     queries.append(table)
+    ...     release.wait()
+    ...     yield from [('{"a":1}',), ('{"a":2}',)]
+    >>> with ThreadPoolExecutor() as pool:
+    ...     results = pool.map(list, [export(session, "t"), export(session, "t")])
+    ...     while not FLIGHTS or next(iter(FLIGHTS.values())).subscribers < 2:
+    ...         sleep(0.01)
+    ...     release.set()
+    >>> list(results)
+    [[('{"a":1}',), ('{"a":2}',)], [('{"a":1}',), ('{"a":2}',)]]
+    >>> queries
+    ['t']
+    """
+    @wraps(function)
+    def wrapped(session, *args, **kwargs) -> Iterator[Tuple[str]]:
+        key = (function.__qualname__, session.connection.info.user, args, tuple(sorted(kwargs.items())))
+
+        with FLIGHTS_LOCK:
+            flight = FLIGHTS.get(key)
+            subscription = flight.subscribe() if flight else None
+
+            if subscription:
+                LOG.debug(f"Attaching to in-flight {function.__name__}{args}")
+            else:
+                flight = FLIGHTS[key] = Flight(key, function(session, *args, **kwargs))
+                subscription = flight.subscribe()
+                flight.start()
+
+        yield from subscription
+
+    return wrapped
+
+
+class Flight:
+    """
+    A single query, identified by *key*, whose *rows* are spooled to
+    temporary files for any number of subscribers to read.
+
+    The spool is a series of segment files, each started once the last
+    reaches :data:`SEGMENT_SIZE` bytes.  Segments are removed as soon as
+    every subscriber has read past them, and subscribers which fall more than
+    :data:`MAX_LAG` bytes behind the query are dropped, so a flight never
+    spools much more than ``MAX_LAG + SEGMENT_SIZE`` bytes at once.
+    """
+    def __init__(self, key: Tuple[Any, ...], rows: Iterable[Tuple[str]]):
+        self.key = key
+        self.rows = rows
+        self.condition = Condition()
+        self.segments: List[Tuple[int, str]] = []
+        self.positions: Dict[int, int] = {}
+        self.dropped: Set[int] = set()
+        self.next_subscriber = 0
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+        self.spool = self.new_segment()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.positions)
+
+    def start(self) -> None:
+        Thread(target = self.run, name = f"coalesced export {self.key[0]}", daemon = True).start()
+
+    def run(self) -> None:
+        """
+        Appends all rows to the spool, flushing every :data:`FLUSH_ROWS`,
+        until they're exhausted or no one is subscribed anymore.
+        """
+        try:
+            rows = iter(self.rows)
+            count = 0
+
+            try:
+                for row in rows:
+                    self.spool.write((row[0] + "\n").encode("utf-8"))
+                    count += 1
+
+                    if count % FLUSH_ROWS == 0:
+                        self.flush()
+
+                        if self.abandoned():
+                            LOG.debug(f"Abandoned {self.key[0]} without subscribers")
+                            break
+            finally:
+                close = getattr(rows, "close", None)
+                if close:
+                    close()
+
+            self.flush()
+
+        except BaseException as error:
+            self.error = error
+
+        finally:
+            self.spool.close()
+            self.land()
+
+    def new_segment(self) -> BinaryIO:
+        """
+        Starts a new segment of the spool at the current size.
+        """
+        descriptor, path = tempfile.mkstemp(prefix = "id3c-export-", suffix = ".spool")
+
+        with self.condition:
+            self.segments.append((self.size, path))
+
+        return os.fdopen(descriptor, "wb")
+
+    def flush(self) -> None:
+        """
+        Makes the rows appended so far visible to subscribers, drops those
+        which have fallen too far behind, and starts a new segment if the
+        current one is full.
+        """
+        self.spool.flush()
+
+        with self.condition:
+            self.size = self.segments[-1][0] + self.spool.tell()
+
+            for subscriber, position in list(self.positions.items()):
+                if self.size - position > MAX_LAG:
+                    LOG.warning(f"Dropping a subscriber of {self.key[0]} more than {MAX_LAG:,} bytes behind")
+                    del self.positions[subscriber]
+                    self.dropped.add(subscriber)
+
+            self.trim()
+            self.condition.notify_all()
+
+        if self.spool.tell() >= SEGMENT_SIZE:
+            spool, self.spool = self.spool, self.new_segment()
+            spool.close()
+
+    def trim(self) -> None:
+        """
+        Removes the segments every subscriber has read past, or all of them
+        once the flight is done and no one is subscribed anymore.  Must be
+        called while holding :attr:`condition`.
+        """
+        read = min(self.positions.values(), default = self.size)
+
+        while len(self.segments) > 1 and self.segments[1][0] <= read:
+            os.unlink(self.segments.pop(0)[1])
+
+        if self.done and not self.positions:
+            for _, path in self.segments:
+                os.unlink(path)
+
+            self.segments.clear()
+
+    def abandoned(self) -> bool:
+        """
+        Ends the flight early, so that no one else attaches to it, if no one
+        is subscribed to it anymore.
+        """
+        with FLIGHTS_LOCK:
+            if self.subscribers:
+                return False
+
+            if FLIGHTS.get(self.key) is self:
+                del FLIGHTS[self.key]
+
+            return True
+
+    def land(self) -> None:
+        """
+        Marks the flight as done, so that new calls start another.  Its
+        segments are removed once its subscribers have read them.
+        """
+        with FLIGHTS_LOCK:
+            if FLIGHTS.get(self.key) is self:
+                del FLIGHTS[self.key]
+
+        with self.condition:
+            self.done = True
+            self.trim()
+            self.condition.notify_all()
+
+    def subscribe(self) -> Optional[Iterator[Tuple[str]]]:
+        """
+        Returns a reader of all rows of the flight, from the first, or
+        ``None`` if the first rows have already been removed from the spool.
+        Must be called while holding :data:`FLIGHTS_LOCK`, so that the flight
+        doesn't land before it's subscribed to.
+        """
+        with self.condition:
+            if not self.segments or self.segments[0][0] != 0:
+                return None
+
+            file = open(self.segments[0][1], "rb")
+            subscriber = self.next_subscriber
+            self.next_subscriber += 1
+            self.positions[subscriber] = 0
+
+        return self.read(subscriber, file)
+
+    def read(self, subscriber: int, file: BinaryIO) -> Iterator[Tuple[str]]:
+        try:
+            start = 0
+            position = 0
+            incomplete = b""
+
+            while True:
+                with self.condition:
+                    if subscriber in self.positions:
+                        self.positions[subscriber] = position
+                        self.trim()
+
+                    while self.size == position and not self.done and subscriber not in self.dropped:
+                        self.condition.wait()
+
+                    if subscriber in self.dropped:
+                        raise RuntimeError(f"Fell more than {MAX_LAG:,} bytes behind the coalesced export {self.key[0]}")
+
+                    size, done = self.size, self.done
+                    segments = list(self.segments)
+
+                while position < size:
+                    following = [ segment for segment in segments if segment[0] > start ]
+                    end = following[0][0] if following else size
+
+                    if position == end:
+                        file.close()
+                        start, path = following[0]
+
+                        try:
+                            file = open(path, "rb")
+                        except FileNotFoundError:
+                            raise RuntimeError(f"Fell more than {MAX_LAG:,} bytes behind the coalesced export {self.key[0]}")
+
+                        continue
+
+                    block = incomplete + file.read(min(READ_SIZE, end - position))
+                    position += len(block) - len(incomplete)
+                    *lines, incomplete = block.split(b"\n")
+
+                    for line in lines:
+                        yield (line.decode("utf-8"),)
+
+                if done:
+                    break
+
+            if self.error:
+                raise self.error
+        finally:
+            file.close()
+
+            with self.condition:
+                self.positions.pop(subscriber, None)
+                self.dropped.discard(subscriber)
+                self.trim()
@@ -1,26 +1,56 @@
-from typing import Any, Iterable, Tuple
+import os
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+from cachetools import TTLCache
 from psycopg2.sql import SQL, Identifier
 from id3c.db.session import DatabaseSession
 from id3c.api.datastore import catch_permission_denied
 from id3c.api.utils import export
+from .coalescing import coalesce
+
+
+# Number of rows fetched per round trip by the server-side cursors which
+# stream exports.  Memory use of an export is bounded by this, not the size of
+# the exported view.
+EXPORT_ITERSIZE = int(os.environ.get("EXPORT_ITERSIZE", 2000))
+
+# Return of results lookups by barcode, keyed by (database user, barcode) so
+# that results are never shared between users with different permissions.
+# Barcodes are compared case-insensitively, like the citext barcode column,
+# so keys use the lowercased barcode.  Participants refresh their results
+# often, so even a short TTL absorbs most lookups while keeping results
+# reasonably fresh.  Unknown barcodes are never cached, so results are found
+# as soon as they are released.
+BARCODE_RESULTS_CACHE: TTLCache = TTLCache(
+    maxsize = int(os.environ.get("RETURN_RESULTS_CACHE_SIZE", 10000)),
+    ttl     = int(os.environ.get("RETURN_RESULTS_CACHE_TTL", 60)))
+
+BARCODE_RESULTS_LOCK = Lock()
 
 @export
 @catch_permission_denied
+@coalesce
 def fetch_rows_from_table(session: DatabaseSession,
-                          qualified_table: Tuple) -> Iterable[Tuple[str]]:
+                          qualified_table: Tuple,
+                          itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple[str]]:
     """
     Exports all rows in a given *qualified_table* and yields them as JSON (one
     per line) in a generative fashion.
 
     *qualified_table* should be a tuple of (schema, table). All identifiers will
     be properly quoted by this method.
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
+    Concurrent identical exports share a single query; see
+    :mod:`seattleflu.id3c.api.coalescing`.
     """
     assert len(qualified_table) == 2, \
         "A schema and table name must be included in the qualified table tuple"
 
     table = SQL(".").join(map(Identifier, qualified_table))
 
-    with session, session.cursor() as cursor:
+    with session, session.cursor("fetch_rows_from_table") as cursor:
+        cursor.itersize = itersize
         cursor.execute(SQL("""
             select row_to_json(r)::text
             from {} as r
@@ -29,6 +59,171 @@ def fetch_rows_from_table(session: DatabaseSession,
         yield from cursor
 
 
+@export
+@catch_permission_denied
+@coalesce
+def fetch_rows_incrementally(session: DatabaseSession,
+                             qualified_table: Tuple,
+                             key: str,
+                             since_column: str = None,
+                             since: str = None,
+                             after: Any = None,
+                             limit: int = None,
+                             itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple[str]]:
+    """
+    Exports rows in a given *qualified_table* in order of its *key* column,
+    yielding them as JSON (one per line) like :func:`fetch_rows_from_table`.
+
+    Only rows whose *since_column* is later than *since*, whose *key* is
+    greater than *after*, or both, are exported, up to *limit* rows.  Pages
+    of an export can be fetched by passing the *key* of the last row
+    received as the next *after*.  *key* and *since_column* should be
+    indexed so that each page costs only as much as the rows in it.
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
+    """
+    assert len(qualified_table) == 2, \
+        "A schema and table name must be included in the qualified table tuple"
+
+    assert since is None or since_column, \
+        f"{'.'.join(qualified_table)} does not support since"
+
+    table = SQL(".").join(map(Identifier, qualified_table))
+    conditions = [SQL("true")]
+    parameters: Dict[str, Any] = { "limit": limit }
+
+    if since is not None:
+        conditions.append(SQL("{} > %(since)s").format(Identifier(since_column)))
+        parameters["since"] = since
+
+    if after is not None:
+        conditions.append(SQL("{} > %(after)s").format(Identifier(key)))
+        parameters["after"] = after
+
+    with session, session.cursor("fetch_rows_incrementally") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(SQL("""
+            select row_to_json(r)::text
+            from {} as r
+            where {}
+            order by {}
+            limit %(limit)s
+            """).format(table, SQL(" and ").join(conditions), Identifier(key)), parameters)
+
+        yield from cursor
+
+
+@export
+@catch_permission_denied
+def fetch_change_token(session: DatabaseSession,
+                       qualified_table: Tuple) -> str:
+    """
+    Returns a cheap token which changes whenever the data behind a given
+    *qualified_table* (usually a view) may have changed.
+
+    The token is derived from the table itself and every table and
+    materialized view it is built from, following view definitions
+    recursively.  It covers their row modification counters from the
+    statistics collector and their storage file nodes, which change when a
+    table is truncated or a materialized view is refreshed.  Statistics are
+    reported shortly after each transaction commits, so the token may lag
+    behind the most recent changes by a moment.  It doesn't change with time
+    alone, which views using e.g. ``current_date`` also depend on.
+
+    Snapshots are shared between users, so the token is only returned to
+    users permitted to select from *qualified_table*.
+    """
+    assert len(qualified_table) == 2, \
+        "A schema and table name must be included in the qualified table tuple"
+
+    table = SQL(".").join(map(Identifier, qualified_table))
+
+    with session:
+        # Fails for users without permission, without reading any rows
+        session.fetch_row(SQL("select from {} limit 0").format(table))
+
+        return session.fetch_row("""
+            with recursive dependency(oid) as (
+                select %s::regclass::oid
+                union
+                select pg_depend.refobjid
+                  from dependency
+                  join pg_rewrite on pg_rewrite.ev_class = dependency.oid
+                  join pg_depend on pg_depend.objid = pg_rewrite.oid
+                 where pg_depend.classid = 'pg_rewrite'::regclass
+                   and pg_depend.refclassid = 'pg_class'::regclass
+                   and pg_depend.refobjid <> dependency.oid
+            )
+            select md5(string_agg(
+                       concat_ws(':', pg_class.oid, pg_class.relfilenode, n_tup_ins, n_tup_upd, n_tup_del),
+                       ',' order by pg_class.oid)) as token
+              from dependency
+              join pg_class on pg_class.oid = dependency.oid
+              left join pg_stat_all_tables on pg_stat_all_tables.relid = pg_class.oid
+            """, (table.as_string(session.connection),)).token
+
+
+@export
+@catch_permission_denied
+def fetch_table_columns(session: DatabaseSession,
+                        qualified_table: Tuple) -> List[Tuple[str, str]]:
+    """
+    Returns the name and type of each column of a given *qualified_table*, in
+    order.  Types are as formatted by Postgres' ``format_type()``, e.g.
+    ``character varying(10)`` or ``timestamp with time zone``.
+    """
+    assert len(qualified_table) == 2, \
+        "A schema and table name must be included in the qualified table tuple"
+
+    table = SQL(".").join(map(Identifier, qualified_table)).as_string(session.connection)
+
+    with session:
+        return [
+            (column.name, column.type) for column in session.fetch_all("""
+                select attname as name, format_type(atttypid, atttypmod) as type
+                  from pg_attribute
+                 where attrelid = %s::regclass
+                   and attnum > 0
+                   and not attisdropped
+                 order by attnum
+                """, (table,)) ]
+
+
+@export
+@catch_permission_denied
+def fetch_columns_from_table(session: DatabaseSession,
+                             qualified_table: Tuple,
+                             columns: Sequence[Tuple[str, str]],
+                             itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple]:
+    """
+    Exports all rows in a given *qualified_table* as tuples of native values,
+    rather than JSON like :func:`fetch_rows_from_table`.
+
+    *columns* is a sequence of (name, type) pairs naming the columns to export
+    and the Postgres type each is cast to.  Types are interpolated into the
+    query as is, so must never come from user input.
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
+    """
+    assert len(qualified_table) == 2, \
+        "A schema and table name must be included in the qualified table tuple"
+
+    table = SQL(".").join(map(Identifier, qualified_table))
+
+    select_list = SQL(", ").join(
+        SQL("{}::{}").format(Identifier(name), SQL(type))
+            for name, type in columns)
+
+    with session, session.cursor("fetch_columns_from_table") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(SQL("""
+            select {}
+            from {}
+            """).format(select_list, table))
+
+        yield from cursor
+
+
 @export
 @catch_permission_denied
 def fetch_barcode_results(session: DatabaseSession,
@@ -36,31 +231,87 @@ def fetch_barcode_results(session: DatabaseSession,
     """
     Export presence/absence results from shipping view for a specific
     *barcode*
+
+    Results are served from :data:`BARCODE_RESULTS_CACHE` when possible.
+    """
+    return fetch_barcode_results_batch(session, [barcode])[barcode]
+
+
+@export
+@catch_permission_denied
+def fetch_barcode_results_batch(session: DatabaseSession,
+                                barcodes: Iterable[str]) -> Dict[str, Any]:
     """
-    barcode_result = session.fetch_row("""
-        select barcode, status, organisms_present
-        from shipping.return_results_v2
-        where barcode = %s
-    """, (barcode,))
+    Export presence/absence results from shipping view for each of the given
+    *barcodes*, keyed by barcode.
+
+    Results are served from :data:`BARCODE_RESULTS_CACHE` when possible, and
+    any others are fetched together with a single query.
+    """
+    user = session.connection.info.user
+    barcodes = list(dict.fromkeys(barcodes))
+    results = {}
+
+    with BARCODE_RESULTS_LOCK:
+        for barcode in barcodes:
+            cached = BARCODE_RESULTS_CACHE.get((user, barcode.lower()))
+
+            if cached is not None:
+                results[barcode] = cached
+
+    missing = [ barcode for barcode in barcodes if barcode not in results ]
+
+    if missing:
+        barcode_results = session.fetch_all("""
+            select barcode, status, organisms_present
+            from shipping.return_results_v2
+            where barcode = any(%s::citext[])
+        """, (missing,))
 
-    if not barcode_result:
-        results = { "status": "unknownBarcode" }
-    else:
-        results = barcode_result._asdict()
+        fetched = { result.barcode.lower(): result._asdict() for result in barcode_results }
+
+        with BARCODE_RESULTS_LOCK:
+            for barcode, result in fetched.items():
+                BARCODE_RESULTS_CACHE[(user, barcode)] = result
+
+        for barcode in missing:
+            results[barcode] = fetched.get(barcode.lower(), { "status": "unknownBarcode" })
 
     return results
 
 
+def invalidate_barcode_results(barcodes: Iterable[str] = None) -> None:
+    """
+    Removes the cached results of the given *barcodes*, or of all barcodes if
+    none are given, from :data:`BARCODE_RESULTS_CACHE`.
+
+    Call this when results may have changed sooner than the cache's TTL.
+    """
+    with BARCODE_RESULTS_LOCK:
+        if barcodes is None:
+            BARCODE_RESULTS_CACHE.clear()
+        else:
+            barcodes = { barcode.lower() for barcode in barcodes }
+
+            for key in [ key for key in BARCODE_RESULTS_CACHE if key[1] in barcodes ]:
+                BARCODE_RESULTS_CACHE.pop(key, None)
+
+
 @export
 @catch_permission_denied
+@coalesce
 def fetch_genomic_sequences(session: DatabaseSession,
                         lineage: str,
-                        segment: str) -> Iterable[Tuple[str]]:
+                        segment: str,
+                        itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple[str]]:
     """
     Export sample identifier and sequence from shipping view based on the
     provided *lineage* and *segment*
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
     """
-    with session, session.cursor() as cursor:
+    with session, session.cursor("fetch_genomic_sequences") as cursor:
+        cursor.itersize = itersize
         cursor.execute("""
             select row_to_json(r)::text
             from (select sample, seq
@@ -71,49 +322,73 @@ def fetch_genomic_sequences(session: DatabaseSession,
         yield from cursor
 
 
+@export
+@catch_permission_denied
+def fetch_genomic_sequence_records(session: DatabaseSession,
+                                   lineage: str,
+                                   segment: str,
+                                   itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple[str, str]]:
+    """
+    Export (sample identifier, sequence) tuples from shipping view based on
+    the provided *lineage* and *segment*, without encoding them as JSON.
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
+    """
+    with session, session.cursor("fetch_genomic_sequence_records") as cursor:
+        cursor.itersize = itersize
+        cursor.execute("""
+            select sample, seq
+              from shipping.genomic_sequences_for_augur_build_v1
+             where organism = %s and segment = %s
+            """,(lineage, segment))
+
+        yield from cursor
+
+
 @export
 @catch_permission_denied
 def fetch_deliverables_log(session: DatabaseSession,
-                        sent_on: str,
-                        process_name: str) -> Iterable[Tuple[str]]:
+                           process_name: str,
+                           sent_from: str = None,
+                           sent_to: str = None,
+                           itersize: int = EXPORT_ITERSIZE) -> Iterable[Tuple[str]]:
     """
-    Export entries from operations.deliverables_log based on the
-    provided *sent_on* date and *process_name*, with associated sample
-    and collection barcodes populated.
+    Export entries from operations.deliverables_log for the provided
+    *process_name* sent on or after the *sent_from* date and on or before
+    the *sent_to* date, with associated sample and collection barcodes
+    populated.  Either date may be omitted for an open-ended range.
+
+    Dates are compared as ranges of ``sent`` times, rather than by casting
+    ``sent`` to a date, so that only the matching entries are scanned using
+    the index on (process_name, sent).
+
+    Rows are streamed from a server-side cursor, *itersize* rows at a time.
     """
+    conditions = [SQL("process_name = %(process_name)s")]
+    parameters = { "process_name": process_name, "sent_from": sent_from, "sent_to": sent_to }
 
-    with session, session.cursor() as cursor:
-        cursor.execute("""
+    if sent_from is not None:
+        conditions.append(SQL("sent >= %(sent_from)s::date"))
+
+    if sent_to is not None:
+        conditions.append(SQL("sent < %(sent_to)s::date + 1"))
+
+    with session, session.cursor("fetch_deliverables_log") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(SQL("""
             select row_to_json(r)::text
             from (select deliverables_log_id,
                         lower(coalesce(sample_barcode, right(sample.identifier,8))) as sample_barcode,
                         lower(coalesce(collection_barcode, right(sample.collection_identifier,8))) as collection_barcode,
 
-                        -- only return details that may be useful for QC
-                        (select jsonb_object_agg(key, value) FROM jsonb_each(deliverables_log.details)
-                            where key in (
-                                          -- wa doh linelist details
-                                          '_provenance',
-                                          'record_id',
-                                          'study_arm',
-                                          'date_tested',
-                                          'test_result',
-                                          'collection_date',
-                                          'redcap_event_name',
-
-                                          -- return of results details
-                                          'result_ts',
-                                          'swab_type',
-                                          'collect_ts',
-                                          'status_code',
-                                          'staff_observed',
-                                          'pre_analytical_specimen_collection')
-                        ) as details
+                        -- only details that may be useful for QC, selected
+                        -- by db.log_deliverable
+                        qc_details as details
 
                     from operations.deliverables_log
                         left join warehouse.identifier samp_identifier on samp_identifier.barcode = sample_barcode
                         left join warehouse.sample on samp_identifier.uuid::text = sample.identifier
-                    where sent::date = %s and process_name = %s) as r
-            """,(sent_on, process_name))
+                    where {}) as r
+            """).format(SQL(" and ").join(conditions)), parameters)
 
         yield from cursor
@@ -0,0 +1,221 @@
+"""
+Export formats besides NDJSON, written straight from database rows.
+"""
+import logging
+import re
+from io import RawIOBase
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+from flask import request
+from more_itertools import chunked
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None # type: ignore
+
+LOG = logging.getLogger(__name__)
+
+
+NDJSON = "application/x-ndjson"
+FASTA = "text/x-fasta"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+
+# Number of rows in each Arrow record batch
+ARROW_BATCH_SIZE = 10_000
+
+# Number of rows in each Parquet row group.  Larger row groups compress
+# better, at the cost of holding more rows in memory while writing them.
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+# Postgres types as which columns of each Postgres type are exported in
+# columnar formats, chosen so psycopg2 returns values Arrow can convert
+# without loss of type.  Columns of any other type (json, uuid, intervals,
+# ltree, …) are exported as text.
+COLUMNAR_TYPES = {
+    "smallint":                    "smallint",
+    "integer":                     "integer",
+    "bigint":                      "bigint",
+    "real":                        "real",
+    "double precision":            "double precision",
+    "numeric":                     "double precision",
+    "boolean":                     "boolean",
+    "date":                        "date",
+    "timestamp with time zone":    "timestamp with time zone",
+    "timestamp without time zone": "timestamp without time zone",
+    "text":                        "text",
+    "character varying":           "text",
+    "character":                   "text",
+    "text[]":                      "text[]",
+    "character varying[]":         "text[]",
+}
+
+
+def negotiate_format(formats: Sequence[str]) -> str:
+    """
+    Returns the media type among *formats* which the current request's
+    ``Accept`` header prefers, or the first of *formats* if it accepts none of
+    them in particular.  Arrow and Parquet formats are only offered if
+    :mod:`pyarrow` is installed.
+    """
+    available = [
+        format for format in formats
+            if pyarrow or format not in (ARROW_STREAM, PARQUET) ]
+
+    return request.accept_mimetypes.best_match(available, default = available[0])
+
+
+def fasta(records: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """
+    Writes (identifier, sequence) *records* as FASTA, one unwrapped sequence
+    line per record.
+
+    >>> b"".join(fasta([("a", "ACGT"), ("b", "NNAC")]))
+    b'>a\\nACGT\\n>b\\nNNAC\\n'
+    """
+    for identifier, sequence in records:
+        yield f">{identifier}\n{sequence}\n".encode("utf-8")
+
+
+def columnar_schema(columns: Sequence[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], "pyarrow.Schema"]:
+    """
+    Maps Postgres *columns*, (name, type) pairs as returned by
+    :func:`seattleflu.id3c.api.datastore.fetch_table_columns`, to the
+    (name, type) pairs to export them as and the Arrow schema of the export.
+
+    >>> casts, schema = columnar_schema([
+    ...     ("id", "integer"),
+    ...     ("site", "character varying(20)"),
+    ...     ("age", "numeric"),
+    ...     ("collected", "timestamp with time zone"),
+    ...     ("details", "jsonb")])
+    >>> casts
+    [('id', 'integer'), ('site', 'text'), ('age', 'double precision'), ('collected', 'timestamp with time zone'), ('details', 'text')]
+    >>> schema.types
+    [DataType(int32), DataType(string), DataType(double), TimestampType(timestamp[us, tz=UTC]), DataType(string)]
+    """
+    arrow_types = {
+        "smallint":                    pyarrow.int16(),
+        "integer":                     pyarrow.int32(),
+        "bigint":                      pyarrow.int64(),
+        "real":                        pyarrow.float32(),
+        "double precision":            pyarrow.float64(),
+        "boolean":                     pyarrow.bool_(),
+        "date":                        pyarrow.date32(),
+        "timestamp with time zone":    pyarrow.timestamp("us", tz = "UTC"),
+        "timestamp without time zone": pyarrow.timestamp("us"),
+        "text":                        pyarrow.string(),
+        "text[]":                      pyarrow.list_(pyarrow.string()),
+    }
+
+    casts = [
+        (name, COLUMNAR_TYPES.get(re.sub(r"\(.*?\)", "", type), "text"))
+            for name, type in columns ]
+
+    schema = pyarrow.schema([ (name, arrow_types[type]) for name, type in casts ])
+
+    return casts, schema
+
+
+def arrow_stream(rows: Iterable[Tuple], schema: "pyarrow.Schema", batch_size: int = ARROW_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Writes *rows*, tuples with values in the order of the fields of *schema*,
+    as an Arrow IPC stream of record batches of up to *batch_size* rows each.
+    Each batch is yielded as soon as it's written.
+
+    >>> schema = pyarrow.schema([("sample", pyarrow.string()), ("seq", pyarrow.string())])
+    >>> table = pyarrow.ipc.open_stream(b"".join(arrow_stream([("a", "ACGT"), ("b", None)], schema, 1))).read_all()
+    >>> table.to_pydict()
+    {'sample': ['a', 'b'], 'seq': ['ACGT', None]}
+    """
+    sink = Sink()
+
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        yield sink.drain()
+
+        for batch in chunked(rows, batch_size):
+            writer.write_batch(record_batch(batch, schema))
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+def parquet_stream(rows: Iterable[Tuple], schema: "pyarrow.Schema", row_group_size: int = PARQUET_ROW_GROUP_SIZE) -> Iterator[bytes]:
+    """
+    Writes *rows*, tuples with values in the order of the fields of *schema*,
+    as a zstd-compressed Parquet file with row groups of up to
+    *row_group_size* rows each.  Each row group is yielded as soon as it's
+    written, and the file's footer last.
+
+    >>> from io import BytesIO
+    >>> schema = pyarrow.schema([("sample", pyarrow.string()), ("age", pyarrow.int32())])
+    >>> file = pyarrow.parquet.ParquetFile(BytesIO(b"".join(parquet_stream([("a", 1), ("b", None), ("c", 3)], schema, 2))))
+    >>> file.num_row_groups
+    2
+    >>> file.read().to_pydict()
+    {'sample': ['a', 'b', 'c'], 'age': [1, None, 3]}
+    """
+    sink = Sink()
+
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression = "zstd") as writer:
+        for batch in chunked(rows, row_group_size):
+            writer.write_batch(record_batch(batch, schema), row_group_size = row_group_size)
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+def record_batch(rows: List[Tuple], schema: "pyarrow.Schema") -> "pyarrow.RecordBatch":
+    """
+    Converts *rows*, tuples with values in the order of the fields of
+    *schema*, to an Arrow record batch.
+    """
+    columns: List[List[Any]] = [ [] for _ in schema ]
+
+    for row in rows:
+        for column, value in zip(columns, row):
+            column.append(value)
+
+    return pyarrow.record_batch(
+        [ pyarrow.array(column, type = field.type) for column, field in zip(columns, schema) ],
+        schema = schema)
+
+
+class Sink(RawIOBase):
+    """
+    A write-only file which holds what's written to it until drained.
+
+    Unlike a :class:`io.BytesIO` emptied between writes, it reports the
+    position of everything ever written to it, which writers like Parquet's
+    record in the file's footer.
+
+    >>> sink = Sink()
+    >>> sink.write(b"abc")
+    3
+    >>> sink.drain(), sink.tell(), sink.drain()
+    (b'abc', 3, b'')
+    """
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        """
+        Returns and forgets everything written since the last drain.
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
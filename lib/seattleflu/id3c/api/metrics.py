@@ -0,0 +1,241 @@
+"""
+Per-endpoint request metrics, exposed in the Prometheus text format.
+
+For every request to an instrumented blueprint, histograms record:
+
+* the time until the first chunk of the response body was produced, which
+  for exports is dominated by the database query,
+* the total duration, including streaming the body to the client,
+* the number of rows exported, and
+* the number of bytes sent, after any compression.
+
+Streamed responses are measured as they're consumed, so their duration and
+sizes are recorded when the stream finishes or the client goes away.
+
+Metrics are kept in memory by each process of the API, so a scraper sees
+only the process which answered it.
+"""
+import logging
+from bisect import bisect_left
+from itertools import chain
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar, Union
+from flask import Blueprint, Response, g, has_request_context, request
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+ROWS_BUCKETS    = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+BYTES_BUCKETS   = (1024, 16 * 1024, 256 * 1024, 4 * 1024**2, 64 * 1024**2, 1024**3, 16 * 1024**3)
+
+
+class Histogram:
+    """
+    A cumulative histogram of observations with the given *labels*.
+
+    >>> h = Histogram("request_rows", "Rows exported", ["endpoint"], (1, 10))
+    >>> h.observe(("a",), 5)
+    >>> h.observe(("a",), 50)
+    >>> print(h.render())
+    # HELP request_rows Rows exported
+    # TYPE request_rows histogram
+    request_rows_bucket{endpoint="a",le="1"} 0
+    request_rows_bucket{endpoint="a",le="10"} 1
+    request_rows_bucket{endpoint="a",le="+Inf"} 2
+    request_rows_sum{endpoint="a"} 55
+    request_rows_count{endpoint="a"} 2
+    """
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self.lock = Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self.lock:
+            if labels not in self.series:
+                self.series[labels] = ([0] * (len(self.buckets) + 1), [0])
+
+            counts, total = self.series[labels]
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self.lock:
+            series = sorted((labels, list(counts), total[0]) for labels, (counts, total) in self.series.items())
+
+        for labels, counts, total in series:
+            selector = ",".join(f'{name}="{escape(value)}"' for name, value in zip(self.labels, labels))
+            cumulative = 0
+
+            for bound, count in zip(chain(map(number, self.buckets), ["+Inf"]), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{selector},le="{bound}"}} {cumulative}')
+
+            lines.append(f"{self.name}_sum{{{selector}}} {number(total)}")
+            lines.append(f"{self.name}_count{{{selector}}} {cumulative}")
+
+        return "\n".join(lines)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def number(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+LABELS = ["endpoint", "method", "status"]
+
+HISTOGRAMS = {
+    "first_byte": Histogram(
+        "id3c_customizations_request_first_byte_seconds",
+        "Time until the first chunk of the response body was produced",
+        LABELS, SECONDS_BUCKETS),
+
+    "duration": Histogram(
+        "id3c_customizations_request_duration_seconds",
+        "Time until the response body was completely sent",
+        LABELS, SECONDS_BUCKETS),
+
+    "rows": Histogram(
+        "id3c_customizations_response_rows",
+        "Rows exported in the response body",
+        LABELS, ROWS_BUCKETS),
+
+    "bytes": Histogram(
+        "id3c_customizations_response_bytes",
+        "Bytes sent in the response body, after compression",
+        LABELS, BYTES_BUCKETS),
+}
+
+
+class RequestMetrics:
+    """
+    Measurements of a single request, started when it's received.
+    """
+    def __init__(self, endpoint: str, method: str):
+        self.endpoint = endpoint
+        self.method = method
+        self.start = perf_counter()
+        self.first_byte: Optional[float] = None
+        self.rows = 0
+        self.bytes = 0
+
+    def count_rows(self, rows: Iterable[T]) -> Iterator[T]:
+        """
+        Passes *rows* through, counting them.
+        """
+        for row in rows:
+            self.rows += 1
+            yield row
+
+    def count_lines(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Passes *chunks* of newline-delimited rows through, counting the rows.
+        """
+        for chunk in chunks:
+            self.rows += chunk.count(b"\n")
+            yield chunk
+
+    def stream(self, chunks: Iterable[Union[str, bytes]], status: str) -> Iterator[bytes]:
+        """
+        Passes *chunks* of a response body through, recording the request's
+        metrics once they're exhausted or abandoned.  Text chunks are encoded
+        as UTF-8, as Werkzeug would, so their size is counted in bytes.
+        """
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if self.first_byte is None:
+                    self.first_byte = perf_counter()
+                self.bytes += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+            self.record(status)
+
+    def record(self, status: str) -> None:
+        end = perf_counter()
+        labels = (self.endpoint, self.method, status)
+
+        HISTOGRAMS["first_byte"].observe(labels, (self.first_byte or end) - self.start)
+        HISTOGRAMS["duration"].observe(labels, end - self.start)
+        HISTOGRAMS["rows"].observe(labels, self.rows)
+        HISTOGRAMS["bytes"].observe(labels, self.bytes)
+
+
+def current() -> Optional[RequestMetrics]:
+    """
+    Returns the metrics of the current request, if it's instrumented.
+    """
+    return g.get("metrics") if has_request_context() else None
+
+
+def count_rows(rows: Iterable[T]) -> Iterable[T]:
+    """
+    Counts *rows* toward the exported rows of the current request, if it's
+    instrumented.  Must be called while handling the request, though the rows
+    are counted as they're later consumed.
+    """
+    metrics = current()
+    return metrics.count_rows(rows) if metrics else rows
+
+
+def count_lines(chunks: Iterable[bytes]) -> Iterable[bytes]:
+    """
+    Counts newline-delimited rows in *chunks* toward the exported rows of the
+    current request, if it's instrumented, like :func:`count_rows`.
+    """
+    metrics = current()
+    return metrics.count_lines(chunks) if metrics else chunks
+
+
+def instrument(*blueprints: Blueprint) -> None:
+    """
+    Records metrics for every request to the given *blueprints*.
+    """
+    for blueprint in blueprints:
+        blueprint.before_request(start)
+        blueprint.after_request(finish)
+
+
+def start() -> None:
+    g.metrics = RequestMetrics(request.endpoint or "unknown", request.method)
+
+
+def finish(response: Response) -> Response:
+    metrics: Optional[RequestMetrics] = g.pop("metrics", None)
+
+    if metrics:
+        status = str(response.status_code)
+
+        if response.is_streamed:
+            response.response = metrics.stream(response.response, status)
+        else:
+            metrics.bytes = response.content_length or 0
+            metrics.record(status)
+
+    return response
+
+
+def render() -> str:
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    return "\n".join(histogram.render() for histogram in HISTOGRAMS.values()) + "\n"
@@ -0,0 +1,142 @@
+"""
+Streaming responses for API exports.
+"""
+import logging
+import os
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+from flask import Response, request
+from .metrics import count_rows
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None # type: ignore
+
+LOG = logging.getLogger(__name__)
+
+
+# Compression levels for exports, overridable with environment variables.
+GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", 6))
+ZSTD_LEVEL = int(os.environ.get("EXPORT_ZSTD_LEVEL", 3))
+
+# Amount of uncompressed output to collect before compressing it and flushing
+# it to the client.  Larger chunks compress better, smaller chunks reach the
+# client sooner.
+FLUSH_SIZE = 64 * 1024
+
+
+def gzip_encoder(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Compresses *chunks* into a gzip stream, flushing after every
+    :data:`FLUSH_SIZE` bytes of input.
+
+    >>> import gzip
+    >>> gzip.decompress(b"".join(gzip_encoder([b"a\\n", b"b\\n"])))
+    b'a\\nb\\n'
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    for chunk in buffered(chunks):
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+def zstd_encoder(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Compresses *chunks* into a Zstandard stream, flushing a block after every
+    :data:`FLUSH_SIZE` bytes of input.
+    """
+    compressor = zstandard.ZstdCompressor(level = ZSTD_LEVEL).compressobj()
+
+    for chunk in buffered(chunks):
+        yield compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    yield compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def buffered(chunks: Iterable[bytes], size: int = None) -> Iterator[bytes]:
+    """
+    Joins consecutive *chunks* until they're at least *size* bytes long
+    (:data:`FLUSH_SIZE` by default).
+
+    >>> list(buffered([b"a", b"b", b"c", b"d", b"e"], size = 2))
+    [b'ab', b'cd', b'e']
+    """
+    size = size or FLUSH_SIZE
+    buffer = []
+    length = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+
+        if length >= size:
+            yield b"".join(buffer)
+            buffer = []
+            length = 0
+
+    if buffer:
+        yield b"".join(buffer)
+
+
+ENCODERS: Dict[str, Callable[[Iterable[bytes]], Iterator[bytes]]] = {}
+
+if zstandard:
+    ENCODERS["zstd"] = zstd_encoder
+
+ENCODERS["gzip"] = gzip_encoder
+
+
+def negotiate_encoding() -> Tuple[str, Callable[[Iterable[bytes]], Iterator[bytes]]]:
+    """
+    Returns the name and encoder of the content encoding the current request
+    accepts most, preferring ``zstd`` over ``gzip`` when equally acceptable,
+    or (``None``, ``None``) if it accepts neither.
+    """
+    encoding = request.accept_encodings.best_match(list(ENCODERS))
+
+    if encoding:
+        return encoding, ENCODERS[encoding]
+    else:
+        return None, None
+
+
+def ndjson_response(rows: Iterable[Tuple[str]]) -> Response:
+    """
+    Streams *rows*, each a tuple whose first item is a JSON document, as an
+    NDJSON response.
+
+    The body is compressed with gzip or zstd when the request's
+    ``Accept-Encoding`` allows, flushing as it goes so the response keeps
+    streaming.
+    """
+    return ndjson_stream_response((row[0] + '\n').encode("utf-8") for row in count_rows(rows))
+
+
+def ndjson_stream_response(chunks: Iterable[bytes]) -> Response:
+    """
+    Streams *chunks* of already serialized NDJSON as a response, compressing
+    them as :func:`ndjson_response` does.
+    """
+    return stream_response(chunks, "application/x-ndjson")
+
+
+def stream_response(chunks: Iterable[bytes], mimetype: str) -> Response:
+    """
+    Streams *chunks* of a body of the given *mimetype* as a response,
+    compressing them with gzip or zstd when the request's ``Accept-Encoding``
+    allows.
+    """
+    encoding, encoder = negotiate_encoding()
+
+    if not encoder:
+        return Response(chunks, mimetype=mimetype, headers={"Vary": "Accept-Encoding"})
+
+    LOG.debug(f"Compressing {mimetype} response with {encoding}")
+
+    return Response(
+        encoder(chunks),
+        mimetype=mimetype,
+        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
@@ -1,11 +1,15 @@
 import logging
-from flask import jsonify, request, abort, Response, Blueprint, send_file
+from flask import jsonify, request, abort, Blueprint, Response, send_file
 from flask_cors import cross_origin
 from id3c.api.routes import api_v1, blueprints, api_unversioned
 from id3c.api.exceptions import BadRequest
 from id3c.api.utils.routes import authenticated_datastore_session_required
+from datetime import datetime
 from pathlib import Path
-from . import datastore
+from typing import Any, Dict, Optional
+from . import datastore, formats, metrics
+from .responses import ndjson_response, stream_response
+from .snapshots import snapshot_response
 import os
 import re
 
@@ -13,12 +17,22 @@ LOG = logging.getLogger(__name__)
 
 base_dir     = Path(__file__).parent.resolve()
 
+GENOMIC_SEQUENCE_SCHEMA = formats.pyarrow.schema([
+    ("sample", formats.pyarrow.string()),
+    ("seq", formats.pyarrow.large_string()),
+]) if formats.pyarrow else None
+
+# Maximum number of barcodes in a batched return of results request
+RETURN_RESULTS_BATCH_LIMIT = int(os.environ.get("RETURN_RESULTS_BATCH_LIMIT", 100))
+
 api_v2 = Blueprint('api_v2', 'api_v2', url_prefix='/v2')
 blueprints.append(api_v2)
 
 api_v3 = Blueprint('api_v3', 'api_v3', url_prefix='/v3')
 blueprints.append(api_v3)
 
+metrics.instrument(api_v1, api_v2, api_v3)
+
 @api_unversioned.route("/documentation/customizations", methods = ['GET'])
 def get_documentation():
     """
@@ -26,6 +40,19 @@ def get_documentation():
     """
     return send_file(base_dir / "static/documentation.html", "text/html; charset=UTF-8")
 
+
+@api_unversioned.route("/metrics/customizations", methods = ['GET'])
+def get_metrics():
+    """
+    Export per-endpoint request metrics in the Prometheus text format.
+    """
+    # restrict access to the metrics scraper and localhost
+    if request.remote_addr not in [os.environ.get('METRICS_SCRAPER_IP'), '127.0.0.1']:
+        abort(403)
+
+    return Response(metrics.render(), mimetype = "text/plain; version=0.0.4")
+
+
 @api_v1.route("/shipping/return-results/<barcode>", methods = ['GET'])
 @cross_origin(origins=[
     "https://seattleflu.org",
@@ -55,6 +82,32 @@ def get_barcode_results_v2(barcode, session):
     return jsonify(results)
 
 
+@api_v2.route("/shipping/return-results", methods = ['POST'])
+@cross_origin(origins=[
+    "https://seattleflu.org",
+    "https://dev.seattleflu.org",
+    "http://localhost:3000",
+    "http://localhost:8080"])
+@authenticated_datastore_session_required
+def get_barcode_results_batch(session):
+    """
+    Export presence/absence results for each of the collection barcodes
+    listed under the ``barcodes`` key of the JSON request body, keyed by
+    barcode.
+    """
+    body = request.get_json(silent = True)
+    barcodes = body.get("barcodes") if isinstance(body, dict) else None
+
+    if not isinstance(barcodes, list) or not all(isinstance(barcode, str) for barcode in barcodes):
+        raise BadRequest(f"Request body must be a JSON object with a list of strings under «barcodes».")
+    if len(barcodes) > RETURN_RESULTS_BATCH_LIMIT:
+        raise BadRequest(f"At most {RETURN_RESULTS_BATCH_LIMIT} «barcodes» may be requested at once.")
+
+    LOG.debug(f"Exporting presence/absence results for {len(barcodes)} barcodes")
+    results = datastore.fetch_barcode_results_batch(session, barcodes)
+    return jsonify(results)
+
+
 @api_v1.route("/shipping/augur-build-metadata", methods = ['GET'])
 def get_metadata_v1():
     """
@@ -71,22 +124,19 @@ def get_metadata_v2(session):
     """
     LOG.debug("Exporting metadata for SFS augur build")
 
-    metadata = datastore.fetch_rows_from_table(session, ("shipping", "metadata_for_augur_build_v2"))
-
-    return Response((row[0] + '\n' for row in metadata), mimetype="application/x-ndjson")
+    return snapshot_response(session, ("shipping", "metadata_for_augur_build_v2"))
 
 
 @api_v3.route("/shipping/augur-build-metadata", methods = ['GET'])
 @authenticated_datastore_session_required
 def get_metadata_v3(session):
     """
-    Export metadata needed for SFS augur build
+    Export metadata needed for SFS augur build, as NDJSON, Parquet or an
+    Arrow IPC stream depending on the request's Accept header
     """
     LOG.debug("Exporting metadata for SFS augur build")
 
-    metadata = datastore.fetch_rows_from_table(session, ("shipping", "metadata_for_augur_build_v3"))
-
-    return Response((row[0] + '\n' for row in metadata), mimetype="application/x-ndjson")
+    return columnar_export_response(session, ("shipping", "metadata_for_augur_build_v3"))
 
 
 @api_v1.route("/shipping/genomic-data/<lineage>/<segment>", methods = ['GET'])
@@ -97,12 +147,28 @@ def get_genomic_data(lineage, segment, session):
     *lineage* and *segment*.
     The *lineage* should be in the full lineage in ltree format
     such as 'Influenza.A.H1N1'
+
+    Sequences are exported as NDJSON by default, or as FASTA or an Arrow IPC
+    stream if preferred by the request's Accept header.
     """
-    LOG.debug(f"Exporting genomic data for lineage <{lineage}> and segment <{segment}>")
+    format = formats.negotiate_format([formats.NDJSON, formats.FASTA, formats.ARROW_STREAM])
+
+    LOG.debug(f"Exporting genomic data for lineage <{lineage}> and segment <{segment}> as {format}")
 
-    sequences = datastore.fetch_genomic_sequences(session, lineage, segment)
+    if format == formats.FASTA:
+        records = metrics.count_rows(datastore.fetch_genomic_sequence_records(session, lineage, segment))
+        response = stream_response(formats.fasta(records), format)
 
-    return Response((row[0] + '\n' for row in sequences), mimetype="application/x-ndjson")
+    elif format == formats.ARROW_STREAM:
+        records = metrics.count_rows(datastore.fetch_genomic_sequence_records(session, lineage, segment))
+        response = stream_response(formats.arrow_stream(records, GENOMIC_SEQUENCE_SCHEMA), format)
+
+    else:
+        sequences = datastore.fetch_genomic_sequences(session, lineage, segment)
+        response = ndjson_response(sequences)
+
+    response.vary.add("Accept")
+    return response
 
 
 @api_v1.route("/shipping/scan-demographics", methods = ['GET'])
@@ -113,22 +179,19 @@ def get_scan_demographics(session):
     """
     LOG.debug("Exporting demographics for SCAN")
 
-    demographics = datastore.fetch_rows_from_table(session, ("shipping", "scan_demographics_v1"))
-
-    return Response((row[0] + '\n' for row in demographics), mimetype="application/x-ndjson")
+    return snapshot_response(session, ("shipping", "scan_demographics_v1"))
 
 
 @api_v2.route("/shipping/scan-demographics", methods = ['GET'])
 @authenticated_datastore_session_required
 def get_scan_demographics__v2(session):
     """
-    Export basic demographics for SCAN
+    Export basic demographics for SCAN, as NDJSON, Parquet or an Arrow IPC
+    stream depending on the request's Accept header
     """
     LOG.debug("Exporting demographics with COVID status for SCAN")
 
-    demographics = datastore.fetch_rows_from_table(session, ("shipping", "scan_demographics_v2"))
-
-    return Response((row[0] + '\n' for row in demographics), mimetype="application/x-ndjson")
+    return columnar_export_response(session, ("shipping", "scan_demographics_v2"))
 
 
 @api_v1.route("/shipping/scan-hcov19-positives", methods = ['GET'])
@@ -141,7 +204,7 @@ def get_scan_positives(session):
 
     positives = datastore.fetch_rows_from_table(session, ("shipping", "scan_hcov19_result_counts_v1"))
 
-    return Response((row[0] + '\n' for row in positives), mimetype="application/x-ndjson")
+    return ndjson_response(positives)
 
 
 @api_v2.route("/shipping/scan-hcov19-positives", methods = ['GET'])
@@ -154,7 +217,7 @@ def get_scan_positives__v2(session):
 
     positives = datastore.fetch_rows_from_table(session, ("shipping", "scan_hcov19_result_counts_v2"))
 
-    return Response((row[0] + '\n' for row in positives), mimetype="application/x-ndjson")
+    return ndjson_response(positives)
 
 
 @api_v1.route("/shipping/scan-enrollments", methods = ['GET'])
@@ -167,7 +230,7 @@ def get_scan_enrollments(session):
 
     enrollments = datastore.fetch_rows_from_table(session, ("shipping", "scan_enrollments_v1"))
 
-    return Response((row[0] + '\n' for row in enrollments), mimetype="application/x-ndjson")
+    return ndjson_response(enrollments)
 
 
 @api_v1.route("/shipping/scan-enrollments-internal", methods = ['GET'])
@@ -180,7 +243,7 @@ def get_scan_enrollments_internal(session):
 
     enrollments = datastore.fetch_rows_from_table(session, ("shipping", "scan_redcap_enrollments_v1"))
 
-    return Response((row[0] + '\n' for row in enrollments), mimetype="application/x-ndjson")
+    return ndjson_response(enrollments)
 
 
 @api_v1.route("/shipping/latest-results", methods = ['GET'])
@@ -195,9 +258,15 @@ def get_latest_results(session):
     if request.remote_addr not in [os.environ['LIMS_IP'], '127.0.0.1']:
         abort(403)
 
-    latest_results = datastore.fetch_rows_from_table(session, ("shipping", "latest_results"))
+    incremental = incremental_export_arguments()
+
+    if incremental:
+        latest_results = datastore.fetch_rows_incrementally(session, ("shipping", "latest_results"),
+            key = "latest_result_id", since_column = "created", **incremental)
+    else:
+        latest_results = datastore.fetch_rows_from_table(session, ("shipping", "latest_results"))
 
-    return Response((row[0] + '\n' for row in latest_results), mimetype="application/x-ndjson")
+    return ndjson_response(latest_results)
 
 
 @api_v1.route("/shipping/hct-tableau-results", methods = ['GET'])
@@ -208,9 +277,15 @@ def get_hct_tableau_results(session):
     """
     LOG.debug("Exporting HCT results for Tableau dashboard backing data")
 
-    hct_tableau_results = datastore.fetch_rows_from_table(session, ("shipping", "uw_reopening_results_hct_data_pulls"))
+    incremental = incremental_export_arguments(since = False)
+
+    if incremental:
+        hct_tableau_results = datastore.fetch_rows_incrementally(session, ("shipping", "uw_reopening_results_hct_data_pulls_v2"),
+            key = "presence_absence_id", **incremental)
 
-    return Response((row[0] + '\n' for row in hct_tableau_results), mimetype="application/x-ndjson")
+        return ndjson_response(hct_tableau_results)
+
+    return snapshot_response(session, ("shipping", "uw_reopening_results_hct_data_pulls"))
 
 
 @api_v1.route("/shipping/hct-tableau-encounters", methods = ['GET'])
@@ -221,16 +296,89 @@ def get_hct_tableau_encounters(session):
     """
     LOG.debug("Exporting HCT encounters for Tableau dashboard backing data")
 
-    hct_tableau_encounters = datastore.fetch_rows_from_table(session, ("shipping", "uw_reopening_encounters_hct_data_pulls"))
+    # Encounters are kept by their date, not when they were last imported or
+    # changed, so only paging by key is supported.  The view picks each
+    # individual's latest encounter on the fly, so every page still queries
+    # all of their encounters.
+    incremental = incremental_export_arguments(since = False)
+
+    if incremental:
+        hct_tableau_encounters = datastore.fetch_rows_incrementally(session, ("shipping", "uw_reopening_encounters_hct_data_pulls"),
+            key = "individual_id", **incremental)
+
+        return ndjson_response(hct_tableau_encounters)
+
+    return snapshot_response(session, ("shipping", "uw_reopening_encounters_hct_data_pulls"))
+
+
+def incremental_export_arguments(since: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Parses the optional ``since``, ``after`` and ``limit`` query parameters of
+    an export route into keyword arguments for
+    :func:`datastore.fetch_rows_incrementally`, or returns ``None`` if none
+    were given.  Routes whose rows have no meaningful modification time pass
+    *since* as false to reject the ``since`` parameter.
+    """
+    arguments: Dict[str, Any] = {
+        name: request.args.get(name)
+            for name in ["since", "after", "limit"]
+             if request.args.get(name) is not None
+    }
+
+    if not arguments:
+        return None
+
+    if "since" in arguments:
+        if not since:
+            raise BadRequest(f"Argument «since» is not supported by this route; use «after» instead.")
+        try:
+            arguments["since"] = datetime.fromisoformat(arguments["since"].replace("Z", "+00:00"))
+        except ValueError:
+            raise BadRequest(f"Argument «since» improperly formatted (expected an ISO 8601 timestamp).")
+
+    for name in ["after", "limit"]:
+        if name in arguments:
+            if not re.match(r"^\d+$", arguments[name]):
+                raise BadRequest(f"Argument «{name}» improperly formatted (expected a non-negative integer).")
+            arguments[name] = int(arguments[name])
+
+    return arguments
+
+
+def columnar_export_response(session, qualified_table) -> Response:
+    """
+    Responds with all rows of *qualified_table* in the format preferred by
+    the request's Accept header: NDJSON through
+    :func:`.snapshots.snapshot_response` by default, or typed columns as a
+    Parquet file or an Arrow IPC stream.
+    """
+    format = formats.negotiate_format([formats.NDJSON, formats.PARQUET, formats.ARROW_STREAM])
+
+    if format == formats.NDJSON:
+        response = snapshot_response(session, qualified_table)
+
+    else:
+        LOG.debug(f"Exporting {'.'.join(qualified_table)} as {format}")
 
-    return Response((row[0] + '\n' for row in hct_tableau_encounters), mimetype="application/x-ndjson")
+        columns, schema = formats.columnar_schema(datastore.fetch_table_columns(session, qualified_table))
+        rows = metrics.count_rows(datastore.fetch_columns_from_table(session, qualified_table, columns))
+
+        if format == formats.PARQUET:
+            # Parquet is compressed already
+            response = Response(formats.parquet_stream(rows, schema), mimetype = format)
+        else:
+            response = stream_response(formats.arrow_stream(rows, schema), format)
+
+    response.vary.add("Accept")
+    return response
 
 
 @api_v1.route("/operations/deliverables-log", methods = ['GET'])
 @authenticated_datastore_session_required
 def get_deliverables_log(session):
     """
-    Export deliverables log
+    Export deliverables log for a *process_name*, either for a single *sent*
+    date or a range of dates from *sent_from* to *sent_to*, inclusive
     """
     LOG.debug("Exporting deliverables log for LIMS integration")
 
@@ -239,18 +387,26 @@ def get_deliverables_log(session):
         abort(403)
 
     sent_on = request.args.get('sent')
+    sent_from = request.args.get('sent_from')
+    sent_to = request.args.get('sent_to')
     process_name = request.args.get('process_name')
 
     date_format = re.compile(r"^\d{4}-\d{2}-\d{2}$")
-    if not sent_on:
-        raise BadRequest(f"Missing required argument «sent≫.")
-    if not date_format.match(sent_on):
-        raise BadRequest(f"Argument «sent≫ improperly formatted (expected format: YYYY-MM-DD).")
-    elif not process_name:
+    if sent_on and (sent_from or sent_to):
+        raise BadRequest(f"Argument «sent≫ cannot be combined with «sent_from≫ or «sent_to≫.")
+    if not (sent_on or sent_from or sent_to):
+        raise BadRequest(f"Missing required argument «sent≫ (or «sent_from≫ and/or «sent_to≫).")
+    for name, value in [('sent', sent_on), ('sent_from', sent_from), ('sent_to', sent_to)]:
+        if value and not date_format.match(value):
+            raise BadRequest(f"Argument «{name}≫ improperly formatted (expected format: YYYY-MM-DD).")
+    if not process_name:
         raise BadRequest(f"Missing required argument «process_name≫.")
     elif process_name not in ['return-of-results', 'wa-doh-linelists']:
         raise BadRequest(f"Unrecognized «process_name≫ (expected: 'return-of-results' or 'wa-doh-linelists').")
 
-    deliverables_log = datastore.fetch_deliverables_log(session, sent_on, process_name)
+    if sent_on:
+        sent_from = sent_to = sent_on
+
+    deliverables_log = datastore.fetch_deliverables_log(session, process_name, sent_from, sent_to)
 
-    return Response((row[0] + '\n' for row in deliverables_log), mimetype="application/x-ndjson")
+    return ndjson_response(deliverables_log)
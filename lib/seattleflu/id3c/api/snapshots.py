@@ -0,0 +1,274 @@
+"""
+Snapshots of heavy exports, served with ``ETag`` and ``Last-Modified``.
+
+Each snapshot is the NDJSON output of a view, materialized to a local file
+named for the view and a change token from
+:func:`seattleflu.id3c.api.datastore.fetch_change_token`.  While the token is
+unchanged, requests are served from the file, or answered ``304 Not
+Modified`` if the client already has it, without querying the view again.
+Some views change with time alone, e.g. by comparing dates to
+``current_date``, which the token can't see, so snapshots are also
+superseded every ``SNAPSHOT_MAX_AGE`` seconds.
+
+Generation of a snapshot is guarded by an exclusive lock on a file next to
+it, so concurrent requests for the same export, in any thread or process of
+the API, share a single query.  The request which takes the lock writes the
+snapshot in a background thread, at the pace of the database rather than of
+its client.  It and any other request arriving before the snapshot is
+complete stream the partial file as it grows, so they all start receiving
+rows right away.  Requests which find another snapshot of the same export
+still being generated for longer than ``SNAPSHOT_LOCK_TIMEOUT`` seconds stream
+the view directly instead.
+"""
+import fcntl
+import logging
+import os
+import stat
+import tempfile
+from datetime import datetime, timezone
+from hashlib import sha256
+from pathlib import Path
+from threading import Thread
+from time import monotonic, sleep, time
+from typing import IO, Iterable, Iterator, Optional, Tuple
+from flask import Response, request
+from id3c.db.session import DatabaseSession
+from . import datastore
+from .metrics import count_lines
+from .responses import ndjson_response, ndjson_stream_response
+
+LOG = logging.getLogger(__name__)
+
+
+SNAPSHOT_DIR = Path(os.environ.get("EXPORT_SNAPSHOT_DIR") or Path(tempfile.gettempdir()) / "id3c-export-snapshots")
+
+# Seconds after which a snapshot is superseded even if its change token isn't
+SNAPSHOT_MAX_AGE = float(os.environ.get("EXPORT_SNAPSHOT_MAX_AGE") or 3600)
+
+# Seconds to wait for the generation of another snapshot of the same export to
+# finish before streaming the export directly instead
+SNAPSHOT_LOCK_TIMEOUT = float(os.environ.get("EXPORT_SNAPSHOT_LOCK_TIMEOUT") or 5)
+
+# Size of the blocks in which snapshot files are read back
+READ_SIZE = 64 * 1024
+
+# Seconds between checks for more of a snapshot which is being generated
+POLL_INTERVAL = 0.1
+
+
+def snapshot_response(session: DatabaseSession, qualified_table: Tuple[str, str]) -> Response:
+    """
+    Responds with all rows of *qualified_table*, as
+    :func:`seattleflu.id3c.api.datastore.fetch_rows_from_table` would, but
+    through a snapshot.
+    """
+    token = datastore.fetch_change_token(session, qualified_table)
+    period = int(time() // SNAPSHOT_MAX_AGE)
+    name = ".".join(qualified_table)
+    etag = sha256(f"{name}\N{UNIT SEPARATOR}{token}\N{UNIT SEPARATOR}{period}".encode("utf-8")).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        LOG.debug(f"Snapshot of {name} is unchanged since the client's copy")
+        response = Response(status = 304)
+        response.set_etag(etag, weak = True)
+        return response
+
+    SNAPSHOT_DIR.mkdir(parents = True, exist_ok = True)
+    snapshot = SNAPSHOT_DIR / f"{name}.{etag}.ndjson"
+    lock = FileLock(SNAPSHOT_DIR / f"{name}.lock")
+    deadline = monotonic() + SNAPSHOT_LOCK_TIMEOUT
+    file: IO[bytes]
+
+    while True:
+        try:
+            file = snapshot.open("rb")
+        except FileNotFoundError:
+            pass
+        else:
+            LOG.debug(f"Serving snapshot of {name} from «{snapshot}»")
+            return complete_response(file, etag)
+
+        if lock.acquire():
+            # Another request may have finished generating it since we looked
+            if snapshot.exists():
+                lock.release()
+                continue
+
+            LOG.info(f"Generating snapshot of {name}")
+            file = generate(name, snapshot, datastore.fetch_rows_from_table(session, qualified_table), lock)
+            break
+
+        try:
+            file = partial(snapshot).open("rb")
+        except FileNotFoundError:
+            # Another snapshot of the export is being generated, or ours is
+            # just starting or finishing
+            if monotonic() >= deadline:
+                LOG.warning(f"Timed out waiting for another snapshot of {name}; streaming it directly")
+                return ndjson_response(datastore.fetch_rows_from_table(session, qualified_table))
+
+            sleep(POLL_INTERVAL)
+        else:
+            LOG.debug(f"Following generation of snapshot of {name} in «{file.name}»")
+            break
+
+    response = ndjson_stream_response(count_lines(follow(file, lock.path)))
+    response.set_etag(etag, weak = True)
+    return response
+
+
+def complete_response(file: IO[bytes], etag: str) -> Response:
+    """
+    Responds with the complete snapshot *file*, or ``304 Not Modified`` if
+    the client's copy isn't older than it.
+    """
+    last_modified = datetime.fromtimestamp(int(os.fstat(file.fileno()).st_mtime), timezone.utc)
+
+    if request.if_modified_since and not request.if_none_match and last_modified <= request.if_modified_since:
+        file.close()
+        response = Response(status = 304)
+    else:
+        response = ndjson_stream_response(count_lines(read(file)))
+
+    response.set_etag(etag, weak = True)
+    response.last_modified = last_modified
+    return response
+
+
+def partial(snapshot: Path) -> Path:
+    """
+    Path of the file to which *snapshot* is written until it's complete.
+    """
+    return snapshot.with_name(f"{snapshot.name}.partial")
+
+
+def generate(name: str, snapshot: Path, rows: Iterable[Tuple[str]], lock: "FileLock") -> IO[bytes]:
+    """
+    Writes NDJSON lines for *rows* to the partial file of *snapshot* in a
+    background thread, returning the partial file opened for reading.  Must
+    be called while holding *lock*, which the thread releases when done.
+
+    Once all rows are written, the partial file is marked complete for
+    :func:`follow` by making it read-only, and then replaces *snapshot*.
+    Older snapshots of the export *name* are then removed.
+    """
+    incomplete = partial(snapshot)
+
+    try:
+        # Left behind by a process which stopped while generating it
+        incomplete.unlink(missing_ok = True)
+
+        writer = incomplete.open("xb")
+        reader = incomplete.open("rb")
+    except:
+        lock.release()
+        raise
+
+    def run():
+        try:
+            with writer:
+                for row in rows:
+                    writer.write((row[0] + '\n').encode("utf-8"))
+
+                writer.flush()
+                os.fchmod(writer.fileno(), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            os.replace(incomplete, snapshot)
+
+            for old in SNAPSHOT_DIR.glob(f"{name}.*.ndjson*"):
+                if old != snapshot:
+                    old.unlink(missing_ok = True)
+
+        except BaseException:
+            LOG.exception(f"Failed to generate snapshot of {name}")
+            incomplete.unlink(missing_ok = True)
+
+        finally:
+            lock.release()
+
+    Thread(target = run, name = f"snapshot of {name}", daemon = True).start()
+
+    return reader
+
+
+def follow(file: IO[bytes], lock_path: Path) -> Iterator[bytes]:
+    """
+    Reads a snapshot *file* which may still be being generated while
+    *lock_path* is locked, waiting for more whenever the end is reached,
+    until it's marked complete by :func:`generate`.
+
+    Raises an error if generation stops before the file is complete, so that
+    the response is cut short rather than silently truncated.
+    """
+    with file:
+        while True:
+            complete = is_complete(file)
+            block = file.read(READ_SIZE)
+
+            if block:
+                yield block
+            elif complete:
+                return
+            elif not is_generating(file, lock_path) and not is_complete(file):
+                raise RuntimeError(f"Generation of «{file.name}» stopped before it was complete")
+            else:
+                sleep(POLL_INTERVAL)
+
+
+def is_complete(file: IO[bytes]) -> bool:
+    return not os.fstat(file.fileno()).st_mode & stat.S_IWUSR
+
+
+def is_generating(file: IO[bytes], lock_path: Path) -> bool:
+    """
+    Returns true if the partial snapshot *file* may still be written to: it
+    hasn't been removed, and generation under *lock_path* is still running.
+    """
+    if not os.fstat(file.fileno()).st_nlink:
+        return False
+
+    lock = FileLock(lock_path)
+
+    if lock.acquire():
+        lock.release()
+        return False
+
+    return True
+
+
+def read(file: IO[bytes]) -> Iterator[bytes]:
+    with file:
+        yield from iter(lambda: file.read(READ_SIZE), b"")
+
+
+class FileLock:
+    """
+    An exclusive :func:`fcntl.flock` on *path*.  Each lock opens *path* anew,
+    so it excludes other threads of this process as well as other processes.
+    Releasing is idempotent and may happen in another thread.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.file: Optional[IO] = None
+
+    def acquire(self) -> bool:
+        """
+        Takes the lock without waiting for it.  Returns true if the lock was
+        taken.
+        """
+        file = self.path.open("a")
+
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+
+        self.file = file
+        return True
+
+    def release(self) -> None:
+        if self.file:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
@@ -8,6 +8,7 @@ By in turn loading our own individual commands here, we allow each command
 module to register itself via Click's decorators.
 """
 import logging
+import numpy as np
 import pandas as pd
 from typing import List
 
@@ -20,6 +21,8 @@ __all__ = [
     "reportable_conditions",
     "offer_uw_testing",
     "backfill_sample_ids",
+    "refresh_uw_encounters",
+    "refresh_materialized_views",
 ]
 
 
@@ -42,6 +45,45 @@ def age_ceiling(age: float, max_age=85) -> float:
     return min(age, max_age)
 
 
+def age_in_years(later: pd.Series, earlier: pd.Series) -> pd.Series:
+    """
+    Column-oriented equivalent of ``relativedelta(later, earlier).years`` for
+    each pair of timestamps in the *later* and *earlier* Series, which must be
+    in the same time zone (if any).
+
+    Like :class:`dateutil.relativedelta.relativedelta`, a day of month past
+    the end of the later month is clipped to the month's end, so someone born
+    on a leap day turns a year older on the 28th of February:
+
+    >>> later = pd.Series(pd.to_datetime(["2023-02-28 00:00", "2023-02-27 00:00", "2020-01-01 12:00", "2019-06-01 00:00"]))
+    >>> earlier = pd.Series(pd.to_datetime(["2020-02-29 00:00", "2020-02-29 00:00", "2000-01-01 13:00", "2020-06-02 00:00"]))
+    >>> age_in_years(later, earlier).tolist()
+    [3, 2, 19, -1]
+    """
+    # Compare wall-clock times, as relativedelta does when adding months to
+    # a timestamp.
+    if later.dt.tz is not None:
+        later = later.dt.tz_localize(None)
+    if earlier.dt.tz is not None:
+        earlier = earlier.dt.tz_localize(None)
+
+    months = (later.dt.year - earlier.dt.year) * 12 + (later.dt.month - earlier.dt.month)
+
+    # *earlier* shifted by *months* lands in the same year and month as
+    # *later*, so only the day of month and time of day need comparing.
+    shifted_day = np.minimum(earlier.dt.day, later.dt.days_in_month)
+    later_time = later - later.dt.normalize()
+    earlier_time = earlier - earlier.dt.normalize()
+
+    before_shifted = (later.dt.day < shifted_day) | ((later.dt.day == shifted_day) & (later_time < earlier_time))
+    after_shifted = (later.dt.day > shifted_day) | ((later.dt.day == shifted_day) & (later_time > earlier_time))
+
+    forward = later >= earlier
+    months = months - (forward & before_shifted) + (~forward & after_shifted)
+
+    return np.sign(months) * (months.abs() // 12)
+
+
 def trim_whitespace(df: pd.DataFrame) -> pd.DataFrame:
     """ Trims leading and trailing whitespace from strings in *df* """
     # Guard against AttributeErrors from entirely empty non-string dtype columns
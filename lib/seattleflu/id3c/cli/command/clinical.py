@@ -20,23 +20,26 @@ import hmac
 import base64
 import json
 import glob
+import sys
+from contextlib import redirect_stdout
 from datetime import datetime, timezone
 from functools import partial
 from math import ceil
-from typing import Optional, List, Dict
+from pathlib import Path
+from typing import Iterable, Optional, List, Dict, TextIO
 from id3c.db.session import DatabaseSession
 from id3c.cli import cli
 from id3c.cli.io.pandas import dump_ndjson, load_file_as_dataframe, read_excel
-from id3c.cli.command.geocode import get_geocoded_address
-from id3c.cli.command.location import location_lookup
 from id3c.cli.command.de_identify import generate_hash
-from id3c.cli.command import pickled_cache
-from dateutil.relativedelta import relativedelta
 from .etl.redcap_map import map_sex
 from .etl.fhir import generate_patient_hash
+from ...db import find_tracts
+from ...geocode import Geocoder, sqlite_cache
+from ...utils import unwrap
 from . import (
     add_provenance,
     age_ceiling,
+    age_in_years,
     barcode_quality_control,
     trim_whitespace,
     group_true_values_into_list,
@@ -48,6 +51,13 @@ PHSKC_IDENTIFIERS = {
     'all_cids': 'phskcCid',
     'phskc_barcode': 'phskcCid',
 }
+PHSKC_ADDRESS_COLUMNS = {
+    'pat_address_line1': 'street',
+    'pat_address_line2': 'secondary',
+    'pat_address_city': 'city',
+    'pat_address_state': 'state',
+    'pat_address_zip': 'zipcode',
+}
 KP2023_IDENTIFIERS = {
     'collection_id': 'kaiserPermanenteSpecimenId'
 }
@@ -594,8 +604,23 @@ def add_kp_manifest_data(df: pd.DataFrame, manifest_filenames: tuple, manifest_f
 @click.argument("file_pattern", metavar = "<PHSKC Clinical Data filename pattern>")
 @click.argument("geocoding_cache_file", envvar = "GEOCODING_CACHE", metavar = "<Geocoding cache filename>",
             type = click.Path(dir_okay=False, writable=True))
-
-def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache_file: str = None) -> None:
+@click.option("--geocoding-workers",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 8,
+    show_default = True,
+    help    = "Geocode up to <n> uncached addresses concurrently")
+@click.option("--manifest-shards",
+    metavar = "<directory>",
+    type    = click.Path(file_okay=False, writable=True),
+    help    = unwrap("""
+        Keep the manifest as one shard per PHSKC file in <directory>, along
+        with an index of each file's last parse and content hash, and only
+        parse and rewrite the shards of changed files.  The <PHSKC Clinical
+        Manifest Data filename> is used only to seed a new <directory>."""))
+
+def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache_file: str = None, geocoding_workers: int = 8,
+                manifest_shards: str = None) -> None:
     """
     Process clinical data from PHSKC.
 
@@ -612,7 +637,20 @@ def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache
 
     All clinical records (both newly and previously parsed data) are output to stdout
     as newline-delimited JSON records. You will likely want to redirect stdout to a file.
+
+    Geocoding results are cached in an SQLite database named after the
+    <Geocoding cache filename> with a .sqlite suffix, created if it does not
+    exist and seeded from the pickled cache of that name used by `id3c geocode`.
+    The pickled cache itself is left unchanged.
+
+    With --manifest-shards, the cost of a run depends only on the files which
+    changed since they were last parsed, and the merged manifest is streamed from
+    the shards.
     """
+    if manifest_shards:
+        parse_phskc_sharded(phskc_manifest_filename, file_pattern, geocoding_cache_file, geocoding_workers, manifest_shards)
+        return
+
     parsed_clinical_records = pd.read_json(phskc_manifest_filename, orient='records', dtype={'inferred_symptomatic': 'string', 'census_tract': 'string', 'age': 'int64'}, lines=True)
     if not parsed_clinical_records.empty:
         parsed_clinical_records.columns = parsed_clinical_records.columns.str.lower()
@@ -632,9 +670,7 @@ def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache
 
         if manifest_records.empty or (last_modified_time > manifest_records['last_parsed']).all():
             LOG.info(f'Parsing `{relative_filename}`, no previous parse or file was last modified more recently than previous parse')
-            clinical_records = pd.read_excel(file, dtype={'inferred_symptomatic': 'str'})
-            clinical_records.columns = clinical_records.columns.str.lower()
-            clinical_records = trim_whitespace(clinical_records)
+            clinical_records = read_phskc_file(file)
         else:
             LOG.debug(f'Skipped parsing of `{relative_filename}`, file has not been modified since last parse')
             continue
@@ -648,7 +684,7 @@ def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache
             continue
 
         clinical_records = add_provenance(clinical_records, relative_filename)
-        clinical_records = format_phskc_data(clinical_records, geocoding_cache_file)
+        clinical_records = format_phskc_data(clinical_records, geocoding_cache_file, geocoding_workers)
 
         # if we don't have any manifest data at all, make these records the new manifest data.
         # if we don't have any manifest data for this file, add parsed data to the dataframe
@@ -667,6 +703,179 @@ def parse_phskc(phskc_manifest_filename: str, file_pattern: str, geocoding_cache
     dump_ndjson(parsed_clinical_records)
 
 
+def parse_phskc_sharded(phskc_manifest_filename: str, file_pattern: str, geocoding_cache_file: str,
+                        geocoding_workers: int, manifest_shards: str) -> None:
+    """
+    Sharded variant of :func:`parse_phskc`, which keeps the manifest in a
+    :class:`ManifestShards` *manifest_shards* directory.
+    """
+    shards = ManifestShards(manifest_shards)
+
+    if not shards.index:
+        shards.seed(phskc_manifest_filename)
+
+    for file in glob.glob(file_pattern):
+        relative_filename = file.split('/')[-1]
+        last_modified_time = os.path.getmtime(file)
+        LOG.debug(f'Working on `{relative_filename}`. Last modified time was {last_modified_time}')
+
+        content_hash = shards.changed(relative_filename, file, last_modified_time)
+
+        if not content_hash:
+            LOG.debug(f'Skipped parsing of `{relative_filename}`, file has not changed since last parse')
+            continue
+
+        LOG.info(f'Parsing `{relative_filename}`, no previous parse or file has changed since previous parse')
+        clinical_records = read_phskc_file(file)
+
+        if clinical_records.empty and relative_filename in shards.index:
+            LOG.warning(
+                f"A previously parsed PHSKC file is now empty: `{relative_filename}`. These records must be removed from the manifest manually.")
+            continue
+        elif clinical_records.empty:
+            LOG.debug(f'Skipped parsing of `{relative_filename}`, file was empty')
+            continue
+
+        clinical_records = add_provenance(clinical_records, relative_filename)
+        clinical_records = format_phskc_data(clinical_records, geocoding_cache_file, geocoding_workers)
+
+        dropped = shards.index.get(relative_filename, {}).get('records', 0)
+        shards.write(relative_filename, clinical_records, content_hash)
+
+        LOG.info(f"Dropped {dropped} and saved {len(clinical_records)} new manifest records")
+
+    shards.save_index()
+
+    LOG.info(f"Dumping {sum(entry['records'] for entry in shards.index.values())} parsed PHSKC records to stdout")
+    shards.dump()
+
+
+def read_phskc_file(filename: str) -> pd.DataFrame:
+    """
+    Reads the PHSKC clinical data file *filename*, lowercasing its column
+    names and trimming whitespace from its values.
+    """
+    clinical_records = pd.read_excel(filename, dtype={'inferred_symptomatic': 'str'})
+    clinical_records.columns = clinical_records.columns.str.lower()
+    return trim_whitespace(clinical_records)
+
+
+class ManifestShards:
+    """
+    A parsed clinical manifest partitioned into one NDJSON shard per source
+    file in *directory*.
+
+    An ``index.json`` file in *directory* records, for each source file in
+    the order it was last parsed, when it was last parsed, the SHA-256 hash
+    of its contents and how many records its shard holds.  Shards and the
+    index are replaced atomically, so an interrupted run leaves the previous
+    shards intact.
+    """
+    INDEX = "index.json"
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents = True, exist_ok = True)
+
+        index = self.directory / self.INDEX
+
+        if index.exists():
+            with index.open(encoding = "utf-8") as file:
+                self.index: Dict[str, dict] = json.load(file)
+        else:
+            self.index = {}
+
+    def shard(self, filename: str) -> Path:
+        return self.directory / f"{filename}.ndjson"
+
+    def seed(self, manifest_filename: str) -> None:
+        """
+        Splits the existing, unsharded manifest *manifest_filename* into
+        shards.  Content hashes of the source files are not known yet, so each
+        is re-checked by :meth:`changed` only if modified since its last parse.
+        """
+        manifest = pd.read_json(manifest_filename, orient='records', dtype={'inferred_symptomatic': 'string', 'census_tract': 'string', 'age': 'int64'}, lines=True)
+
+        if manifest.empty:
+            return
+
+        manifest.columns = manifest.columns.str.lower()
+
+        LOG.info(f"Seeding manifest shards in «{self.directory}» from {len(manifest)} records of «{manifest_filename}»")
+
+        for filename, records in manifest.groupby(manifest._provenance.str['filename'], sort = False):
+            self.write(filename, records, None)
+
+        self.save_index()
+
+    def changed(self, filename: str, path: str, last_modified_time: float) -> Optional[str]:
+        """
+        Returns the SHA-256 hash of the source file at *path* if it has
+        changed since *filename* was last parsed, or ``None`` if it hasn't.
+
+        Files not modified since their last parse aren't read at all.  Files
+        modified since, but whose contents are unchanged, are only marked as
+        parsed again.
+        """
+        entry = self.index.get(filename)
+
+        if entry and last_modified_time <= entry['last_parsed']:
+            return None
+
+        with open(path, "rb") as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+
+        if entry and content_hash == entry['sha256']:
+            entry['last_parsed'] = int(time.time())
+            return None
+
+        return content_hash
+
+    def write(self, filename: str, records: pd.DataFrame, content_hash: Optional[str]) -> None:
+        """
+        Replaces the shard of *filename* with *records*, moving it to the end
+        of the merged manifest as :func:`parse_phskc` would.
+        """
+        shard = self.shard(filename)
+        incomplete = shard.with_name(shard.name + ".partial")
+
+        with incomplete.open("w", encoding = "utf-8") as file, redirect_stdout(file):
+            dump_ndjson(records)
+
+        os.replace(incomplete, shard)
+
+        self.index.pop(filename, None)
+        self.index[filename] = {
+            'last_parsed': int(records['last_parsed'].max()),
+            'sha256': content_hash,
+            'records': len(records),
+        }
+
+    def save_index(self) -> None:
+        index = self.directory / self.INDEX
+        incomplete = index.with_name(index.name + ".partial")
+
+        with incomplete.open("w", encoding = "utf-8") as file:
+            json.dump(self.index, file, indent = 2)
+
+        os.replace(incomplete, index)
+
+    def dump(self, output: TextIO = None) -> None:
+        """
+        Streams the merged manifest of all shards, in index order, to
+        *output* (stdout by default).
+        """
+        output = output or sys.stdout
+
+        for filename in self.index:
+            with self.shard(filename).open(encoding = "utf-8") as shard:
+                for line in shard:
+                    if line.strip():
+                        output.write(line.rstrip("\n") + "\n")
+
+        output.flush()
+
+
 @clinical.command("deduplicate-phskc")
 @click.argument("phskc_manifest_filename", metavar = "<PHSKC Clinical Manifest Data filename>",
             type = click.Path(exists=True, dir_okay=False))
@@ -825,45 +1034,18 @@ def match_phskc(phskc_manifest_new_filename: str, phskc_manifest_unmatched_filen
         dump_ndjson(matched_clinical_records)
 
 
-def format_phskc_data(clinical_records: pd.DataFrame, geocoding_cache_file: str) -> pd.DataFrame:
+def format_phskc_data(clinical_records: pd.DataFrame, geocoding_cache_file: str, geocoding_workers: int = 8) -> pd.DataFrame:
     """
     Formats a DataFrame with PHSKC clinical data in a manner
     suitable to compare with existing PHSKC manifest data.
+
+    Distinct addresses are geocoded by up to *geocoding_workers* threads.
     """
     clinical_records['site'] = 'PHSKC'
     clinical_records['patient_class'] = 'field'
     clinical_records['encounter_status'] = 'finished'
 
-    # generate encounter and individual identifiers for each record
-    clinical_records['individual'] = clinical_records.apply(
-        lambda row: generate_patient_hash(
-            row['pat_name'].split(',')[::-1],
-            map_sex(row['sex']),
-            str(row['birth_date']),
-            str(row["pat_address_zip"])
-        ), axis=1
-    )
-
-    clinical_records['identifier'] = clinical_records.apply(
-        lambda row: generate_hash(
-            f"{row['individual']}{row['collect_ts']}".lower()
-        ), axis=1
-    )
-
-    # localize encounter timestamps to pacific time
-    clinical_records['encountered'] = clinical_records['collect_ts'].dt.tz_localize('America/Los_Angeles')
-
-    # calculate age based on sample collection date and birth day. Localize birth date datetime value to ensure accurate
-    # delta with local collection datetime.
-    clinical_records['birth_date'] = pd.to_datetime(clinical_records['birth_date']).dt.tz_localize('America/Los_Angeles')
-    clinical_records['age'] = clinical_records.apply(
-        lambda row: age_ceiling(
-                relativedelta(
-                    row['encountered'],
-                    row['birth_date']
-                ).years
-            ), axis=1
-    )
+    clinical_records = add_phskc_identifiers(clinical_records)
 
     # fill address NA values with empty strings to prevent geocoding failure, geocode addresses,
     # then hash them and get the census tract to remove PII from downstream processes
@@ -877,27 +1059,14 @@ def format_phskc_data(clinical_records: pd.DataFrame, geocoding_cache_file: str)
         }, inplace=True
     )
 
-    with pickled_cache(geocoding_cache_file) as cache:
+    with sqlite_cache(geocoding_cache_file) as cache:
+        geocoder = Geocoder(cache, max_workers=geocoding_workers)
         clinical_records['lat'], clinical_records['lng'], clinical_records['canonical_address'] = zip(
-            *clinical_records.apply(
-                lambda row: get_geocoded_address(
-                    {
-                        'street': row['pat_address_line1'],
-                        'secondary': row['pat_address_line2'],
-                        'city': row['pat_address_city'],
-                        'state': row['pat_address_state'],
-                        'zipcode': row['pat_address_zip']
-                    },
-                    cache
-                ),
-                axis=1
-            )
+            *geocoder.geocode_all(phskc_addresses(clinical_records))
         )
 
     db = DatabaseSession()
-    clinical_records = clinical_records.apply(
-       lambda row: encode_addresses(db, row), axis=1
-    )
+    clinical_records = encode_addresses(db, clinical_records)
 
     column_map = {
         'ethnic_group': 'ethnicity',
@@ -944,25 +1113,83 @@ def format_phskc_data(clinical_records: pd.DataFrame, geocoding_cache_file: str)
     return clinical_records
 
 
-def encode_addresses(db: DatabaseSession, row: pd.Series) -> pd.Series:
+def add_phskc_identifiers(clinical_records: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the de-identified ``individual`` and ``identifier`` columns to PHSKC
+    *clinical_records*, along with the localized ``encountered`` timestamp and
+    the ``age`` at encounter.
+    """
+    # generate encounter and individual identifiers for each record.  Hashing
+    # is inherently per-record, so build the inputs column-wise and hash them
+    # in a single pass rather than building a Series for every row.
+    sexes = clinical_records['sex'].map({
+        sex: map_sex(sex) for sex in clinical_records['sex'].unique() })
+
+    clinical_records['individual'] = [
+        generate_patient_hash(
+            name.split(',')[::-1],
+            sex,
+            str(birth_date),
+            str(zipcode)
+        )
+        for name, sex, birth_date, zipcode in zip(
+            clinical_records['pat_name'],
+            sexes,
+            clinical_records['birth_date'],
+            clinical_records['pat_address_zip'])
+    ]
+
+    clinical_records['identifier'] = [
+        generate_hash(f"{individual}{collect_ts}".lower())
+            for individual, collect_ts in zip(clinical_records['individual'], clinical_records['collect_ts'])
+    ]
+
+    # localize encounter timestamps to pacific time
+    clinical_records['encountered'] = clinical_records['collect_ts'].dt.tz_localize('America/Los_Angeles')
+
+    # calculate age based on sample collection date and birth day. Localize birth date datetime value to ensure accurate
+    # delta with local collection datetime.
+    clinical_records['birth_date'] = pd.to_datetime(clinical_records['birth_date']).dt.tz_localize('America/Los_Angeles')
+    clinical_records['age'] = age_in_years(
+        clinical_records['encountered'],
+        clinical_records['birth_date']
+    ).map(age_ceiling)
+
+    return clinical_records
+
+
+def phskc_addresses(clinical_records: pd.DataFrame) -> List[dict]:
+    """
+    Returns the address of each of the PHSKC *clinical_records*, as the dicts
+    expected by :class:`seattleflu.id3c.geocode.Geocoder`.
+    """
+    return clinical_records[list(PHSKC_ADDRESS_COLUMNS)] \
+        .rename(columns=PHSKC_ADDRESS_COLUMNS) \
+        .to_dict('records')
+
+
+def encode_addresses(db: DatabaseSession, df: pd.DataFrame) -> pd.DataFrame:
     """
-    Given a series with latitude and longitute data, plus a canonical
+    Given a DataFrame with latitude and longitude columns, plus a canonical
     address, encodes that data into census tract information and hashes
     the address.
+
+    Census tracts are looked up for all distinct coordinates at once.
     """
-    location = location_lookup(db, (row.get('lat'), row.get('lng')), 'tract')
+    df['census_tract'] = find_tracts(db, zip(df['lat'], df['lng']))
+    df['address_hash'] = hash_addresses(df['canonical_address'])
 
-    if location:
-        row['census_tract'] = location.identifier
-    else:
-        row['census_tract'] = None
+    return df
 
-    if row['canonical_address']:
-        row['address_hash'] = generate_hash(row['canonical_address'])
-    else:
-        row['address_hash'] = None
 
-    return row
+def hash_addresses(addresses: Iterable[Optional[str]]) -> List[Optional[str]]:
+    """
+    Returns the hash of each canonical address in *addresses*, or ``None``
+    where there is no address.
+    """
+    return [
+        generate_hash(address) if address else None
+            for address in addresses ]
 
 
 @clinical.command("parse-kp2023")
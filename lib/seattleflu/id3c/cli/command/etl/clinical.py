@@ -3,10 +3,15 @@ Process clinical documents into the relational warehouse.
 """
 import click
 import logging
+import multiprocessing
+import queue
 import re
+import time
 from datetime import datetime, timezone
-from typing import Any, Mapping, Optional, Dict
-from id3c.cli.command import with_database_session
+from more_itertools import chunked
+from psycopg2.extras import execute_values
+from typing import Any, Mapping, Optional, Dict, Iterable, List, Set, Tuple
+from id3c.cli.command import with_database_session, DatabaseSessionAction
 from id3c.db import find_identifier
 from id3c.db.session import DatabaseSession
 from id3c.db.datatypes import Json
@@ -17,9 +22,7 @@ from id3c.cli.command.etl import (
 
     age,
     age_to_delete,
-    find_or_create_site,
     find_sample,
-    find_location,
     update_sample,
     upsert_encounter,
     upsert_individual,
@@ -39,8 +42,9 @@ from id3c.cli.command.etl import (
 from . import race, ethnicity
 from .fhir import *
 from .clinical_retrospectives import *
-from id3c.cli.command.etl.consensus_genome import find_organism
 from .redcap_map import map_symptom
+from ....db import ProcessingLogBuffer
+from ....utils import unwrap
 
 
 LOG = logging.getLogger(__name__)
@@ -54,13 +58,72 @@ LOG = logging.getLogger(__name__)
 # this revision number should be incremented.
 REVISION = 4
 
+# Maps the pathogen (and subtype) of sequencing accessions to the lineage of
+# the matching organism within the warehouse.
+ORGANISM_NAME_MAP = {
+    'rsv-a': 'RSV.A',
+    'rsv-b': 'RSV.B',
+    'hcov19': 'Human_coronavirus.2019',
+    'flu-a::h1n1': 'Influenza.A.H1N1',
+    'flu-a::h3n2': 'Influenza.A.H3N2',
+    'flu-b': 'Influenza.B'
+}
+
+# Number of records claimed by each worker with --jobs, and for which sample
+# origins are prefetched, at a time when not using --batch-size.
+CLAIM_SIZE = 100
 
-@etl.command("clinical", help = __doc__)
-@with_database_session
 
-def etl_clinical(*, db: DatabaseSession):
+@etl.command("clinical", help = __doc__)
+@with_database_session(pass_action = True)
+
+@click.option("--batch-size",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    help    = unwrap("""
+        Process clinical records in chunks of <n>.  Identifiers, samples,
+        sites, and Census tracts are fetched for a whole chunk at once and
+        individuals, encounters, and processing log entries are written back
+        in bulk.  A chunk which fails is rolled back and reprocessed one
+        record at a time.
+
+        Defaults to processing one record at a time."""))
+
+@click.option("--flush-interval",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 1000,
+    show_default = True,
+    help    = unwrap("""
+        Buffer processing log entries in memory and write them to the
+        database in bulk every <n> records."""))
+
+@click.option("--jobs",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 1,
+    show_default = True,
+    help    = unwrap(f"""
+        Process clinical records with <n> parallel workers, each using its
+        own database session.  Workers claim disjoint chunks of --batch-size
+        records (or {CLAIM_SIZE} records without --batch-size) using
+        «for update skip locked».  Each worker commits or rolls back its own
+        transaction when it finishes.  Can't be combined with --prompt."""))
+
+def etl_clinical(*, batch_size: Optional[int], flush_interval: int, jobs: int, db: DatabaseSession, action: DatabaseSessionAction):
     LOG.debug(f"Starting the clinical ETL routine, revision {REVISION}")
 
+    if jobs > 1:
+        if action is DatabaseSessionAction.PROMPT:
+            raise click.UsageError("--prompt can't be used with --jobs")
+
+        run_clinical_workers(
+            jobs           = jobs,
+            batch_size     = batch_size,
+            flush_interval = flush_interval,
+            commit         = action is DatabaseSessionAction.COMMIT)
+        return
+
     # Fetch and iterate over clinical records that aren't processed
     #
     # Rows we fetch are locked for update so that two instances of this
@@ -76,124 +139,504 @@ def etl_clinical(*, db: DatabaseSession):
            for update
         """, (Json([{ "revision": REVISION }]),))
 
-    for record in clinical:
-        with db.savepoint(f"clinical record {record.id}"):
-            LOG.info(f"Processing clinical record {record.id}")
-
-            # Check validity of barcode
-            received_sample_identifier = sample_identifier(db,
-                record.document["barcode"])
-
-            # Skip row if no matching identifier found
-            if received_sample_identifier is None:
-                LOG.info("Skipping due to unknown barcode " + \
-                          f"{record.document['barcode']}")
-                mark_skipped(db, record.id)
-                continue
-
-            # Check sample exists in database
-            sample = find_sample(db,
-                identifier = received_sample_identifier)
-
-            # Skip row if sample does not exist
-            if sample is None:
-                LOG.info("Skipping due to missing sample with identifier " + \
-                            f"{received_sample_identifier}")
-                mark_skipped(db, record.id)
-                continue
-
-            # Most of the time we expect to see existing sites so a
-            # select-first approach makes the most sense to avoid useless
-            # updates.
-            if record.document.get("site"):
-                site = find_or_create_site(db,
-                    identifier = site_identifier(record.document["site"]),
-                    details    = {"type": "retrospective"})
-            else:
-                site = None
-            
-            # Sequencing accession IDs are being loaded into the clinical receiving table, and will
-            # be processed differently than other records, populating only the warehouse.consensus_genome and 
-            # warehouse.genomic_sequence tables with the relevant data.
-            if record.document.get('genbank_accession') or record.document.get('gisaid_accession'):
-                if record.document['pathogen'] == 'flu-a':
-                    record.document['organism'] = record.document['pathogen'] + '::' + record.document['subtype']
-                else:
-                    record.document['organism'] = record.document['pathogen']
-                # Find the matching organism within the warehouse for the reference organism
-                organism_name_map = {
-                    'rsv-a': 'RSV.A',
-                    'rsv-b': 'RSV.B',
-                    'hcov19': 'Human_coronavirus.2019',
-                    'flu-a::h1n1': 'Influenza.A.H1N1',
-                    'flu-a::h3n2': 'Influenza.A.H3N2',
-                    'flu-b': 'Influenza.B'
-                }
-                organism = find_organism(db, organism_name_map[record.document['organism']])
+    processing_log = clinical_processing_log(db, flush_interval)
+    lookups = ReferenceLookups(db)
+
+    # Flush whatever is pending even if we stop with an error so that the log
+    # agrees with the successfully processed records that get committed.
+    try:
+        process_clinical_records(db, processing_log, lookups, clinical, batch_size)
+    finally:
+        processing_log.flush()
+        lookups.log_stats()
+
+
+def run_clinical_workers(jobs: int, batch_size: Optional[int], flush_interval: int, commit: bool) -> None:
+    """
+    Processes unprocessed clinical records with *jobs* parallel worker
+    processes running :func:`clinical_worker` and logs their aggregate
+    progress.
+
+    If any worker fails, the others stop after their current chunk.
+    """
+    # Spawn rather than fork so workers don't inherit our open database
+    # connection.
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+    stop = context.Event()
+
+    workers = [
+        context.Process(
+            name   = f"clinical ETL worker {number}",
+            target = clinical_worker,
+            args   = (number, batch_size, flush_interval, commit, progress, stop))
+        for number in range(1, jobs + 1) ]
+
+    LOG.info(f"Starting {jobs} clinical ETL workers")
+
+    for worker in workers:
+        worker.start()
+
+    started = time.monotonic()
+    processed = 0
+    finished = 0
+
+    while finished < jobs:
+        try:
+            number, count = progress.get(timeout = 5)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+            continue
+
+        if count is None:
+            finished += 1
+            continue
+
+        processed += count
+        elapsed = time.monotonic() - started
+
+        LOG.info(f"Processed {processed:,} clinical records across {jobs} workers ({processed / elapsed:,.1f} records/s)")
+
+    for worker in workers:
+        worker.join()
+
+    failed = [ worker.name for worker in workers if worker.exitcode != 0 ]
+
+    if failed:
+        raise ClinicalWorkerError(f"{len(failed)} of {jobs} clinical ETL workers failed: {', '.join(failed)}")
+
+    LOG.info(f"Finished processing {processed:,} clinical records with {jobs} workers in {time.monotonic() - started:,.1f}s")
+
+
+def clinical_worker(number: int,
+                    batch_size: Optional[int],
+                    flush_interval: int,
+                    commit: bool,
+                    progress: Any,
+                    stop: Any) -> None:
+    """
+    Worker process for :func:`run_clinical_workers`.
+
+    Repeatedly claims the next chunk of unprocessed clinical records not
+    already locked by another worker and processes it on the worker's own
+    database session.  Each claim starts after the last record this worker
+    claimed, so a worker never reclaims its own records.  All work is done in
+    one transaction, which holds the claimed records' locks until it's
+    committed (if *commit* is true) or rolled back at the end.
+
+    The number of records processed per chunk is put on the *progress*
+    queue, followed by ``None`` when the worker is done.
+    """
+    db = DatabaseSession()
+    processing_log = clinical_processing_log(db, flush_interval)
+    lookups = ReferenceLookups(db)
+    claim_size = batch_size or CLAIM_SIZE
+    last_id = 0
+
+    try:
+        try:
+            while not stop.is_set():
+                records = db.fetch_all("""
+                    select clinical_id as id, document
+                      from receiving.clinical
+                     where not processing_log @> %s
+                       and clinical_id > %s
+                     order by id
+                     limit %s
+                       for update skip locked
+                    """, (Json([{ "revision": REVISION }]), last_id, claim_size))
+
+                if not records:
+                    break
+
+                last_id = records[-1].id
+
+                process_clinical_records(db, processing_log, lookups, records, batch_size)
+                progress.put((number, len(records)))
+        finally:
+            processing_log.flush()
+            lookups.log_stats()
+
+    except Exception as error:
+        stop.set()
+        LOG.error(f"Clinical ETL worker {number} aborting with error: {error}")
+        raise
+
+    finally:
+        if commit:
+            LOG.info(f"Clinical ETL worker {number} committing successfully processed records")
+            db.commit()
+        else:
+            LOG.info(f"Clinical ETL worker {number} rolling back all changes")
+            db.rollback()
+
+        progress.put((number, None))
+
+
+def clinical_processing_log(db: DatabaseSession, flush_interval: int) -> ProcessingLogBuffer:
+    """
+    Returns a :class:`ProcessingLogBuffer` for ``receiving.clinical``.
+    """
+    return ProcessingLogBuffer(db,
+        table          = ("receiving", "clinical"),
+        key            = "clinical_id",
+        assignment     = "processing_log = processing_log || log.entry",
+        flush_interval = flush_interval)
+
+
+def process_clinical_records(db: DatabaseSession,
+                             processing_log: ProcessingLogBuffer,
+                             lookups: ReferenceLookups,
+                             records: Iterable[Any],
+                             batch_size: Optional[int]) -> None:
+    """
+    Processes clinical *records* in chunks of *batch_size* or, if no
+    *batch_size* is given, one at a time.
+
+    The *processing_log* is flushed between records or chunks, never within
+    their savepoints.  Reference entities are looked up through the run's
+    *lookups*, which prefetch the sample origins needed to generate FHIR
+    bundles for each chunk.
+    """
+    for chunk in chunked(records, batch_size or CLAIM_SIZE):
+        lookups.sample_origins.prefetch(fhir_bound_barcodes(chunk))
+
+        if batch_size:
+            process_clinical_batch(db, processing_log, lookups, chunk)
+            processing_log.flush_if_full()
+        else:
+            for record in chunk:
+                process_clinical_record(db, processing_log, lookups, record)
+                processing_log.flush_if_full()
+
+
+def process_clinical_record(db: DatabaseSession,
+                            processing_log: ProcessingLogBuffer,
+                            lookups: ReferenceLookups,
+                            record: Any) -> None:
+    """
+    Process a single clinical *record* within its own savepoint.
+    """
+    with db.savepoint(f"clinical record {record.id}"):
+        LOG.info(f"Processing clinical record {record.id}")
+
+        # Check validity of barcode
+        received_sample_identifier = sample_identifier(db,
+            record.document["barcode"])
+
+        # Skip row if no matching identifier found
+        if received_sample_identifier is None:
+            LOG.info("Skipping due to unknown barcode " + \
+                      f"{record.document['barcode']}")
+            mark_skipped(processing_log, record.id)
+            return
+
+        # Check sample exists in database
+        sample = find_sample(db,
+            identifier = received_sample_identifier)
+
+        # Skip row if sample does not exist
+        if sample is None:
+            LOG.info("Skipping due to missing sample with identifier " + \
+                        f"{received_sample_identifier}")
+            mark_skipped(processing_log, record.id)
+            return
+
+        # Most of the time we expect to see existing sites so a
+        # select-first approach makes the most sense to avoid useless
+        # updates.
+        if record.document.get("site"):
+            site = lookups.site(site_identifier(record.document["site"]))
+        else:
+            site = None
+
+        # Sequencing accession IDs are being loaded into the clinical receiving table, and will
+        # be processed differently than other records, populating only the warehouse.consensus_genome and
+        # warehouse.genomic_sequence tables with the relevant data.
+        if is_sequencing_accession(record.document):
+            upsert_sequencing_accession(db, lookups, record.document, sample)
+
+        # PHSKC and KP2023 will be handled differently than other clinical records, converted
+        # to FHIR format and inserted into receiving.fhir table to be processed
+        # by the FHIR ETL. When time allows, SCH and KP should follow suit.
+        elif is_fhir_bound(record.document, site):
+            fhir_bundle = generate_fhir_bundle(db, record.document, site.identifier, lookups)
+            insert_fhir_bundle(db, fhir_bundle)
+
+        else:
+            # Most of the time we expect to see new individuals and new
+            # encounters, so an insert-first approach makes more sense.
+            # Encounters we see more than once are presumed to be
+            # corrections.
+            individual = upsert_individual(db,
+                identifier  = record.document["individual"],
+                sex         = sex(record.document["AssignedSex"]))
+
+            encounter = upsert_encounter(db,
+                identifier      = record.document["identifier"],
+                encountered     = record.document["encountered"],
+                individual_id   = individual.id,
+                site_id         = site.id,
+                age             = age(record.document),
+                details         = encounter_details(record.document))
+
+            sample = update_sample(db,
+                sample = sample,
+                encounter_id = encounter.id)
+
+            # Link encounter to a Census tract, if we have it
+            tract_identifier = census_tract_identifier(record.document)
+
+            if tract_identifier:
+                tract = lookups.tract(tract_identifier)
+                assert tract, f"Tract «{tract_identifier}» is unknown"
+
+                upsert_encounter_location(db,
+                    encounter_id = encounter.id,
+                    relation = "residence",
+                    location_id = tract.id)
+
+        mark_processed(processing_log, record.id, {"status": "processed"})
+
+        LOG.info(f"Finished processing clinical record {record.id}")
+
+
+def process_clinical_batch(db: DatabaseSession,
+                           processing_log: ProcessingLogBuffer,
+                           lookups: ReferenceLookups,
+                           records: List[Any]) -> None:
+    """
+    Process a chunk of clinical *records* using set-based queries.
+
+    The whole chunk is processed within one savepoint.  If anything in it
+    fails, the savepoint is rolled back and the chunk is reprocessed one
+    record at a time with :func:`process_clinical_record`, which isolates the
+    bad record from the rest of the chunk.
+    """
+    first, last = records[0].id, records[-1].id
+
+    try:
+        with db.savepoint(f"clinical records {first} to {last}"):
+            LOG.info(f"Processing {len(records):,} clinical records {first} to {last} in bulk")
+            upsert_clinical_batch(db, processing_log, lookups, records)
+
+    except Exception as error:
+        LOG.warning(
+            f"Bulk processing of clinical records {first} to {last} failed ({error}), "
+            "reprocessing them one at a time")
+
+        for record in records:
+            process_clinical_record(db, processing_log, lookups, record)
+
+    else:
+        LOG.info(f"Finished processing clinical records {first} to {last}")
+
+
+def upsert_clinical_batch(db: DatabaseSession,
+                          processing_log: ProcessingLogBuffer,
+                          lookups: ReferenceLookups,
+                          records: List[Any]) -> None:
+    """
+    Bulk version of the body of :func:`process_clinical_record`.
+
+    Identifiers and samples for all *records* are fetched up front with a
+    few set-based queries, and any sites and Census tracts not yet cached by
+    the run's *lookups* are prefetched.  Individuals, encounters,
+    sample links, and encounter locations are then written back with one
+    statement each, and processing log entries are added to the
+    *processing_log* buffer.  Sequencing accessions and
+    FHIR-bound records are still processed one at a time, but using the
+    prefetched sample and site.
+
+    Any record which can't be processed raises an exception, which fails the
+    whole batch.
+    """
+    documents = [ record.document for record in records ]
+
+    identifiers = find_identifiers(db,
+        { document["barcode"] for document in documents if document.get("barcode") })
+
+    samples = find_samples(db,
+        { identifier.uuid for identifier in identifiers.values() })
+
+    lookups.prefetch_sites(
+        { site_identifier(document["site"]) for document in documents if document.get("site") })
+
+    lookups.prefetch_tracts(
+        set(filter(None, map(census_tract_identifier, documents))))
+
+    log_entries: List[Tuple[int, Mapping]] = []
+    individuals: Dict[str, Optional[str]] = {}
+    encounters: Dict[str, dict] = {}
+    sample_links: List[Tuple[str, Any, Any]] = []
+
+    for record in records:
+        document = record.document
+
+        identifier = identifiers.get((document.get("barcode") or "").lower())
+
+        if identifier is None:
+            LOG.info(f"Skipping clinical record {record.id} due to unknown barcode {document['barcode']}")
+            log_entries.append((record.id, { "status": "skipped" }))
+            continue
+
+        assert identifier.set_name == "samples" or \
+            identifier.set_name == "collections-seattleflu.org", \
+            f"Identifier found in set «{identifier.set_name}», not «samples»"
 
-                assert organism, f"No organism found with name «{record.document['pathogen']}»"
+        sample = samples.get(identifier.uuid)
 
-                # Most of the time we expect to see new sequences, so an
-                # insert-first approach makes the most sense to avoid useless
-                # queries.
-                genome = upsert_genome(db,
-                    sample = sample,
-                    organism = organism)
+        if sample is None:
+            LOG.info(f"Skipping clinical record {record.id} due to missing sample with identifier {identifier.uuid}")
+            log_entries.append((record.id, { "status": "skipped" }))
+            continue
 
-                genomic_sequence = upsert_genomic_sequence(db,
-                    genome = genome,
-                    details = record.document)
+        site = lookups.site(site_identifier(document["site"])) if document.get("site") else None
 
+        if is_sequencing_accession(document):
+            upsert_sequencing_accession(db, lookups, document, sample)
 
+        elif is_fhir_bound(document, site):
+            fhir_bundle = generate_fhir_bundle(db, document, site.identifier, lookups)
+            insert_fhir_bundle(db, fhir_bundle)
 
-            # PHSKC and KP2023 will be handled differently than other clinical records, converted
-            # to FHIR format and inserted into receiving.fhir table to be processed
-            # by the FHIR ETL. When time allows, SCH and KP should follow suit.
-            # Since KP2023 and KP samples both have KaiserPermanente as their site in id3c,
-            # use the ndjson document's site to distinguish KP vs KP2023 samples
-            elif site and (site.identifier == 'RetrospectivePHSKC' or record.document["site"].upper() == 'KP2023'):
-                fhir_bundle = generate_fhir_bundle(db, record.document, site.identifier)
-                insert_fhir_bundle(db, fhir_bundle)
+        else:
+            tract_identifier = census_tract_identifier(document)
 
+            if tract_identifier:
+                tract = lookups.tract(tract_identifier)
+                assert tract, f"Tract «{tract_identifier}» is unknown"
             else:
-                # Most of the time we expect to see new individuals and new
-                # encounters, so an insert-first approach makes more sense.
-                # Encounters we see more than once are presumed to be
-                # corrections.
-                individual = upsert_individual(db,
-                    identifier  = record.document["individual"],
-                    sex         = sex(record.document["AssignedSex"]))
+                tract = None
+
+            # Later records for the same individual or encounter win, just
+            # as they would when processed one at a time.
+            individuals[document["individual"]] = sex(document["AssignedSex"])
+
+            encounters[document["identifier"]] = {
+                "identifier": document["identifier"],
+                "encountered": document["encountered"],
+                "individual": document["individual"],
+                "site_id": site.id,
+                "age": age(document),
+                "details": encounter_details(document),
+            }
+
+            sample_links.append((document["identifier"], sample, tract))
+
+        log_entries.append((record.id, { "status": "processed" }))
+
+    if encounters:
+        individual_ids = upsert_individuals(db, individuals)
+
+        encounter_ids = upsert_encounters(db, [
+            { **encounter, "individual_id": individual_ids[encounter["individual"]] }
+                for encounter in encounters.values() ])
+
+        sample_encounters: Dict[int, int] = {}
+        encounter_locations: Dict[int, int] = {}
+
+        for encounter_identifier, sample, tract in sample_links:
+            encounter_id = encounter_ids[encounter_identifier]
+
+            assert sample.encounter_id in {None, encounter_id}, \
+                f"Sample {sample.id} is already linked to encounter {sample.encounter_id}"
+
+            sample_encounters[sample.id] = encounter_id
+
+            if tract:
+                encounter_locations[encounter_id] = tract.id
+
+        update_samples(db, sample_encounters)
+        upsert_encounter_locations(db, "residence", encounter_locations)
+
+    # Only buffer log entries once everything else has succeeded, so a failed
+    # batch leaves nothing behind in the buffer.
+    for clinical_id, entry in log_entries:
+        mark_processed(processing_log, clinical_id, entry)
+
+
+def is_sequencing_accession(document: dict) -> bool:
+    """
+    Returns True if the clinical *document* holds sequencing accession IDs.
+    """
+    return bool(document.get('genbank_accession') or document.get('gisaid_accession'))
+
 
-                encounter = upsert_encounter(db,
-                    identifier      = record.document["identifier"],
-                    encountered     = record.document["encountered"],
-                    individual_id   = individual.id,
-                    site_id         = site.id,
-                    age             = age(record.document),
-                    details         = encounter_details(record.document))
+def is_fhir_bound(document: dict, site: Any) -> bool:
+    """
+    Returns True if the clinical *document* from *site* should be converted
+    into a FHIR bundle instead of being processed directly.
 
-                sample = update_sample(db,
-                    sample = sample,
-                    encounter_id = encounter.id)
+    Since KP2023 and KP samples both have KaiserPermanente as their site in
+    ID3C, the document's own site is used to distinguish KP2023 samples.
+    """
+    return bool(site) and (site.identifier == 'RetrospectivePHSKC' or document["site"].upper() == 'KP2023')
 
-                # Link encounter to a Census tract, if we have it
-                tract_identifier = record.document.get("census_tract")
 
-                if tract_identifier:
-                    # Special-case float-like identifiers in earlier date
-                    tract_identifier = re.sub(r'\.0$', '', str(tract_identifier))
+def fhir_bound_barcodes(records: List[Any]) -> Set[str]:
+    """
+    Returns the barcodes of the clinical *records* which will be converted
+    into FHIR bundles.
+
+    This judges by the site name alone, like :func:`is_fhir_bound` does for
+    KP2023, so that records with unknown sites are left to fail when they're
+    processed instead of here.
+    """
+    return {
+        record.document["barcode"]
+            for record in records
+             if record.document.get("barcode")
+            and str(record.document.get("site") or "").upper() in {"PHSKC", "KP2023"} }
+
+
+def census_tract_identifier(document: dict) -> Optional[str]:
+    """
+    Returns the Census tract identifier of a clinical *document*, if it has
+    one.
 
-                    tract = find_location(db, "tract", tract_identifier)
-                    assert tract, f"Tract «{tract_identifier}» is unknown"
+    Float-like identifiers from earlier data are special-cased:
+
+    >>> census_tract_identifier({"census_tract": 53033005301.0})
+    '53033005301'
+    >>> census_tract_identifier({"census_tract": "53033005301"})
+    '53033005301'
+    >>> census_tract_identifier({}) is None
+    True
+    """
+    tract_identifier = document.get("census_tract")
+
+    if not tract_identifier:
+        return None
+
+    return re.sub(r'\.0$', '', str(tract_identifier))
+
+
+def upsert_sequencing_accession(db: DatabaseSession, lookups: ReferenceLookups, document: dict, sample: Any) -> None:
+    """
+    Upserts the consensus genome and genomic sequence described by the
+    sequencing accession *document* for *sample*.
+    """
+    if document['pathogen'] == 'flu-a':
+        document['organism'] = document['pathogen'] + '::' + document['subtype']
+    else:
+        document['organism'] = document['pathogen']
+    # Find the matching organism within the warehouse for the reference organism
+    organism = lookups.organism(ORGANISM_NAME_MAP[document['organism']])
 
-                    upsert_encounter_location(db,
-                        encounter_id = encounter.id,
-                        relation = "residence",
-                        location_id = tract.id)
+    assert organism, f"No organism found with name «{document['pathogen']}»"
 
-            mark_processed(db, record.id, {"status": "processed"})
+    # Most of the time we expect to see new sequences, so an
+    # insert-first approach makes the most sense to avoid useless
+    # queries.
+    genome = upsert_genome(db,
+        sample = sample,
+        organism = organism)
 
-            LOG.info(f"Finished processing clinical record {record.id}")
+    upsert_genomic_sequence(db,
+        genome = genome,
+        details = document)
 
 
 def upsert_genome(db: DatabaseSession, sample: MinimalSampleRecord, organism: OrganismRecord) -> GenomeRecord:
@@ -275,9 +718,10 @@ def upsert_genomic_sequence(db: DatabaseSession, genome: GenomeRecord, details:
 def create_encounter(db: DatabaseSession,
                      record: dict,
                      patient_reference: dict,
-                     location_references: list) -> Optional[tuple]:
+                     location_references: list,
+                     lookups: ReferenceLookups = None) -> Optional[tuple]:
     """ Returns a FHIR Encounter resource entry and reference """
-    encounter_location_references = create_encounter_location_references(db, record, location_references)
+    encounter_location_references = create_encounter_location_references(db, record, location_references, lookups)
 
     if not encounter_location_references:
         return None, None
@@ -347,7 +791,7 @@ def determine_questionnaire_items(record: dict) -> List[dict]:
     return questionnaire_items
 
 
-def generate_fhir_bundle(db: DatabaseSession, record: dict, site_id: str) -> Optional[dict]:
+def generate_fhir_bundle(db: DatabaseSession, record: dict, site_id: str, lookups: ReferenceLookups = None) -> Optional[dict]:
 
     patient_entry, patient_reference = create_patient(record)
 
@@ -368,7 +812,7 @@ def generate_fhir_bundle(db: DatabaseSession, record: dict, site_id: str) -> Opt
     else:
         LOG.warning(f'Function generate_fhir_bundle does not currently create location resource entries for site {site_id}')
 
-    encounter_entry, encounter_reference = create_encounter(db, record, patient_reference, location_references)
+    encounter_entry, encounter_reference = create_encounter(db, record, patient_reference, location_references, lookups)
 
     if not encounter_entry:
         LOG.info("Skipping clinical data pull with insufficient information to construct encounter")
@@ -1843,29 +2287,170 @@ def sample_identifier(db: DatabaseSession, barcode: str) -> Optional[str]:
 
     return identifier.uuid if identifier else None
 
-def mark_skipped(db, clinical_id: int) -> None:
+def find_identifiers(db: DatabaseSession, barcodes: Set[str]) -> Dict[str, Any]:
+    """
+    Bulk version of :func:`id3c.db.find_identifier`.
+
+    Returns a mapping of lowercased barcode to identifier for the known
+    *barcodes*.
+    """
+    LOG.debug(f"Looking up {len(barcodes):,} barcodes")
+
+    identifiers = db.fetch_all("""
+        select uuid::text,
+               barcode,
+               identifier_set.name as set_name
+          from warehouse.identifier
+          join warehouse.identifier_set using (identifier_set_id)
+         where barcode = any(%s::citext[])
+        """, (list(barcodes),))
+
+    return { identifier.barcode.lower(): identifier for identifier in identifiers }
+
+
+def find_samples(db: DatabaseSession, identifiers: Set[str]) -> Dict[str, Any]:
+    """
+    Bulk version of :func:`id3c.cli.command.etl.find_sample`.
+
+    Returns a mapping of sample or collection identifier to sample for the
+    known *identifiers*.  Samples are locked for update.
+    """
+    LOG.debug(f"Looking up {len(identifiers):,} samples")
+
+    samples = db.fetch_all("""
+        select sample_id as id, identifier, collection_identifier, encounter_id
+          from warehouse.sample
+         where identifier = any(%s) or collection_identifier = any(%s)
+           for update
+        """, (list(identifiers), list(identifiers)))
+
+    by_identifier = {}
+
+    for sample in samples:
+        if sample.collection_identifier:
+            by_identifier[sample.collection_identifier] = sample
+        by_identifier[sample.identifier] = sample
+
+    return by_identifier
+
+
+def upsert_individuals(db: DatabaseSession, individuals: Mapping[str, Optional[str]]) -> Dict[str, int]:
+    """
+    Bulk version of :func:`id3c.cli.command.etl.upsert_individual`.
+
+    Takes a mapping of identifier to sex and returns a mapping of identifier
+    to individual id.
+    """
+    LOG.debug(f"Upserting {len(individuals):,} individuals")
+
+    with db.cursor() as cursor:
+        upserted = execute_values(cursor, """
+            insert into warehouse.individual (identifier, sex)
+            values %s
+
+            on conflict (identifier) do update
+                set sex = excluded.sex
+
+            returning individual_id as id, identifier
+            """, list(individuals.items()), fetch = True)
+
+    assert len(upserted) == len(individuals), "Upsert affected fewer rows than expected!"
+
+    return { individual.identifier: individual.id for individual in upserted }
+
+
+def upsert_encounters(db: DatabaseSession, encounters: List[dict]) -> Dict[str, int]:
+    """
+    Bulk version of :func:`id3c.cli.command.etl.upsert_encounter`.
+
+    Takes a list of encounters with unique identifiers and returns a mapping
+    of identifier to encounter id.
+    """
+    LOG.debug(f"Upserting {len(encounters):,} encounters")
+
+    rows = [
+        (e["identifier"], e["encountered"], e["individual_id"], e["site_id"], e["age"], Json(e["details"]))
+            for e in encounters ]
+
+    with db.cursor() as cursor:
+        upserted = execute_values(cursor, """
+            insert into warehouse.encounter (identifier, encountered, individual_id, site_id, age, details)
+            values %s
+
+            on conflict (identifier) do update
+                set encountered   = excluded.encountered,
+                    individual_id = excluded.individual_id,
+                    site_id       = excluded.site_id,
+                    age           = excluded.age,
+                    details       = excluded.details
+
+            returning encounter_id as id, identifier
+            """, rows, fetch = True)
+
+    assert len(upserted) == len(encounters), "Upsert affected fewer rows than expected!"
+
+    return { encounter.identifier: encounter.id for encounter in upserted }
+
+
+def update_samples(db: DatabaseSession, sample_encounters: Mapping[int, int]) -> None:
+    """
+    Bulk version of :func:`id3c.cli.command.etl.update_sample`.
+
+    Takes a mapping of sample id to the encounter id it should be linked to.
+    """
+    LOG.debug(f"Linking {len(sample_encounters):,} samples to encounters")
+
+    with db.cursor() as cursor:
+        execute_values(cursor, """
+            update warehouse.sample
+               set encounter_id = batch.encounter_id
+              from (values %s) as batch (sample_id, encounter_id)
+             where sample.sample_id = batch.sample_id
+            """, list(sample_encounters.items()), template = "(%s::integer, %s::integer)")
+
+
+def upsert_encounter_locations(db: DatabaseSession, relation: str, encounter_locations: Mapping[int, int]) -> None:
+    """
+    Bulk version of :func:`id3c.cli.command.etl.upsert_encounter_location`.
+
+    Takes a *relation* and a mapping of encounter id to location id.
+    """
+    if not encounter_locations:
+        return
+
+    LOG.debug(f"Upserting {len(encounter_locations):,} {relation} encounter locations")
+
+    with db.cursor() as cursor:
+        execute_values(cursor, """
+            insert into warehouse.encounter_location (encounter_id, relation, location_id)
+            values %s
+
+            on conflict (encounter_id, relation) do update
+                set location_id = excluded.location_id
+            """, [
+                (encounter_id, relation, location_id)
+                    for encounter_id, location_id in encounter_locations.items() ])
+
+
+def mark_skipped(processing_log: ProcessingLogBuffer, clinical_id: int) -> None:
     LOG.debug(f"Marking clinical record {clinical_id} as skipped")
-    mark_processed(db, clinical_id, { "status": "skipped" })
+    mark_processed(processing_log, clinical_id, { "status": "skipped" })
 
 
-def mark_processed(db, clinical_id: int, entry: Mapping) -> None:
+def mark_processed(processing_log: ProcessingLogBuffer, clinical_id: int, entry: Mapping) -> None:
     LOG.debug(f"Marking clinical document {clinical_id} as processed")
 
-    data = {
-        "clinical_id": clinical_id,
-        "log_entry": Json({
-            **entry,
-            "revision": REVISION,
-            "timestamp": datetime.now(timezone.utc),
-        }),
-    }
+    processing_log.append(clinical_id, {
+        **entry,
+        "revision": REVISION,
+        "timestamp": datetime.now(timezone.utc),
+    })
 
-    with db.cursor() as cursor:
-        cursor.execute("""
-            update receiving.clinical
-               set processing_log = processing_log || %(log_entry)s
-             where clinical_id = %(clinical_id)s
-            """, data)
+class ClinicalWorkerError(RuntimeError):
+    """
+    Raised by :function: `run_clinical_workers` if any of its workers failed
+    """
+    pass
 
 class UnknownVaccine(ValueError):
     """
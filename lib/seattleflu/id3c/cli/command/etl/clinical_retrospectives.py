@@ -4,9 +4,12 @@ into FHIR bundles
 """
 import logging
 import re
-from typing import Optional, Dict, Callable, Any
-from cachetools import TTLCache
+from collections import Counter, defaultdict
+from typing import Optional, Dict, Callable, Any, Hashable, Iterable, Set
+from cachetools import LRUCache, TTLCache
 from id3c.db.session import DatabaseSession
+from id3c.cli.command.etl import find_or_create_site, find_location
+from id3c.cli.command.etl.consensus_genome import find_organism
 from id3c.cli.command.location import location_lookup
 from id3c.cli.command.geocode import get_geocoded_address
 from . import standardize_whitespace
@@ -18,6 +21,191 @@ LOG = logging.getLogger(__name__)
 SFS = "https://seattleflu.org"
 
 
+class ReferenceLookups:
+    """
+    Run-scoped, memoizing lookups of reference entities, such as organisms,
+    sites, and Census tracts, which are shared by many records.
+
+    Each distinct entity is looked up in the database at most once per run.
+    Hits and misses are counted per kind of entity and can be logged with
+    :meth:`log_stats` at the end of the run.
+
+    Lookup results are cached even if nothing was found, except for sites:
+    newly created sites aren't cached as the savepoint they're created in may
+    yet be rolled back.
+    """
+    def __init__(self, db: DatabaseSession):
+        self.db = db
+        self.cache: Dict[str, Dict[Hashable, Any]] = defaultdict(dict)
+        self.hits: Counter = Counter()
+        self.misses: Counter = Counter()
+        self.sample_origins = SampleOriginResolver(db)
+
+    def memoize(self, kind: str, key: Hashable, lookup: Callable[[], Any]) -> Any:
+        """
+        Returns the cached *kind* of entity for *key*, calling *lookup* to
+        find it if it's not yet cached.
+        """
+        cache = self.cache[kind]
+
+        if key in cache:
+            self.hits[kind] += 1
+            return cache[key]
+
+        self.misses[kind] += 1
+        cache[key] = lookup()
+
+        return cache[key]
+
+    def organism(self, lineage: str) -> Any:
+        """
+        Memoized :func:`id3c.cli.command.etl.consensus_genome.find_organism`.
+        """
+        return self.memoize("organism", lineage, lambda: find_organism(self.db, lineage))
+
+    def site(self, identifier: str, details: dict = None) -> Any:
+        """
+        Memoized :func:`id3c.cli.command.etl.find_or_create_site`.
+
+        Sites which need creating are created with *details*, which default
+        to those of a retrospective site.
+        """
+        site = self.memoize("site", identifier, lambda: self.db.fetch_row("""
+            select site_id as id, identifier
+              from warehouse.site
+             where identifier = %s
+            """, (identifier,)))
+
+        if site is None:
+            del self.cache["site"][identifier]
+            site = find_or_create_site(self.db,
+                identifier = identifier,
+                details    = details or {"type": "retrospective"})
+
+        return site
+
+    def tract(self, identifier: str) -> Any:
+        """
+        Memoized :func:`id3c.cli.command.etl.find_location` for Census tracts.
+        """
+        return self.memoize("tract", identifier, lambda: find_location(self.db, "tract", identifier))
+
+    def prefetch_sites(self, identifiers: Set[str]) -> None:
+        """
+        Caches all existing sites among *identifiers* with one query.
+        """
+        missing = identifiers - self.cache["site"].keys()
+
+        if not missing:
+            return
+
+        self.misses["site"] += len(missing)
+
+        sites = self.db.fetch_all("""
+            select site_id as id, identifier
+              from warehouse.site
+             where identifier = any(%s)
+            """, (list(missing),))
+
+        self.cache["site"].update({ site.identifier: site for site in sites })
+
+    def prefetch_tracts(self, identifiers: Set[str]) -> None:
+        """
+        Caches the Census tracts for all *identifiers* with one query.
+        Unknown tracts are cached as ``None``.
+        """
+        missing = identifiers - self.cache["tract"].keys()
+
+        if not missing:
+            return
+
+        self.misses["tract"] += len(missing)
+
+        tracts = self.db.fetch_all("""
+            select location_id as id, scale, identifier, hierarchy
+              from warehouse.location
+             where scale = 'tract' and identifier = any(%s)
+            """, (list(missing),))
+
+        self.cache["tract"].update(dict.fromkeys(missing))
+        self.cache["tract"].update({ tract.identifier: tract for tract in tracts })
+
+    def log_stats(self) -> None:
+        """
+        Logs hit and miss counts for each kind of entity looked up.
+        """
+        for kind in sorted(self.hits.keys() | self.misses.keys()):
+            LOG.info(f"Reference lookups of {kind}: {self.hits[kind]:,} hits, {self.misses[kind]:,} misses")
+
+        self.sample_origins.log_stats()
+
+
+class SampleOriginResolver:
+    """
+    Resolves the ``sample_origin`` of samples by barcode, like
+    :func:`find_sample_origin_by_barcode`, for many records.
+
+    :meth:`prefetch` fetches the samples for a whole batch of barcodes with
+    one query.  Samples are kept in a bounded LRU cache of *maxsize*
+    barcodes, from which barcodes seen before are resolved without a query.
+    """
+    def __init__(self, db: DatabaseSession, maxsize: int = 10_000):
+        self.db = db
+        self.cache: LRUCache[str, Optional[Any]] = LRUCache(maxsize = maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, barcodes: Iterable[str]) -> None:
+        """
+        Fetches and caches the samples of all *barcodes* not yet cached.
+        Barcodes without a sample are cached as such.
+        """
+        missing = { barcode.lower() for barcode in barcodes if barcode } - self.cache.keys()
+
+        if not missing:
+            return
+
+        self.misses += len(missing)
+
+        LOG.debug(f"Prefetching sample origins for {len(missing):,} barcodes")
+
+        samples = self.db.fetch_all("""
+            select lower(barcode) as barcode, details ->> 'sample_origin' as sample_origin
+            from warehouse.sample
+            join warehouse.identifier on sample.identifier = identifier.uuid::text
+            where barcode = any(%s::citext[])
+        """, (list(missing),))
+
+        # Cache the barcodes without a sample first, so the found samples
+        # aren't the ones evicted if the batch is larger than the cache.
+        for barcode in missing - { sample.barcode for sample in samples }:
+            self.cache[barcode] = None
+
+        for sample in samples:
+            self.cache[sample.barcode] = sample
+
+    def __call__(self, barcode: str) -> Optional[str]:
+        """
+        Given an SFS *barcode* return the `sample_origin` found in
+        sample.details
+        """
+        key = barcode.lower()
+
+        if key in self.cache:
+            self.hits += 1
+        else:
+            self.prefetch([barcode])
+
+        return checked_sample_origin(barcode, self.cache.get(key))
+
+    def log_stats(self) -> None:
+        """
+        Logs hit and miss counts for the sample origins resolved.
+        """
+        if self.hits or self.misses:
+            LOG.info(f"Reference lookups of sample origin: {self.hits:,} hits, {self.misses:,} misses")
+
+
 def create_specimen(record: dict, patient_reference: dict) -> tuple:
     """ Returns a FHIR Specimen resource entry and reference. """
     barcode = record["barcode"]
@@ -42,6 +230,14 @@ def find_sample_origin_by_barcode(db: DatabaseSession, barcode: str) -> Optional
         where barcode = %s
     """, (barcode,))
 
+    return checked_sample_origin(barcode, sample)
+
+
+def checked_sample_origin(barcode: str, sample: Any) -> Optional[str]:
+    """
+    Returns the `sample_origin` of the *sample* found for *barcode*, if any,
+    logging why not otherwise.
+    """
     if not sample:
         LOG.error(f"No sample with barcode «{barcode}» found.")
         return None
@@ -53,9 +249,20 @@ def find_sample_origin_by_barcode(db: DatabaseSession, barcode: str) -> Optional
     return sample.sample_origin
 
 
-def create_encounter_location_references(db: DatabaseSession, record: dict, resident_locations: list = None) -> Optional[list]:
-    """ Returns FHIR Encounter location references """
-    sample_origin = find_sample_origin_by_barcode(db, record["barcode"])
+def create_encounter_location_references(db: DatabaseSession,
+                                         record: dict,
+                                         resident_locations: list = None,
+                                         lookups: ReferenceLookups = None) -> Optional[list]:
+    """
+    Returns FHIR Encounter location references
+
+    Sample origins are resolved through *lookups*, if given, which may have
+    prefetched them.
+    """
+    if lookups:
+        sample_origin = lookups.sample_origins(record["barcode"])
+    else:
+        sample_origin = find_sample_origin_by_barcode(db, record["barcode"])
 
     if not sample_origin:
         return None
@@ -18,6 +18,10 @@ LOG = logging.getLogger(__name__)
 
 SFS = "https://seattleflu.org"
 
+# Python's core "re" module doesn't support Unicode property classes
+NON_WORD_CHARS = regex.compile(r'[^\s\p{Alphabetic}\p{Mark}\p{Decimal_Number}\p{Join_Control}]')
+WHITESPACE = regex.compile(r'\s+')
+
 class Resource(TypedDict):
     resourceType: str
     id: str
@@ -509,6 +513,13 @@ def generate_full_url_uuid() -> str:
     return f"urn:uuid:{uuid4()}"
 
 
+class PersonalInformation(NamedTuple):
+    name: str
+    gender: str
+    birth_date: str
+    postal_code: str
+
+
 def generate_patient_hash(names: Iterable[str], gender: str, birth_date: str, postal_code: str) -> str:
     """
     Creates a likely-to-be unique, unreversible hash from the *names*,
@@ -517,12 +528,6 @@ def generate_patient_hash(names: Iterable[str], gender: str, birth_date: str, po
     Used in FHIR Patient resources as an identifier, which ultimately winds up
     in ID3C's ``warehouse.individual.identifier`` column.
     """
-    class PersonalInformation(NamedTuple):
-        name: str
-        gender: str
-        birth_date: str
-        postal_code: str
-
     personal_information = PersonalInformation(
         canonicalize_name(*names),
         gender,
@@ -567,11 +572,10 @@ def canonicalize_name(*parts: Iterable[str]) -> str:
     'LAZYDOG'
     """
     def remove_non_word_chars(part):
-        # Python's core "re" module doesn't support Unicode property classes
-        return regex.sub(r'[^\s\p{Alphabetic}\p{Mark}\p{Decimal_Number}\p{Join_Control}]', "", part)
+        return NON_WORD_CHARS.sub("", part)
 
     def collapse_whitespace(part):
-        return regex.sub(r'\s+', " ", part)
+        return WHITESPACE.sub(" ", part)
 
     def canonicalize(part):
         return collapse_whitespace(remove_non_word_chars(part)).strip().upper()
@@ -7,22 +7,41 @@ queue based on the testing capacity quotas for the given time period.
 This command is idempotent and can be safely re-run to e.g. pickup a missed
 cronjob or troubleshoot or fix bugs.  Running the command more than once won't
 release extra tests above the quota.
+
+Quota is reserved for offers before REDCap is updated and any left unused is
+released afterwards, each in a short transaction of its own which is committed
+immediately, even with --prompt, since offers made in REDCap can't be rolled
+back.  The priority queue is likewise rescored in a transaction of its own, so
+neither the quota nor the queue is locked while REDCap is updated.  Runs of
+this command are still serialized by an advisory lock, so concurrent runs
+don't offer testing to the same individuals.
+
+Offers are sent to REDCap in concurrent batches with --jobs, and batches which
+fail with transient errors are retried.  Records whose offers still fail stay
+in the queue for the next run.
+
+Each batch of offers made is recorded in operations.test_offer, along with
+synthetic DETs, as soon as REDCap accepts it.  These are also committed
+immediately, so the ledger keeps offers made even if the rest of the run is
+rolled back.  Individuals offered testing in the last few days are skipped
+even if the REDCap records updated for them haven't been imported yet.
 """
 import click
 import enum
 import json
 import logging
 import os
+from contextlib import contextmanager
 from datetime import date, datetime
-from more_itertools import bucket, chunked
-from psycopg2.extras import execute_values
-from typing import List
+from more_itertools import bucket
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from id3c.cli import cli
 from id3c.cli.command import with_database_session, DatabaseSessionAction
 from id3c.cli.redcap import Project, InstrumentStatus, det
-from id3c.db.datatypes import Json
 from id3c.db.session import DatabaseSession
-from id3c.json import dump_ndjson
+from id3c.json import as_json, dump_ndjson
+from ...db import copy_rows
+from ...redcap import update_records
 from ...utils import unwrap
 
 
@@ -32,6 +51,7 @@ STUDY_START_DATE = date(2021, 9, 9)
 
 TESTING_INSTRUMENT = "testing_determination_internal"
 
+# Initial number of records per REDCap update, adjusted to response times.
 REDCAP_BATCH_SIZE = 150
 
 
@@ -54,7 +74,14 @@ REDCAP_BATCH_SIZE = 150
     help    = "Write REDCap offers of testing to stdout as an NDJSON stream.",
     default = False)
 
-def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action: DatabaseSessionAction):
+@click.option("--jobs",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 4,
+    show_default = True,
+    help    = "Send up to <n> batches of offers to REDCap at once.")
+
+def offer_uw_testing(*, at: str, log_offers: bool, jobs: int, db: DatabaseSession, action: DatabaseSessionAction):
     LOG.debug(f"Offering UW Husky Coronavirus Testing @ {at}")
 
     dry_run = action is DatabaseSessionAction.DRY_RUN
@@ -70,8 +97,15 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
     # that's preferrable, so decided not to implement as a ledger right now.
     #   -trs, 17 Sept & 13 Oct 2020
 
-    # Lookup the quota for the current time, locking it for update at the end
-    # after we make offers.
+    # Serialize runs of this command until this transaction ends, so that
+    # concurrent runs don't offer testing to the same individuals at the head
+    # of the queue.
+    db.fetch_row("""
+        select pg_advisory_xact_lock(hashtext('offer-uw-testing'))
+        """)
+
+    # Lookup the quota for the current time.  It's only locked later, briefly,
+    # to reserve and release the quota for our offers.
     #
     # XXX TODO: As a future improvement, automatically pick up any remaining
     # quota left from _past_ timespans in the current day.
@@ -87,7 +121,6 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
             operations.test_quota
         where
             name = 'uw' and timespan @> timestamp with time zone %s
-        for update
         """, (at,))
 
     if not quota:
@@ -102,15 +135,25 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
         f"Quota for {quota.name} during {quota.timespan} "
         f"is now {quota.remaining:,} = {quota.max:,} - {quota.used:,} (remaining = max - used)")
 
+    # Rescore the individuals whose data changed since the queue was last
+    # refreshed, so the queue is as current as shipping.uw_priority_queue_v1.
+    # This locks the queue against concurrent rescoring until committed.
+    with committed_session(db, dry_run) as session:
+        rescored = session.fetch_row("""
+            select shipping.refresh_uw_priority_queue() as count
+            """)
+
+    LOG.info(f"Rescored {rescored.count:,} individuals in the priority queue")
+
     # Offer testing to the top entries in our priority queue.
     #
-    # Disabling parallel queries here, which were occasionally getting stuck with
-    # wait event `IPC: Message Queue Send`. Setting work_mem higher to use memory instead
-    # of disk for sorting and hash tables
-
+    # This is the order of shipping.uw_priority_queue_v1, which is indexed by
+    # the queue table.  Individuals we offered testing recently are skipped,
+    # as the queue only knows of offers once REDCap's records are imported.
+    # The window matches the queue's own 3 days between invites.
     next_in_queue = db.fetch_all("""
-        set local work_mem = '64MB';
         select
+            individual,
             redcap_url,
             redcap_project_id,
             redcap_record_id,
@@ -119,7 +162,21 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
             priority,
             priority_reason
         from
-            shipping.uw_priority_queue_v1
+            shipping.__uw_priority_queue
+        where
+            not exists (
+                select
+                from
+                    operations.test_offer
+                where
+                    test_offer.individual = __uw_priority_queue.individual
+                    and offered >= current_date - interval '3 days')
+        order by
+            priority,
+            latest_invite_date nulls first,
+            latest_collection_date nulls first,
+            encountered,
+            individual
         limit
             %s
         """, (quota.remaining,))
@@ -131,12 +188,57 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
     LOG.info(f"Fetched {len(next_in_queue):,} entries from the head of the queue")
 
     # Use the REDCap URL and project id from the queue rather than hardcoding.
-    buckets = bucket(next_in_queue, lambda q: (q.redcap_url, q.redcap_project_id))
+    #
+    # Projects are setup before any quota is reserved, as that may fail on
+    # REDCap errors.  Token will automatically come from the environment.  If
+    # we're doing a dry run, then Project will make sure we update_records()
+    # doesn't actually update records.
+    projects = {
+        (url, project_id): Project(url, project_id, dry_run = dry_run)
+            for url, project_id in dict.fromkeys((q.redcap_url, q.redcap_project_id) for q in next_in_queue) }
+
+    # Reserve quota for our offers before making them, committing the
+    # reservation right away so the quota row isn't locked while we wait on
+    # REDCap.  A concurrent run may have used some of the quota since we looked
+    # it up, so we may be granted less than we asked for.
+    with committed_session(db, dry_run) as session:
+        reservation = session.fetch_row("""
+            with reservation as (
+                select
+                    name,
+                    timespan,
+                    greatest(least(max - used, %s), 0) as reserved
+                from
+                    operations.test_quota
+                where
+                    (name, timespan) = (%s, %s)
+                for update
+            )
+            update
+                operations.test_quota
+            set
+                used = used + reservation.reserved
+            from
+                reservation
+            where
+                (test_quota.name, test_quota.timespan) = (reservation.name, reservation.timespan)
+            returning
+                reservation.reserved
+            """, (len(next_in_queue), quota.name, quota.timespan))
+
+    if not reservation.reserved:
+        LOG.info(f"No quota remaining for {quota.name} during {quota.timespan} after concurrent offers, aborting")
+        return
+
+    LOG.info(f"Reserved quota for {reservation.reserved:,} offers {'(dry run)' if dry_run else ''}")
+
+    buckets = bucket(next_in_queue[:reservation.reserved], lambda q: (q.redcap_url, q.redcap_project_id))
     queued_by_project = {
         key: list(buckets[key])
             for key in buckets }
 
-    offer_count = 0
+    updates = []
+    queued_by_project_record: Dict[int, Dict[str, Any]] = {}
 
     for (url, project_id), queued in queued_by_project.items():
         offers = [ offer(q) for q in queued ]
@@ -146,53 +248,97 @@ def offer_uw_testing(*, at: str, log_offers: bool, db: DatabaseSession, action:
         if log_offers:
             dump_ndjson(offers)
 
-        # Token will automatically come from the environment.  If we're doing a
-        # dry run, then Project will make sure we update_records() doesn't
-        # actually update records.
-        project = Project(url, project_id, dry_run = dry_run)
-
-        batches = list(chunked(offers, REDCAP_BATCH_SIZE))
-
-        for i, batch in enumerate(batches, 1):
-            LOG.info(f"Updating REDCap record batch {i:,}/{len(batches):,} of size {len(batch):,}")
-            offer_count += project.update_records(batch)
-
-        # Insert synthetic DETs into our receiving table to trigger a new
-        # import.  This helps complete the roundtrip data update for the REDCap
-        # records we just updated since API imports don't trigger natural DETs.
-        insert_dets(db, project, offers)
-
-    # XXX TODO: Maybe also update an internal testing_offered flag (in
-    # encounter.details?) to avoid delay of roundtrip thru REDCap?  If we don't
-    # do this, then worst case we try to offer testing to the same records more
-    # than once?  This is probably more complicated than we want to deal with
-    # on the first iteration and involves cooperation between this command and
-    # the priority queue definition.  I think timing will work out most of the
-    # time and the worst case is we offer less testing than we can handle
-    # (better than offering more!).  If it happens commonly, we can address
-    # later.
-    #   -trs, 17 Sept & 13 Oct 2020
+        project = projects[(url, project_id)]
 
-    updated_quota = db.fetch_row("""
-        update
-            operations.test_quota
-        set
-            used = used + %s
-        where
-            (name, timespan) = (%s, %s)
-        returning
-            name,
-            timespan,
-            max,
-            used,
-            max - used as remaining
-        """, (offer_count, quota.name, quota.timespan))
+        updates.append((project, offers))
+        queued_by_project_record[id(project)] = { q.redcap_record_id: q for q in queued }
+
+    # Record each batch of offers as soon as REDCap accepts it, committing
+    # right away like the quota reservation.  The offers stand in REDCap even
+    # if our main transaction is later rolled back, and the ledger must know
+    # of them so they aren't made again.
+    def on_updated(project: Project, updated: List[dict]):
+        with committed_session(db, dry_run) as session:
+            record_offers(session, project, [
+                (queued_by_project_record[id(project)][offer["record_id"]], offer)
+                    for offer in updated ])
+
+    # Batches for all projects are sent concurrently, resized to REDCap's
+    # response times and retried on transient errors.  Records which still
+    # fail aren't offered testing and so stay in the queue for the next run.
+    #
+    # Whatever happens after the offers are made, release the quota reserved
+    # for records which weren't offered, as the reservation is already
+    # committed.  If we don't know which records were offered, keep it all.
+    offer_count: Optional[int] = None
+
+    try:
+        results = update_records(updates, max_workers = jobs, batch_size = REDCAP_BATCH_SIZE, on_updated = on_updated)
+
+        offer_count = sum(result.updated_count for result in results)
+
+        for result in results:
+            if result.failed:
+                LOG.error(f"Failed to offer testing to {len(result.failed):,} records in {result.project}; they remain in the queue")
+
+    finally:
+        if offer_count is not None:
+            release_quota(db, quota, reservation.reserved - offer_count, dry_run)
+
+
+def release_quota(db: DatabaseSession, quota, unused: int, dry_run: bool):
+    """
+    Releases *unused* reserved *quota* in a :func:`committed_session`.
+    """
+    with committed_session(db, dry_run) as session:
+        updated_quota = session.fetch_row("""
+            update
+                operations.test_quota
+            set
+                used = used - %s
+            where
+                (name, timespan) = (%s, %s)
+            returning
+                name,
+                timespan,
+                max,
+                used,
+                max - used as remaining
+            """, (unused, quota.name, quota.timespan))
 
     LOG.info(
         f"Quota for {updated_quota.name} during {updated_quota.timespan} "
         f"is now {updated_quota.remaining:,} = {updated_quota.max:,} - {updated_quota.used:,} (remaining = max - used)")
 
 
+@contextmanager
+def committed_session(db: DatabaseSession, dry_run: bool) -> Iterator[DatabaseSession]:
+    """
+    Yields a new database session which is committed as soon as the block
+    exits, so rows and tables it locks, like the quota and the priority queue,
+    are only locked briefly.
+
+    Offers made in REDCap can't be rolled back, so neither is quota used for
+    them nor their record in the ledger, even if the changes in *db* are.  With *dry_run*, *db* is yielded
+    instead so changes are rolled back with it.
+    """
+    if dry_run:
+        yield db
+        return
+
+    session = DatabaseSession()
+
+    try:
+        yield session
+        session.commit()
+
+    except:
+        session.rollback()
+        raise
+
+    finally:
+        session.connection.close()
+
 
 def offer(queued) -> dict:
     """
@@ -226,21 +372,43 @@ def offer(queued) -> dict:
     }
 
 
-def insert_dets(db: DatabaseSession, project: Project, offers: List[dict]):
+def record_offers(db: DatabaseSession, project: Project, offers: List[Tuple[Any, dict]]):
     """
-    Inserts synthethic DETs into ``receiving.redcap_det`` for the REDCap record
-    *offers* made for *project*.
+    Records the REDCap record *offers* made for *project*, pairs of a queued
+    row from the priority queue and the offer made for it.
+
+    Each offer is recorded in the ``operations.test_offer`` ledger, which the
+    queue is filtered by until the updated REDCap records are imported.  To
+    trigger that import, synthetic DETs are inserted into
+    ``receiving.redcap_det``, since API imports don't trigger natural DETs.
+    Both are copied in bulk in the same transaction, which should be committed
+    as soon as possible after REDCap is updated.
     """
-    dets = [
-        (Json(det(project, offer, TESTING_INSTRUMENT)),)
-            for offer in offers ]
-
-    LOG.info(f"Inserting {len(dets):,} synthetic REDCap DETs for {project}")
-
-    with db.cursor() as cursor:
-        execute_values(cursor, """
-            insert into receiving.redcap_det (document) values %s
-            """, dets)
+    LOG.info(f"Recording {len(offers):,} offers and synthetic REDCap DETs for {project}")
+
+    copy_rows(db, ("receiving", "redcap_det"), ["document"], (
+        (as_json(det(project, offer, TESTING_INSTRUMENT)),)
+            for _, offer in offers ))
+
+    copy_rows(db, ("operations", "test_offer"), [
+            "individual",
+            "redcap_url",
+            "redcap_project_id",
+            "redcap_record_id",
+            "redcap_event_name",
+            "redcap_repeat_instance",
+            "priority",
+            "priority_reason",
+        ], (
+        (queued.individual,
+         queued.redcap_url,
+         queued.redcap_project_id,
+         offer["record_id"],
+         offer["redcap_event_name"],
+         offer["redcap_repeat_instance"],
+         queued.priority,
+         queued.priority_reason)
+            for queued, offer in offers ))
 
 
 @enum.unique
@@ -0,0 +1,255 @@
+"""
+Refresh materialized views in dependency order.
+
+Discovers the materialized views in the given schemas and refreshes each one
+only after every materialized view it reads from, directly or through other
+views, has been refreshed.  Views which don't depend on each other are
+refreshed in parallel with --jobs.
+
+Views with a unique index are refreshed concurrently, so they can still be
+read while refreshing.  Others, and views which were never populated, are
+refreshed with an exclusive lock.
+
+Each view is refreshed on its own database session and committed as soon as
+it's refreshed, so the views depending on it see its new rows.  With
+--dry-run, each refresh is rolled back instead, so dependent views are
+refreshed from the old rows.
+
+The duration and row count of each refresh is recorded in
+operations.materialized_view_refresh_log.
+"""
+import click
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Mapping, Set, Tuple
+from psycopg2.sql import SQL, Identifier
+from id3c.cli import cli
+from id3c.cli.command import with_database_session, DatabaseSessionAction
+from id3c.db.session import DatabaseSession
+from ...utils import unwrap
+
+
+LOG = logging.getLogger(__name__)
+
+
+@cli.command("refresh-materialized-views", help = __doc__)
+@with_database_session(pass_action = True)
+
+@click.option("--schema", "schemas",
+    metavar  = "<schema>",
+    multiple = True,
+    default  = ["shipping"],
+    show_default = True,
+    help     = unwrap("""
+        Refresh the materialized views in <schema>.  May be given more than
+        once."""))
+
+@click.option("--jobs",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 1,
+    show_default = True,
+    help    = "Refresh up to <n> independent materialized views at once.")
+
+def refresh_materialized_views(*, schemas: Tuple[str, ...], jobs: int, db: DatabaseSession, action: DatabaseSessionAction):
+    if action is DatabaseSessionAction.PROMPT:
+        raise click.UsageError("--prompt can't be used, as each view is committed as soon as it's refreshed")
+
+    commit = action is DatabaseSessionAction.COMMIT
+
+    views = {
+        view.name: view
+            for view in db.fetch_all("""
+                select
+                    pg_class.oid,
+                    nspname as schema,
+                    relname as table,
+                    format('%%I.%%I', nspname, relname) as name,
+                    relispopulated and exists (
+                        select from pg_index
+                         where indrelid = pg_class.oid
+                           and indisunique
+                           and indisvalid
+                           and indpred is null
+                           and indexprs is null) as concurrently
+                  from pg_class
+                  join pg_namespace on (pg_namespace.oid = relnamespace)
+                 where relkind = 'm'
+                   and nspname = any(%s)
+                """, (list(schemas),)) }
+
+    if not views:
+        LOG.info(f"No materialized views in {', '.join(schemas)}")
+        return
+
+    dependencies: Dict[str, Set[str]] = { name: set() for name in views }
+
+    for dependency in fetch_dependencies(db, [ view.oid for view in views.values() ]):
+        dependencies[dependency.dependent].add(dependency.materialized_view)
+
+    LOG.info(f"Refreshing {len(views):,} materialized views with up to {jobs} at once")
+
+    failed, skipped = refresh_in_order(
+        dependencies,
+        lambda name: refresh(views[name].schema, views[name].table, views[name].concurrently, commit),
+        jobs)
+
+    if failed:
+        raise RefreshError(
+            f"Failed to refresh {', '.join(failed)}"
+            + (f"; skipped refreshing {', '.join(skipped)} which depend on them" if skipped else ""))
+
+    LOG.info(f"Refreshed {len(views):,} materialized views")
+
+
+def fetch_dependencies(db: DatabaseSession, oids: List[int]) -> List:
+    """
+    Returns the pairs of materialized views among *oids* where the
+    ``dependent`` view reads from the ``materialized_view``, either directly
+    or through any number of plain views.
+
+    A view's dependencies are recorded in ``pg_depend`` against its rewrite
+    rule, not the view itself.
+    """
+    return db.fetch_all("""
+        with recursive reference (dependent, relation) as (
+            select rewrite.ev_class, depend.refobjid
+              from pg_rewrite as rewrite
+              join pg_depend as depend on (depend.classid = 'pg_rewrite'::regclass and depend.objid = rewrite.oid)
+             where rewrite.ev_class = any(%(oids)s::oid[])
+               and depend.refclassid = 'pg_class'::regclass
+               and depend.refobjid <> rewrite.ev_class
+
+            union
+
+            select reference.dependent, depend.refobjid
+              from reference
+              join pg_class on (pg_class.oid = reference.relation and pg_class.relkind = 'v')
+              join pg_rewrite as rewrite on (rewrite.ev_class = reference.relation)
+              join pg_depend as depend on (depend.classid = 'pg_rewrite'::regclass and depend.objid = rewrite.oid)
+             where depend.refclassid = 'pg_class'::regclass
+               and depend.refobjid <> rewrite.ev_class
+        )
+        select distinct
+            format('%%I.%%I', dependent_namespace.nspname, dependent.relname) as dependent,
+            format('%%I.%%I', namespace.nspname, materialized_view.relname) as materialized_view
+          from reference
+          join pg_class as dependent on (dependent.oid = reference.dependent)
+          join pg_namespace as dependent_namespace on (dependent_namespace.oid = dependent.relnamespace)
+          join pg_class as materialized_view on (materialized_view.oid = reference.relation)
+          join pg_namespace as namespace on (namespace.oid = materialized_view.relnamespace)
+         where reference.relation = any(%(oids)s::oid[])
+        """, { "oids": oids })
+
+
+def refresh_in_order(dependencies: Mapping[str, Set[str]], refresh: Callable[[str], None], jobs: int) -> Tuple[List[str], List[str]]:
+    """
+    Calls *refresh* for each view in *dependencies*, which maps each view to
+    the views it depends on, once all of those have been refreshed.  Up to
+    *jobs* views are refreshed at once.
+
+    Returns the views which failed to refresh and the views which were
+    skipped because a view they depend on failed.
+
+    >>> refreshed = []
+    >>> refresh_in_order({"c": {"a", "b"}, "b": {"a"}, "a": set(), "d": set()}, refreshed.append, jobs = 2)
+    ([], [])
+    >>> refreshed.index("a") < refreshed.index("b") < refreshed.index("c")
+    True
+    >>> sorted(refreshed)
+    ['a', 'b', 'c', 'd']
+
+    >>> def fail_b(view):
+    ...     if view == "b":
+    ...         raise Exception("boom")
+    >>> refresh_in_order({"c": {"b"}, "b": {"a"}, "a": set(), "d": set()}, fail_b, jobs = 2)
+    (['b'], ['c'])
+    """
+    pending = dict(dependencies)
+    refreshed: Set[str] = set()
+    failed: List[str] = []
+
+    with ThreadPoolExecutor(max_workers = jobs) as executor:
+        running = {}
+
+        while True:
+            ready = sorted(view for view, views in pending.items() if views <= refreshed)
+
+            for view in ready:
+                del pending[view]
+                running[executor.submit(refresh, view)] = view
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+
+            for future in finished:
+                view = running.pop(future)
+                error = future.exception()
+
+                if error:
+                    LOG.error(f"Failed to refresh {view}: {error}")
+                    failed.append(view)
+                else:
+                    refreshed.add(view)
+
+    return sorted(failed), sorted(pending)
+
+
+def refresh(schema: str, table: str, concurrently: bool, commit: bool) -> None:
+    """
+    Refreshes the materialized view *schema*.*table* on a new database
+    session, recording the refresh in the log, and commits if *commit* is
+    true.
+    """
+    name = f"{schema}.{table}"
+    db = DatabaseSession()
+
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("select clock_timestamp()")
+            started, = cursor.fetchone()
+
+            LOG.debug(f"Refreshing {name}{' concurrently' if concurrently else ''}")
+
+            cursor.execute(
+                SQL("refresh materialized view {} {}").format(
+                    SQL("concurrently" if concurrently else ""),
+                    Identifier(schema, table)))
+
+            cursor.execute("select clock_timestamp() - %s", (started,))
+            duration, = cursor.fetchone()
+
+            # Counted after the refresh is timed, so the duration logged is
+            # only that of the refresh.  Concurrent refreshes don't update
+            # the planner's row estimate, so the rows must be counted.
+            cursor.execute(SQL("select count(*) from {}").format(Identifier(schema, table)))
+            rows, = cursor.fetchone()
+
+            cursor.execute("""
+                insert into operations.materialized_view_refresh_log (materialized_view, concurrent, started, duration, rows)
+                values (%s, %s, %s, %s, %s)
+                """, (name, concurrently, started, duration, rows))
+
+        LOG.info(f"Refreshed {name} ({rows:,} rows) in {duration}")
+
+        if commit:
+            db.commit()
+        else:
+            db.rollback()
+
+    except:
+        db.rollback()
+        raise
+
+    finally:
+        db.connection.close()
+
+
+class RefreshError(RuntimeError):
+    """
+    Raised by :func:`refresh_materialized_views` if any view failed to
+    refresh.
+    """
+    pass
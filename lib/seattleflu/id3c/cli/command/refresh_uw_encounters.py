@@ -0,0 +1,131 @@
+"""
+Refresh UW encounter summaries.
+
+Applies queued changes to shipping.__uw_encounter_summary, the per-encounter
+summary behind the UW priority queue.  Triggers on warehouse.encounter and
+warehouse.sample queue the ids of every encounter they touch, and this command
+recomputes only those encounters' summaries, in batches.
+
+Queued changes are claimed with "for update skip locked", so overlapping runs
+(e.g. a slow cronjob and the next one) split the queue instead of waiting on
+or duplicating each other.  Changes are removed from the queue in the same
+transaction their summaries are written, so a failed or --dry-run run leaves
+them queued for the next one.
+
+This replaces refreshing the former materialized view shipping.__uw_encounters,
+which recomputed every encounter.
+"""
+import click
+import logging
+from typing import List
+from id3c.cli import cli
+from id3c.cli.command import with_database_session, DatabaseSessionAction
+from id3c.db.session import DatabaseSession
+from ...utils import unwrap
+
+
+LOG = logging.getLogger(__name__)
+
+
+@cli.command("refresh-uw-encounters", help = __doc__)
+@with_database_session(pass_action = True)
+
+@click.option("--batch-size",
+    metavar = "<n>",
+    type    = click.IntRange(min = 1),
+    default = 5000,
+    show_default = True,
+    help    = "Apply at most <n> queued changes at a time.")
+
+@click.option("--rebuild",
+    is_flag = True,
+    help    = unwrap("""
+        Discard all queued changes and recompute the summaries of every
+        encounter.  Useful after changing how summaries are computed."""))
+
+def refresh_uw_encounters(*, batch_size: int, rebuild: bool, db: DatabaseSession, action: DatabaseSessionAction):
+    if rebuild:
+        LOG.info("Rebuilding all UW encounter summaries")
+
+        with db.cursor() as cursor:
+            # Lock out concurrent runs and triggers until we commit, so no
+            # change is discarded without its encounter being recomputed.
+            cursor.execute("""
+                lock table shipping.__uw_encounter_summary_changes, shipping.__uw_encounter_summary
+                in exclusive mode
+                """)
+            cursor.execute("delete from shipping.__uw_encounter_summary_changes")
+            cursor.execute("delete from shipping.__uw_encounter_summary")
+            cursor.execute("""
+                insert into shipping.__uw_encounter_summary
+                select * from shipping.uw_encounter_summaries(null)
+                """)
+
+            LOG.info(f"Rebuilt {cursor.rowcount:,} UW encounter summaries")
+        return
+
+    changes = 0
+    encounters = 0
+
+    while True:
+        claimed = db.fetch_all("""
+            delete from shipping.__uw_encounter_summary_changes
+             where change_id in (
+                select change_id
+                  from shipping.__uw_encounter_summary_changes
+                 order by change_id
+                 limit %s
+                   for update skip locked)
+            returning encounter_id
+            """, (batch_size,))
+
+        if not claimed:
+            break
+
+        encounter_ids: List[int] = sorted({ change.encounter_id for change in claimed })
+
+        LOG.debug(f"Recomputing {len(encounter_ids):,} UW encounter summaries for {len(claimed):,} queued changes")
+
+        with db.cursor() as cursor:
+            # Upsert rather than delete and reinsert, as an overlapping run may
+            # have claimed another change to the same encounter and written its
+            # summary first.
+            cursor.execute("""
+                insert into shipping.__uw_encounter_summary
+                select * from shipping.uw_encounter_summaries(%s)
+                    on conflict (encounter_id) do update
+                   set individual = excluded.individual,
+                       encountered = excluded.encountered,
+                       redcap_url = excluded.redcap_url,
+                       redcap_project_id = excluded.redcap_project_id,
+                       redcap_record_id = excluded.redcap_record_id,
+                       redcap_event_name = excluded.redcap_event_name,
+                       redcap_repeat_instance = excluded.redcap_repeat_instance,
+                       screen_positive = excluded.screen_positive,
+                       daily_symptoms = excluded.daily_symptoms,
+                       daily_exposure = excluded.daily_exposure,
+                       daily_exposure_known_pos = excluded.daily_exposure_known_pos,
+                       daily_travel = excluded.daily_travel,
+                       testing_trigger = excluded.testing_trigger,
+                       surge_selected_flag = excluded.surge_selected_flag,
+                       sample_collection_date = excluded.sample_collection_date,
+                       prior_test_positive_date = excluded.prior_test_positive_date
+                returning encounter_id
+                """, (encounter_ids,))
+
+            recomputed = [ encounter_id for encounter_id, in cursor ]
+
+            # Deleted encounters have no summary to recompute
+            cursor.execute("""
+                delete from shipping.__uw_encounter_summary
+                 where encounter_id = any(%s)
+                   and not encounter_id = any(%s)
+                """, (encounter_ids, recomputed))
+
+        changes += len(claimed)
+        encounters += len(encounter_ids)
+
+    if changes:
+        LOG.info(f"Applied {changes:,} queued changes to {encounters:,} UW encounter summaries")
+    else:
+        LOG.info("No queued changes to UW encounter summaries")
@@ -35,6 +35,8 @@ from datetime import datetime, timezone
 from id3c.cli import cli
 from id3c.db.session import DatabaseSession
 from id3c.db.datatypes import Json
+from ...db import ProcessingLogBuffer
+from ...utils import unwrap
 
 
 LOG = logging.getLogger(__name__)
@@ -61,7 +63,16 @@ def reportable_conditions():
     help        = "Save changes to the database",
     flag_value  = "commit")
 
-def notify(*, action: str):
+@click.option("--flush-interval",
+    metavar     = "<n>",
+    type        = click.IntRange(min = 1),
+    default     = 1000,
+    show_default = True,
+    help        = unwrap("""
+        Buffer reporting log entries in memory and write them to the database
+        in bulk every <n> records."""))
+
+def notify(*, action: str, flush_interval: int):
     LOG.debug(f"Starting the reportable conditions notification routine, revision {REVISION}")
 
     db = DatabaseSession()
@@ -110,43 +121,58 @@ def notify(*, action: str):
             for update of presence_absence;
         """, (Json({"reporting_log":[{ "revision": REVISION }]}),))
 
+    reporting_log = ProcessingLogBuffer(db,
+        table          = ("warehouse", "presence_absence"),
+        key            = "presence_absence_id",
+        assignment     = """details = jsonb_insert('{"reporting_log":[]}' || coalesce(details, '{}'), '{reporting_log, -1}', log.entry, insert_after => true)""",
+        flush_interval = flush_interval)
+
     processed_without_error = None
 
     try:
-        for record in reportable_conditions:
-            with db.savepoint(f"reportable condition presence_absence_id {record.id}"):
-                LOG.info(f"Processing reportable condition, presence_absence_id «{record.id}»")
-
-                if not record.site:
-                    LOG.info(f"No site found for presence_absence_id «{record.id}». " +
-                        "Inferring site from manifest data.")
-
-                responses = {'ncov-reporting': send_slack_post_request(record, slack_webhooks['ncov-reporting'])}
-
-                # Also send study-specific results to their respective channels
-                for project in projects:
-                    if (record.collection_set_name in project['collection_sets']):
-                        responses[project['slack_channel_name']] = send_slack_post_request(
-                            record, project['slack_webhook'])
-
-                # Check all POSTs to Slack were successful to mark as processed
-                # This does mean that if one fails but others succeed, there
-                # will be duplicate POSTs to the already succeeded channels.
-                # The chance of this happening is pretty small, but we can
-                # revisit this if it becomes a common problem
-                #   -Jover, 21 October 2020
-                if all(response.status_code == 200 for response in responses.values()):
-                    mark_processed(db, record.id, {"status": "sent Slack notification"})
-                    LOG.info(f"Finished processing presence_absence_id «{record.id}»")
-
-                else:
-                    for channel, response in responses.items():
-                        if response.status_code != 200:
-                            LOG.error(("Error: A Slack notification could not " \
-                            f"be sent to the channel «{channel}» for "
-                            f"presence_absence_id «{record.id}».\n" \
-                            f"Slack API returned status code {response.status_code}: "\
-                            f"{response.text}"))
+        # Flush between records, never within a record's savepoint, and flush
+        # whatever is pending even if we stop with an error so that records we
+        # already sent notifications for are marked as such.
+        try:
+            for record in reportable_conditions:
+                with db.savepoint(f"reportable condition presence_absence_id {record.id}"):
+                    LOG.info(f"Processing reportable condition, presence_absence_id «{record.id}»")
+
+                    if not record.site:
+                        LOG.info(f"No site found for presence_absence_id «{record.id}». " +
+                            "Inferring site from manifest data.")
+
+                    responses = {'ncov-reporting': send_slack_post_request(record, slack_webhooks['ncov-reporting'])}
+
+                    # Also send study-specific results to their respective channels
+                    for project in projects:
+                        if (record.collection_set_name in project['collection_sets']):
+                            responses[project['slack_channel_name']] = send_slack_post_request(
+                                record, project['slack_webhook'])
+
+                    # Check all POSTs to Slack were successful to mark as processed
+                    # This does mean that if one fails but others succeed, there
+                    # will be duplicate POSTs to the already succeeded channels.
+                    # The chance of this happening is pretty small, but we can
+                    # revisit this if it becomes a common problem
+                    #   -Jover, 21 October 2020
+                    if all(response.status_code == 200 for response in responses.values()):
+                        mark_processed(reporting_log, record.id, {"status": "sent Slack notification"})
+                        LOG.info(f"Finished processing presence_absence_id «{record.id}»")
+
+                    else:
+                        for channel, response in responses.items():
+                            if response.status_code != 200:
+                                LOG.error(("Error: A Slack notification could not " \
+                                f"be sent to the channel «{channel}» for "
+                                f"presence_absence_id «{record.id}».\n" \
+                                f"Slack API returned status code {response.status_code}: "\
+                                f"{response.text}"))
+
+                reporting_log.flush_if_full()
+
+        finally:
+            reporting_log.flush()
 
     except Exception as error:
         processed_without_error = False
@@ -228,23 +254,13 @@ def send_slack_post_request(record: Any, url: str) -> requests.Response:
                          headers={'Content-type': 'application/json'})
 
 
-def mark_processed(db, presence_absence_id: int, entry: Mapping) -> None:
+def mark_processed(reporting_log: ProcessingLogBuffer, presence_absence_id: int, entry: Mapping) -> None:
     LOG.debug(dedent(f"""
     Marking reportable condition «{presence_absence_id}» as processed in the
     presence_absence table"""))
 
-    data = {
-        "presence_absence_id": presence_absence_id,
-        "log_entry": Json({
-            **entry,
-            "revision": REVISION,
-            "timestamp": datetime.now(timezone.utc),
-        }),
-    }
-
-    with db.cursor() as cursor:
-        cursor.execute("""
-            update warehouse.presence_absence
-               set details = jsonb_insert('{"reporting_log":[]}' || coalesce(details, '{}'), '{reporting_log, -1}', %(log_entry)s, insert_after => true)
-             where presence_absence_id = %(presence_absence_id)s
-            """, data)
+    reporting_log.append(presence_absence_id, {
+        **entry,
+        "revision": REVISION,
+        "timestamp": datetime.now(timezone.utc),
+    })
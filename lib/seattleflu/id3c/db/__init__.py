@@ -1,15 +1,41 @@
 """
 Database interfaces
 """
+import csv
 import logging
 from datetime import datetime
-from typing import Optional
+from io import StringIO
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+from psycopg2.sql import SQL, Identifier
 from id3c.db.session import DatabaseSession
 from id3c.db.datatypes import Json
+from id3c.json import as_json
 
 LOG = logging.getLogger(__name__)
 
 
+# Keys of deliverable details which may be useful for QC, stored separately
+# in operations.deliverables_log.qc_details for exports of the log
+DELIVERABLE_QC_DETAIL_KEYS = {
+    # wa doh linelist details
+    '_provenance',
+    'record_id',
+    'study_arm',
+    'date_tested',
+    'test_result',
+    'collection_date',
+    'redcap_event_name',
+
+    # return of results details
+    'result_ts',
+    'swab_type',
+    'collect_ts',
+    'status_code',
+    'staff_observed',
+    'pre_analytical_specimen_collection',
+}
+
+
 def log_deliverable(db: DatabaseSession,
                     process_name:str,
                     details:dict,
@@ -19,16 +45,198 @@ def log_deliverable(db: DatabaseSession,
     LOG.debug(f"Logging deliverable")
 
     if sample_barcode or collection_barcode:
+        qc_details = {
+            key: value
+                for key, value in details.items()
+                 if key in DELIVERABLE_QC_DETAIL_KEYS }
+
         deliverable_log = db.fetch_row("""
             insert into operations.deliverables_log (
                 sample_barcode,
                 collection_barcode,
                 details,
+                qc_details,
                 process_name,
-                sent) values (%s, %s, %s, %s, coalesce(%s, now()))
+                sent) values (%s, %s, %s, %s, %s, coalesce(%s, now()))
             returning deliverables_log as id, sample_barcode, collection_barcode, details, process_name, sent
-            """, (sample_barcode,collection_barcode, Json(details), process_name, sent))
+            """, (sample_barcode,collection_barcode, Json(details), Json(qc_details) if qc_details else None, process_name, sent))
 
         LOG.debug(f"Deliverable log added for {sample_barcode or collection_barcode} ")
     else:
         LOG.warning(f"Deliverable logging skipped. Deliverable log requires sample or collection barcode value.")
+
+
+def find_tracts(db: DatabaseSession, points: Iterable[Tuple[Any, Any]]) -> List[Optional[str]]:
+    """
+    Returns the identifier of the Census tract containing each (lat, lng) pair
+    in *points*, in the same order, or ``None`` where no tract contains the
+    point or either coordinate is missing.
+
+    This is a bulk equivalent of calling
+    :func:`id3c.cli.command.location.location_lookup` at the ``tract`` scale
+    for every point.  Each distinct point is looked up only once, and all of
+    them are resolved with a single query.
+    """
+    points = list(points)
+
+    distinct_points = list({
+        (lat, lng): None
+            for lat, lng in points
+             if lat is not None and lng is not None
+            and lat == lat and lng == lng   # NaN is never equal to itself
+    })
+
+    if not distinct_points:
+        return [None] * len(points)
+
+    LOG.debug(f"Looking up Census tracts for {len(distinct_points):,} distinct points")
+
+    lats, lngs = zip(*distinct_points)
+
+    tracts = db.fetch_all("""
+        select distinct on (point.ordinality)
+               point.ordinality,
+               location.identifier
+          from unnest(%s::double precision[], %s::double precision[])
+                 with ordinality as point(lat, lng, ordinality)
+          join warehouse.location
+            on location.scale = 'tract'
+           and ST_Contains(location.polygon, ST_SetSRID(ST_MakePoint(point.lng, point.lat), 4326))
+         order by point.ordinality, location.identifier
+        """, (list(map(float, lats)), list(map(float, lngs))))
+
+    tract_by_point = {
+        distinct_points[tract.ordinality - 1]: tract.identifier
+            for tract in tracts }
+
+    return [ tract_by_point.get(point) for point in points ]
+
+
+def copy_rows(db: DatabaseSession, table: Tuple[str, str], columns: Iterable[str], rows: Iterable[Iterable[Any]]) -> int:
+    """
+    Inserts *rows* into the *columns* of *table*, a (schema, table) tuple,
+    with a single ``COPY`` and returns the number of rows inserted.
+
+    This is a bulk alternative to ``insert … values`` for many rows at once.
+    Values are sent as CSV, so ``None`` and empty strings are both inserted
+    as null.  Serialize JSON values with :func:`id3c.json.as_json` first.
+    """
+    assert len(table) == 2, \
+        "A schema and table name must be included in the table tuple"
+
+    schema, name = table
+
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    with db.cursor() as cursor:
+        cursor.copy_expert(
+            SQL("copy {}.{} ({}) from stdin with (format csv)").format(
+                Identifier(schema),
+                Identifier(name),
+                SQL(", ").join(map(Identifier, columns))).as_string(cursor),
+            buffer)
+
+        return cursor.rowcount
+
+
+class ProcessingLogBuffer:
+    """
+    Buffers processing log entries in memory and writes them to *table* in
+    bulk, instead of updating each row as its record is processed.
+
+    *table* is a (schema, table) tuple and *key* is the name of its integer
+    primary key column.  *assignment* is the SQL for the ``set`` clause of
+    the ``update``, in which the new log entry is available as
+    ``log.entry``, e.g.::
+
+        processing_log = processing_log || log.entry
+
+    Each flush copies the pending entries into a temporary table with one
+    ``COPY`` and applies them with one ``UPDATE … FROM``.  Only one entry per
+    row may be pending at a time.
+
+    Flushes must happen outside of any per-record savepoint, otherwise a
+    rolled back savepoint would also discard the entries of records processed
+    before it.  Call :meth:`flush_if_full` between records and :meth:`flush`
+    once processing is done, including when it stops with an error.
+    """
+    def __init__(self,
+                 db: DatabaseSession,
+                 table: Tuple[str, str],
+                 key: str,
+                 assignment: str,
+                 flush_interval: int = 1000):
+        assert len(table) == 2, \
+            "A schema and table name must be included in the table tuple"
+
+        self.db = db
+        self.table = table
+        self.key = key
+        self.assignment = assignment
+        self.flush_interval = flush_interval
+        self.entries: Dict[int, Mapping[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def append(self, id: int, entry: Mapping[str, Any]) -> None:
+        """
+        Buffers a log *entry* for the row with primary key *id*.
+        """
+        assert id not in self.entries, \
+            f"A processing log entry for {'.'.join(self.table)} row {id} is already pending"
+
+        self.entries[id] = entry
+
+    def flush_if_full(self) -> None:
+        """
+        Flushes the buffer if it holds at least *flush_interval* entries.
+        """
+        if len(self.entries) >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all pending entries to the database.
+        """
+        if not self.entries:
+            return
+
+        schema, table = self.table
+        buffer = Identifier(f"{table}_processing_log_buffer")
+
+        LOG.debug(f"Flushing {len(self.entries):,} processing log entries to {schema}.{table}")
+
+        rows = StringIO()
+        writer = csv.writer(rows)
+
+        for id, entry in self.entries.items():
+            writer.writerow((id, as_json(entry)))
+
+        rows.seek(0)
+
+        with self.db.cursor() as cursor:
+            cursor.execute(SQL("""
+                create temporary table if not exists {} (
+                    id integer not null,
+                    entry jsonb not null
+                ) on commit drop
+                """).format(buffer))
+
+            cursor.execute(SQL("truncate {}").format(buffer))
+
+            cursor.copy_expert(
+                SQL("copy {} (id, entry) from stdin with (format csv)").format(buffer).as_string(cursor),
+                rows)
+
+            cursor.execute(
+                  SQL("update {}.{} set ").format(Identifier(schema), Identifier(table))
+                + SQL(self.assignment)
+                + SQL(" from {} as log where {}.{} = log.id").format(buffer, Identifier(table), Identifier(self.key)))
+
+            assert cursor.rowcount == len(self.entries), \
+                f"Updated {cursor.rowcount:,} rows of {schema}.{table} for {len(self.entries):,} processing log entries"
+
+        self.entries.clear()
@@ -0,0 +1,314 @@
+"""
+Geocoding interfaces
+"""
+import logging
+import os
+import pickle
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from hashlib import sha256
+from pathlib import Path
+from threading import RLock
+from time import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, MutableMapping, Tuple
+from id3c.cli.command.geocode import get_geocoded_address
+
+LOG = logging.getLogger(__name__)
+
+
+GeocodingResult = Tuple[Any, Any, Any]
+
+# Four weeks, in seconds
+GEOCODING_CACHE_TTL = 60 * 60 * 24 * 28
+
+SQLITE_HEADER = b"SQLite format 3\0"
+
+
+class LockedCache(MutableMapping):
+    """
+    Wraps a geocoding *cache*, such as a :class:`cachetools.TTLCache` or the
+    dict yielded by :func:`id3c.cli.command.pickled_cache`, so that it can be
+    shared by many threads.  Every read and write of the underlying cache
+    happens while holding a lock.
+
+    >>> cache = LockedCache({})
+    >>> cache["a"] = 1
+    >>> "a" in cache, cache.get("b"), len(cache), list(cache)
+    (True, None, 1, ['a'])
+    """
+    def __init__(self, cache: MutableMapping):
+        self.cache = cache
+        self.lock = RLock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.cache[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.cache[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.cache
+
+    def __iter__(self) -> Iterator:
+        with self.lock:
+            return iter(list(self.cache))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.cache)
+
+
+class Geocoder:
+    """
+    Geocodes many addresses at once, in front of a shared geocoding *cache*.
+
+    Addresses are deduplicated, so each distinct address is geocoded only
+    once.  Distinct addresses are then handed to a pool of at most
+    *max_workers* threads, each of which calls *geocode* with the address and
+    a thread-safe view of *cache*.  Cached addresses are answered straight
+    from the cache, while only misses wait on the geocoding service.  Results
+    are written back to *cache* by *geocode* one whole entry at a time.
+
+    *geocode* defaults to :func:`id3c.cli.command.geocode.get_geocoded_address`
+    and must have the same signature, taking an address dict and a cache and
+    returning a (lat, lng, canonicalized address) tuple.  A local stub may be
+    passed instead for testing:
+
+    >>> calls = []
+    >>> def stub(address, cache):
+    ...     calls.append(address["street"])
+    ...     return (47.6, -122.3, address["street"].upper())
+    >>> geocoder = Geocoder({}, max_workers = 2, geocode = stub)
+    >>> geocoder.geocode_all([{"street": "1 main st"}, {"street": "2 main st"}, {"street": "1 main st"}])
+    [(47.6, -122.3, '1 MAIN ST'), (47.6, -122.3, '2 MAIN ST'), (47.6, -122.3, '1 MAIN ST')]
+    >>> sorted(calls)
+    ['1 main st', '2 main st']
+    >>> geocoder.geocode({"street": "3 main st"})
+    (47.6, -122.3, '3 MAIN ST')
+    """
+    def __init__(self,
+                 cache: MutableMapping,
+                 max_workers: int = 8,
+                 geocode: Callable[[dict, MutableMapping], GeocodingResult] = get_geocoded_address):
+        self.cache = cache if isinstance(cache, LockedCache) else LockedCache(cache)
+        self.max_workers = max_workers
+        self._geocode = geocode
+
+    def geocode(self, address: dict) -> GeocodingResult:
+        """
+        Geocodes a single *address* against the shared cache.
+        """
+        return self._geocode(address, self.cache)
+
+    def geocode_all(self, addresses: Iterable[dict]) -> List[GeocodingResult]:
+        """
+        Geocodes all *addresses*, returning their results in the same order.
+        """
+        addresses = list(addresses)
+
+        distinct: Dict[Hashable, dict] = {
+            address_key(address): address
+                for address in addresses }
+
+        if not distinct:
+            return []
+
+        LOG.debug(f"Geocoding {len(distinct):,} distinct addresses of {len(addresses):,} "
+                  f"with up to {self.max_workers} workers")
+
+        if len(distinct) == 1 or self.max_workers == 1:
+            results = list(map(self.geocode, distinct.values()))
+        else:
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                results = list(executor.map(self.geocode, distinct.values()))
+
+        result_by_key = dict(zip(distinct, results))
+
+        return [ result_by_key[address_key(address)] for address in addresses ]
+
+    def prefetch(self, addresses: Iterable[dict]) -> None:
+        """
+        Geocodes all *addresses* concurrently so that later, one-at-a-time
+        lookups of them against the same cache are hits.
+        """
+        self.geocode_all(addresses)
+
+
+def address_key(address: dict) -> Hashable:
+    """
+    Returns a hashable key which is equal for equal *address* dicts.
+
+    >>> address_key({"street": "1 Main St", "city": "Seattle"}) == address_key({"city": "Seattle", "street": "1 Main St"})
+    True
+    """
+    return tuple(sorted(address.items()))
+
+
+class SQLiteCache(MutableMapping):
+    """
+    A persistent geocoding cache stored in the SQLite database *filename*.
+
+    Unlike :func:`id3c.cli.command.pickled_cache`, nothing is loaded up front
+    and every write is committed as it happens, so opening the cache takes the
+    same time however many addresses it holds and concurrent runs sharing the
+    file don't clobber each other's entries.
+
+    Entries are keyed on a SHA-256 hash of the cache key, which for geocoding
+    is derived from the address, and expire *ttl* seconds after they're
+    written.  Expired entries are evicted when the cache is opened.  Iterating
+    over the cache yields the key hashes, not the original keys.
+
+    >>> cache = SQLiteCache(":memory:")
+    >>> cache["1 Main St"] = {"lat": 47.6}
+    >>> cache["1 Main St"], "2 Main St" in cache, len(cache)
+    ({'lat': 47.6}, False, 1)
+    >>> del cache["1 Main St"]
+    >>> len(cache)
+    0
+    """
+    def __init__(self, filename: str, ttl: float = GEOCODING_CACHE_TTL):
+        self.ttl = ttl
+        self.connection = sqlite3.connect(
+            filename,
+            timeout = 60,
+            isolation_level = None,
+            check_same_thread = False)
+
+        self.connection.execute("pragma journal_mode = wal")
+        self.connection.execute("""
+            create table if not exists cache (
+                key     text primary key,
+                value   blob not null,
+                expires real not null
+            )
+            """)
+        self.connection.execute("create index if not exists cache_expires_idx on cache (expires)")
+
+        self.evict()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def evict(self) -> None:
+        """
+        Deletes all expired entries.
+        """
+        evicted = self.connection.execute("delete from cache where expires <= ?", (time(),)).rowcount
+
+        if evicted:
+            LOG.debug(f"Evicted {evicted:,} expired geocoding cache entries")
+
+    def __getitem__(self, key):
+        row = self.connection.execute(
+            "select value from cache where key = ? and expires > ?",
+            (cache_key_hash(key), time())).fetchone()
+
+        if row is None:
+            raise KeyError(key)
+
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        self.connection.execute(
+            "insert or replace into cache (key, value, expires) values (?, ?, ?)",
+            (cache_key_hash(key), pickle.dumps(value), time() + self.ttl))
+
+    def __delitem__(self, key):
+        if not self.connection.execute("delete from cache where key = ?", (cache_key_hash(key),)).rowcount:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator:
+        rows = self.connection.execute("select key from cache where expires > ?", (time(),)).fetchall()
+        return (key for key, in rows)
+
+    def __len__(self) -> int:
+        return self.connection.execute("select count(*) from cache where expires > ?", (time(),)).fetchone()[0]
+
+
+def cache_key_hash(key: Hashable) -> str:
+    """
+    Returns the SHA-256 hex digest identifying *key* in a :class:`SQLiteCache`.
+    """
+    return sha256(pickle.dumps(key, protocol = 4)).hexdigest()
+
+
+@contextmanager
+def sqlite_cache(filename: str, ttl: float = GEOCODING_CACHE_TTL) -> Iterator[SQLiteCache]:
+    """
+    Context manager which opens the :class:`SQLiteCache` for *filename* and
+    closes it on exit.
+
+    *filename* names the geocoding cache shared with
+    :func:`id3c.cli.command.pickled_cache`, e.g. by ``id3c geocode``, so the
+    SQLite database is kept alongside it with a ``.sqlite`` suffix and the
+    pickle is left as is.  A new database is seeded from the pickle, if there
+    is one.  If *filename* is itself already a SQLite database, it is used
+    directly.
+    """
+    path = Path(filename)
+
+    if path.exists() and path.stat().st_size and is_sqlite_database(path):
+        database = path
+    else:
+        database = path.with_name(path.name + ".sqlite")
+
+        if not database.exists() and path.exists() and path.stat().st_size:
+            seed_from_pickled_cache(database, path, ttl)
+
+    cache = SQLiteCache(str(database), ttl)
+
+    try:
+        yield cache
+    finally:
+        cache.close()
+
+
+def is_sqlite_database(path: Path) -> bool:
+    with path.open("rb") as file:
+        return file.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def seed_from_pickled_cache(database: Path, pickled_path: Path, ttl: float = GEOCODING_CACHE_TTL) -> None:
+    """
+    Creates the SQLite cache *database* with the entries of the cache pickled
+    at *pickled_path*, which is left unchanged.
+
+    Every entry is copied and given a fresh *ttl*.  The new database is built
+    alongside and renamed into place once complete.
+    """
+    LOG.info(f"Seeding SQLite geocoding cache «{database}» from «{pickled_path}»")
+
+    with pickled_path.open("rb") as file:
+        pickled = pickle.load(file)
+
+    seeded = database.with_name(database.name + ".seeding")
+
+    if seeded.exists():
+        seeded.unlink()
+
+    cache = SQLiteCache(str(seeded), ttl)
+
+    try:
+        with cache.connection:
+            cache.connection.execute("begin")
+            cache.connection.executemany(
+                "insert or replace into cache (key, value, expires) values (?, ?, ?)",
+                ((cache_key_hash(key), pickle.dumps(value), time() + ttl) for key, value in pickled.items()))
+
+        # Fold the write-ahead log back into the database file so the rename
+        # below carries every entry with it.
+        cache.connection.execute("pragma wal_checkpoint(truncate)")
+    finally:
+        cache.close()
+
+    os.replace(seeded, database)
+
+    LOG.info(f"Seeded {len(pickled):,} geocoding cache entries")
@@ -0,0 +1,269 @@
+"""
+Concurrent, retrying updates of REDCap records
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, Deque, List, NamedTuple, Optional, Sequence, Tuple
+import requests
+
+LOG = logging.getLogger(__name__)
+
+
+# HTTP statuses of responses worth retrying: rate limiting and server errors
+# which are usually gone a moment later.
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Returns true if the REDCap request which raised *error* may succeed if
+    retried, e.g. after a dropped connection, timeout, or server error.
+
+    >>> is_transient(requests.ConnectionError())
+    True
+    >>> response = requests.Response()
+    >>> response.status_code = 503
+    >>> is_transient(requests.HTTPError(response = response))
+    True
+    >>> response.status_code = 403
+    >>> is_transient(requests.HTTPError(response = response))
+    False
+    >>> is_transient(ValueError())
+    False
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in TRANSIENT_STATUS_CODES
+
+    return False
+
+
+class BatchSizer:
+    """
+    Adapts the size of batches of records to how long REDCap takes to update
+    them, aiming for each to take about *target* seconds.
+
+    The size grows by half when a batch takes less than half the target, and
+    halves when a batch takes longer than the target or fails, staying
+    between 1 and *maximum*.
+
+    >>> sizer = BatchSizer(100, maximum = 200, target = 10)
+    >>> sizer.observe(2.0); sizer.size
+    150
+    >>> sizer.observe(2.0); sizer.size
+    200
+    >>> sizer.observe(7.0); sizer.size
+    200
+    >>> sizer.observe(15.0); sizer.size
+    100
+    >>> sizer.shrink(); sizer.size
+    50
+    """
+    def __init__(self, initial: int, maximum: int, target: float):
+        self.size = initial
+        self.maximum = maximum
+        self.target = target
+        self.lock = Lock()
+
+    def observe(self, seconds: float) -> None:
+        """
+        Adapts to a batch which took *seconds* to update.
+        """
+        if seconds > self.target:
+            self.shrink()
+        elif seconds < self.target / 2:
+            with self.lock:
+                self.size = min(self.maximum, self.size + max(1, self.size // 2))
+
+    def shrink(self) -> None:
+        with self.lock:
+            self.size = max(1, self.size // 2)
+
+
+class UpdateResult(NamedTuple):
+    """
+    The outcome of updating *records* of a REDCap *project* with
+    :func:`update_records`.
+    """
+    project: Any
+    updated: List[dict]
+    failed: List[dict]
+    updated_count: int
+
+
+class ProjectUpdates:
+    """
+    The records of a single REDCap *project* still to be updated, taken in
+    batches sized by *sizer*.
+    """
+    def __init__(self, project: Any, records: Sequence[dict], sizer: BatchSizer):
+        self.project = project
+        self.pending: Deque[dict] = deque(records)
+        self.sizer = sizer
+        self.updated: List[dict] = []
+        self.failed: List[dict] = []
+        self.updated_count = 0
+
+    def take(self) -> List[dict]:
+        """
+        Removes the next batch from the pending records.  Must be called while
+        holding the lock of the :func:`update_records` call.
+        """
+        return [ self.pending.popleft() for _ in range(min(self.sizer.size, len(self.pending))) ]
+
+    def result(self) -> UpdateResult:
+        return UpdateResult(self.project, self.updated, self.failed, self.updated_count)
+
+
+def update_records(updates: Sequence[Tuple[Any, Sequence[dict]]],
+                   max_workers: int = 4,
+                   batch_size: int = 150,
+                   max_batch_size: int = 600,
+                   target_latency: float = 10,
+                   retries: int = 3,
+                   backoff: float = 2,
+                   wait: Callable[[float], None] = sleep,
+                   on_updated: Callable[[Any, List[dict]], None] = None) -> List[UpdateResult]:
+    """
+    Updates the records of each REDCap project in *updates*, a list of
+    (project, records) pairs, returning an :class:`UpdateResult` for each
+    project in the same order.
+
+    Records are sent in batches by up to *max_workers* threads at once, taking
+    turns between projects.  Each project's batches start at *batch_size*
+    records and are resized by a :class:`BatchSizer` between 1 and
+    *max_batch_size* records towards *target_latency* seconds per batch.
+
+    A batch which fails with a transient error (see :func:`is_transient`) is
+    retried up to *retries* more times, waiting *backoff* seconds before the
+    first retry and twice as long before each one after.  Updating a record
+    with the same values is idempotent, so a batch which REDCap applied
+    before failing to respond is safe to send again.  Records of batches which
+    still fail are returned as failed instead of raising an error, so that
+    the records which were updated can be accounted for.
+
+    If given, *on_updated* is called with the project and records of each
+    batch as soon as REDCap has updated them, so they can be recorded before
+    the rest are sent.  Calls are made one at a time.  If one raises an
+    error, no more batches are started and the error is raised once the
+    batches in flight finish.
+
+    Each project must have an ``update_records(records)`` method which
+    returns the number of records updated, like
+    :meth:`id3c.cli.redcap.Project.update_records`.  A local fake may be
+    passed instead for testing:
+
+    >>> class FakeProject:
+    ...     def __init__(self, name, failures = 0):
+    ...         self.name, self.failures, self.batches = name, failures, []
+    ...     def update_records(self, records):
+    ...         if self.failures:
+    ...             self.failures -= 1
+    ...             raise requests.ConnectionError("connection reset")
+    ...         self.batches.append(len(records))
+    ...         return len(records)
+    >>> a, b = FakeProject("a"), FakeProject("b", failures = 1)
+    >>> records = [ {"record_id": str(i)} for i in range(10) ]
+    >>> results = update_records([(a, records[:7]), (b, records[7:])], batch_size = 2, max_batch_size = 2, wait = lambda seconds: None)
+    >>> [ (result.project.name, result.updated_count, len(result.failed)) for result in results ]
+    [('a', 7, 0), ('b', 3, 0)]
+    >>> sorted(a.batches), sorted(b.batches)
+    ([1, 2, 2, 2], [1, 2])
+
+    >>> recorded = []
+    >>> results = update_records([(a, records[:3])], on_updated = lambda project, batch: recorded.extend(batch))
+    >>> len(recorded)
+    3
+
+    >>> c = FakeProject("c", failures = 5)
+    >>> [ (result.updated_count, len(result.failed)) for result in update_records([(c, records[:2])], retries = 2, wait = lambda seconds: None) ]
+    [(0, 2)]
+    """
+    projects = [
+        ProjectUpdates(project, records, BatchSizer(batch_size, max_batch_size, target_latency))
+            for project, records in updates ]
+
+    lock = Lock()
+    on_updated_lock = Lock()
+    turn = 0
+    stopped = False
+
+    def next_batch() -> Optional[Tuple[ProjectUpdates, List[dict]]]:
+        nonlocal turn
+
+        with lock:
+            if stopped:
+                return None
+
+            for _ in range(len(projects)):
+                queue = projects[turn]
+                turn = (turn + 1) % len(projects)
+
+                if queue.pending:
+                    return queue, queue.take()
+
+        return None
+
+    def work() -> None:
+        nonlocal stopped
+
+        try:
+            while True:
+                batch = next_batch()
+
+                if not batch:
+                    break
+
+                send(*batch)
+
+        except:
+            with lock:
+                stopped = True
+            raise
+
+    def send(queue: ProjectUpdates, records: List[dict]) -> None:
+        for attempt in range(retries + 1):
+            started = monotonic()
+
+            try:
+                count = queue.project.update_records(records)
+
+            except Exception as error:
+                queue.sizer.shrink()
+
+                if attempt < retries and is_transient(error):
+                    delay = backoff * 2 ** attempt
+                    LOG.warning(f"Retrying update of {len(records):,} records in {queue.project} in {delay:g}s after error: {error}")
+                    wait(delay)
+                    continue
+
+                LOG.error(f"Failed to update {len(records):,} records in {queue.project}: {error}")
+
+                with lock:
+                    queue.failed.extend(records)
+                return
+
+            queue.sizer.observe(monotonic() - started)
+
+            LOG.info(f"Updated {count:,} records in {queue.project} in {monotonic() - started:,.1f}s")
+
+            with lock:
+                queue.updated.extend(records)
+                queue.updated_count += count
+
+            if on_updated:
+                with on_updated_lock:
+                    on_updated(queue.project, records)
+            return
+
+    if projects:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            for future in [ executor.submit(work) for _ in range(max_workers) ]:
+                future.result()
+
+    return [ queue.result() for queue in projects ]
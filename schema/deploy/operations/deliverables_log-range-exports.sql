@@ -0,0 +1,40 @@
+-- Deploy seattleflu/id3c-customizations:operations/deliverables_log-range-exports to pg
+-- requires: operations/deliverables_log
+
+begin;
+
+-- Supports exports of the deliverables log by process and range of sent
+-- times, which scan only the matching entries however large the log grows.
+
+alter table operations.deliverables_log
+    add column qc_details jsonb;
+
+comment on column operations.deliverables_log.qc_details is
+    'The subset of details which may be useful for QC, as included in exports of the log';
+
+update operations.deliverables_log
+   set qc_details = (
+        select jsonb_object_agg(key, value)
+          from jsonb_each(details)
+         where key in (
+            -- wa doh linelist details
+            '_provenance',
+            'record_id',
+            'study_arm',
+            'date_tested',
+            'test_result',
+            'collection_date',
+            'redcap_event_name',
+
+            -- return of results details
+            'result_ts',
+            'swab_type',
+            'collect_ts',
+            'status_code',
+            'staff_observed',
+            'pre_analytical_specimen_collection'));
+
+create index deliverables_log_process_name_sent_idx
+    on operations.deliverables_log (process_name, sent);
+
+commit;
@@ -0,0 +1,25 @@
+-- Deploy seattleflu/id3c-customizations:operations/materialized_view_refresh_log to pg
+-- requires: operations/schema
+
+begin;
+
+create table operations.materialized_view_refresh_log (
+    materialized_view_refresh_log_id integer primary key generated by default as identity,
+    materialized_view text not null,
+    concurrent boolean not null,
+    started timestamp with time zone not null,
+    duration interval not null,
+    rows bigint not null
+);
+
+comment on table operations.materialized_view_refresh_log is 'A log of materialized view refreshes, used for tracking refresh times';
+comment on column operations.materialized_view_refresh_log.materialized_view_refresh_log_id is 'Internal id of this log entry';
+comment on column operations.materialized_view_refresh_log.materialized_view is 'Schema-qualified name of the refreshed materialized view';
+comment on column operations.materialized_view_refresh_log.concurrent is 'Whether the view was refreshed concurrently, without locking out readers';
+comment on column operations.materialized_view_refresh_log.started is 'When the refresh started';
+comment on column operations.materialized_view_refresh_log.duration is 'How long the refresh took';
+comment on column operations.materialized_view_refresh_log.rows is 'Number of rows in the view after the refresh';
+
+create index materialized_view_refresh_log_materialized_view_started_idx on operations.materialized_view_refresh_log (materialized_view, started);
+
+commit;
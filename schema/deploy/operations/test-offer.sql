@@ -0,0 +1,33 @@
+-- Deploy seattleflu/id3c-customizations:operations/test-offer to pg
+-- requires: operations/schema
+
+begin;
+
+create table operations.test_offer (
+    test_offer_id integer primary key generated by default as identity,
+    individual text not null,
+    redcap_url text not null,
+    redcap_project_id text not null,
+    redcap_record_id text not null,
+    redcap_event_name text not null,
+    redcap_repeat_instance text,
+    priority integer not null,
+    priority_reason text not null,
+    offered timestamp with time zone not null default now()
+);
+
+comment on table operations.test_offer is 'A ledger of offers of testing made by updating REDCap records, used to avoid re-offering before REDCap data round trips';
+comment on column operations.test_offer.test_offer_id is 'Internal id of this offer';
+comment on column operations.test_offer.individual is 'Identifier of the individual offered testing, as in the priority queue';
+comment on column operations.test_offer.redcap_url is 'URL of the REDCap instance of the updated record';
+comment on column operations.test_offer.redcap_project_id is 'Id of the REDCap project of the updated record';
+comment on column operations.test_offer.redcap_record_id is 'Id of the updated REDCap record';
+comment on column operations.test_offer.redcap_event_name is 'Event of the updated REDCap record';
+comment on column operations.test_offer.redcap_repeat_instance is 'Repeat instance of the updated REDCap record';
+comment on column operations.test_offer.priority is 'Priority of the individual in the queue when offered testing';
+comment on column operations.test_offer.priority_reason is 'Reason for the priority of the individual in the queue when offered testing';
+comment on column operations.test_offer.offered is 'When testing was offered';
+
+create index test_offer_individual_offered_idx on operations.test_offer (individual, offered);
+
+commit;
@@ -17,11 +17,19 @@ grant insert (document)
     to "uw-priority-queue-processor";
 
 grant select
-    on table shipping.uw_priority_queue_v1, operations.test_quota
+    on table shipping.uw_priority_queue_v1, shipping.__uw_priority_queue, operations.test_quota
+    to "uw-priority-queue-processor";
+
+grant execute
+    on function shipping.refresh_uw_priority_queue
     to "uw-priority-queue-processor";
 
 grant update (used)
     on table operations.test_quota
     to "uw-priority-queue-processor";
 
+grant select, insert
+    on table operations.test_offer
+    to "uw-priority-queue-processor";
+
 commit;
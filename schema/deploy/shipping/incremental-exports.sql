@@ -0,0 +1,18 @@
+-- Deploy seattleflu/id3c-customizations:shipping/incremental-exports to pg
+-- requires: shipping/latest_results
+
+begin;
+
+-- A stable, indexed key and timestamp for the keyset-paginated (after=) and
+-- incremental (since=) variants of the latest results export.  The HCT
+-- Tableau results export is keyed by its view, see shipping/views.
+
+alter table shipping.latest_results
+    add column latest_result_id bigint generated by default as identity primary key;
+
+create index latest_results_created_idx on shipping.latest_results (created);
+
+comment on column shipping.latest_results.latest_result_id is
+    'Internal id of this record, used as the key for paginating exports';
+
+commit;
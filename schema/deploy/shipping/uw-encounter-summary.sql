@@ -0,0 +1,253 @@
+-- Deploy seattleflu/id3c-customizations:shipping/uw-encounter-summary to pg
+-- requires: seattleflu/schema:shipping/schema
+
+begin;
+
+-- An incrementally maintained replacement for the shipping.__uw_encounters
+-- materialized view, which was rebuilt from scratch on every refresh.
+--
+-- Triggers on warehouse.encounter and warehouse.sample queue the ids of HCT
+-- encounters whose questionnaire responses or samples change, and the
+-- `refresh-uw-encounters` command recomputes the summaries of only those
+-- encounters.
+
+create table shipping.__uw_encounter_summary (
+    encounter_id integer primary key,
+    individual text not null,
+    encountered date not null,
+    redcap_url text,
+    redcap_project_id text,
+    redcap_record_id text,
+    redcap_event_name text,
+    redcap_repeat_instance text,
+    screen_positive boolean,
+    daily_symptoms boolean,
+    daily_exposure boolean,
+    daily_exposure_known_pos text,
+    daily_travel text,
+    testing_trigger boolean,
+    surge_selected_flag boolean,
+    sample_collection_date date,
+    prior_test_positive_date date
+);
+
+create index __uw_encounter_summary_individual_idx on shipping.__uw_encounter_summary (individual);
+create index __uw_encounter_summary_encountered_idx on shipping.__uw_encounter_summary (encountered);
+
+comment on table shipping.__uw_encounter_summary is
+  'Records from the encounter arm of the UW Reopening project with key questionnaire values, maintained incrementally by the refresh-uw-encounters command';
+
+
+create table shipping.__uw_encounter_summary_changes (
+    change_id bigint primary key generated always as identity,
+    encounter_id integer not null,
+    changed timestamp with time zone not null default now()
+);
+
+comment on table shipping.__uw_encounter_summary_changes is
+  'Queue of encounters whose summaries in shipping.__uw_encounter_summary are out of date, consumed by the refresh-uw-encounters command';
+
+
+create function shipping.uw_encounter_summaries(encounter_ids integer[]) returns setof shipping.__uw_encounter_summary as $$
+    with encounters as (
+        select encounter_id,
+               individual_id,
+               encountered,
+               details
+          from warehouse.encounter
+         where (encounter_ids is null or encounter_id = any(encounter_ids))
+           and (identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+             or identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%')
+    ),
+
+    -- Only the responses summarized below, aggregated as in
+    -- shipping.fhir_questionnaire_responses_v1
+    responses as (
+        select encounter_id,
+               "linkId" as link_id,
+               array_remove(array_agg("valueString" order by "valueString"), null) as string_response,
+               bool_and("valueBoolean") as boolean_response,
+               array_remove(array_agg("valueDate" order by "valueDate"), null) as date_response
+          from encounters,
+               jsonb_to_recordset(details -> 'QuestionnaireResponse') as q("item" jsonb),
+               jsonb_to_recordset("item") as response("linkId" text, "answer" jsonb),
+               jsonb_to_recordset("answer") as answer("valueString" text,
+                                                      "valueBoolean" bool,
+                                                      "valueDate" text)
+         where "linkId" in ('screen_positive',
+                            'daily_symptoms',
+                            'daily_exposure',
+                            'daily_exposure_known_pos',
+                            'daily_travel',
+                            'testing_trigger',
+                            'surge_selected_flag',
+                            'prior_test_positive_date')
+         group by encounter_id, link_id
+    ),
+
+    questionnaires as (
+        select encounter_id,
+               (array_agg(boolean_response) filter (where link_id = 'screen_positive'))[1] as screen_positive,
+               (array_agg(boolean_response) filter (where link_id = 'daily_symptoms'))[1] as daily_symptoms,
+               case
+                   when count(*) filter (where link_id = 'daily_exposure') = 0 then null
+                   when (array_agg(string_response[1]) filter (where link_id = 'daily_exposure'))[1] in ('yes', 'yes_vac') then true
+                   else false
+               end as daily_exposure,
+               (array_agg(string_response[1]) filter (where link_id = 'daily_exposure_known_pos'))[1] as daily_exposure_known_pos,
+               (array_agg(string_response[1]) filter (where link_id = 'daily_travel'))[1] as daily_travel,
+               (array_agg(boolean_response) filter (where link_id = 'testing_trigger'))[1] as testing_trigger,
+               (array_agg(boolean_response) filter (where link_id = 'surge_selected_flag'))[1] as surge_selected_flag,
+               (array_agg(date_response[1]) filter (where link_id = 'prior_test_positive_date'))[1]::date as prior_test_positive_date
+          from responses
+         group by encounter_id
+    ),
+
+    samples as (
+        select encounter_id,
+               max(collected)::date as sample_collection_date
+          from warehouse.sample
+         where encounter_id in (select encounter_id from encounters)
+         group by encounter_id
+    )
+
+    select encounters.encounter_id,
+           individual.identifier as individual,
+           encounters.encountered::date as encountered,
+           jsonb_extract_path_text(encounters.details, '_provenance', 'redcap', 'url') as redcap_url,
+           jsonb_extract_path_text(encounters.details, '_provenance', 'redcap', 'project_id') as redcap_project_id,
+           jsonb_extract_path_text(encounters.details, '_provenance', 'redcap', 'record_id') as redcap_record_id,
+           jsonb_extract_path_text(encounters.details, '_provenance', 'redcap', 'event_name') as redcap_event_name,
+           jsonb_extract_path_text(encounters.details, '_provenance', 'redcap', 'repeat_instance') as redcap_repeat_instance,
+           screen_positive,
+           daily_symptoms,
+           daily_exposure,
+           daily_exposure_known_pos,
+           daily_travel,
+           testing_trigger,
+           surge_selected_flag,
+           sample_collection_date,
+           prior_test_positive_date
+      from encounters
+      join warehouse.individual using (individual_id)
+      left join questionnaires using (encounter_id)
+      left join samples using (encounter_id)
+$$
+language sql
+stable;
+
+comment on function shipping.uw_encounter_summaries is
+  'Computes the rows of shipping.__uw_encounter_summary for the given encounters, or all encounters if null';
+
+
+-- Transition tables let each statement queue all of its changed rows at
+-- once, which keeps bulk imports fast.  The functions run as their owner so
+-- that the roles modifying encounters and samples don't need access to the
+-- queue.
+create function shipping.queue_uw_encounter_changes() returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select encounter_id
+                  from new_encounters
+                 where identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+
+        elsif tg_op = 'UPDATE' then
+            -- Old rows catch encounters which no longer match
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select encounter_id
+                  from new_encounters
+                 where identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%'
+                 union
+                select encounter_id
+                  from old_encounters
+                 where identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+
+        elsif tg_op = 'DELETE' then
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select encounter_id
+                  from old_encounters
+                 where identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+        end if;
+
+        return null;
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+create function shipping.queue_uw_encounter_sample_changes() returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select distinct encounter_id
+                  from new_samples
+                  join warehouse.encounter using (encounter_id)
+                 where encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+
+        elsif tg_op = 'UPDATE' then
+            -- Old rows catch encounters which no longer match
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select distinct encounter_id
+                  from new_samples
+                  join warehouse.encounter using (encounter_id)
+                 where encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%'
+                 union
+                select distinct encounter_id
+                  from old_samples
+                  join warehouse.encounter using (encounter_id)
+                 where encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+
+        elsif tg_op = 'DELETE' then
+            insert into shipping.__uw_encounter_summary_changes (encounter_id)
+                select distinct encounter_id
+                  from old_samples
+                  join warehouse.encounter using (encounter_id)
+                 where encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
+                    or encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%';
+        end if;
+
+        return null;
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+create trigger queue_uw_encounter_changes_on_insert after insert on warehouse.encounter
+referencing new table as new_encounters
+for each statement execute procedure shipping.queue_uw_encounter_changes();
+
+create trigger queue_uw_encounter_changes_on_update after update on warehouse.encounter
+referencing old table as old_encounters new table as new_encounters
+for each statement execute procedure shipping.queue_uw_encounter_changes();
+
+create trigger queue_uw_encounter_changes_on_delete after delete on warehouse.encounter
+referencing old table as old_encounters
+for each statement execute procedure shipping.queue_uw_encounter_changes();
+
+create trigger queue_uw_encounter_changes_on_insert after insert on warehouse.sample
+referencing new table as new_samples
+for each statement execute procedure shipping.queue_uw_encounter_sample_changes();
+
+create trigger queue_uw_encounter_changes_on_update after update on warehouse.sample
+referencing old table as old_samples new table as new_samples
+for each statement execute procedure shipping.queue_uw_encounter_sample_changes();
+
+create trigger queue_uw_encounter_changes_on_delete after delete on warehouse.sample
+referencing old table as old_samples
+for each statement execute procedure shipping.queue_uw_encounter_sample_changes();
+
+
+insert into shipping.__uw_encounter_summary
+    select * from shipping.uw_encounter_summaries(null);
+
+commit;
@@ -0,0 +1,594 @@
+-- Deploy seattleflu/id3c-customizations:shipping/uw-priority-queue to pg
+-- requires: shipping/views
+-- requires: shipping/uw-encounter-summary
+
+begin;
+
+-- A persistent, indexed copy of shipping.uw_priority_queue_v1, so that
+-- offering testing takes the head of the queue with an index scan instead of
+-- re-ranking every enrollment and encounter.
+--
+-- Triggers queue the individuals whose encounters, enrollments or hCoV-19
+-- results change, and shipping.refresh_uw_priority_queue() rescores only
+-- those individuals.  Priorities also depend on the current date, so the
+-- first refresh of each day rescores everyone.
+
+create function shipping.uw_priority_queue_entries(individuals text[])
+returns table (
+    redcap_url text,
+    redcap_project_id text,
+    redcap_record_id text,
+    redcap_event_name text,
+    redcap_repeat_instance text,
+    encountered date,
+    individual text,
+    latest_invite_date date,
+    latest_collection_date date,
+    priority integer,
+    priority_reason text
+) as $$
+    with uw_individual_summaries as (
+	    select
+		    individual,
+		    max(encountered) filter (where testing_trigger is true) as latest_invite_date,
+		    max(sample_collection_date) filter (where sample_collection_date is not null) as latest_collection_date,
+		    count(*) filter (where testing_trigger is true) as invitation_count,
+		    max(sample_collection_date) filter (where pa.present = true) as latest_positive_hcov19_collection_date,
+		    max(prior_test_positive_date) filter (where prior_test_positive_date is not null) as latest_prior_test_positive_date
+	    from shipping.__uw_encounter_summary as __uw_encounters
+	    left join warehouse.sample using (encounter_id)
+	    -- Lateral so that only the results of these samples are looked up
+	    left join lateral (
+	        select present
+	          from shipping.hcov19_presence_absence_result_v1
+	         where hcov19_presence_absence_result_v1.sample_id = sample.sample_id
+	    ) as pa on true
+	    where (individuals is null or individual = any(individuals))
+	    group by individual
+     ),
+
+    -- Only the enrollment responses used below, aggregated as in
+    -- shipping.uw_reopening_enrollment_fhir_encounter_details_v1
+    enrollment_responses as (
+        select
+            encounter.encounter_id,
+            individual.identifier as individual,
+            encounter.encountered,
+            encounter.details,
+            min("valueDate") filter (where "linkId" = 'prior_test_positive_date_base') as prior_test_positive_date_base,
+            min("valueString") filter (where "linkId" = 'on_campus_freq') as on_campus_freq,
+            min("valueString") filter (where "linkId" = 'added_surveillance_groups') as added_surveillance_groups,
+            min("valueString") filter (where "linkId" = 'alerts_off') as alerts_off
+        from warehouse.individual
+        join warehouse.encounter using (individual_id),
+             jsonb_to_recordset(encounter.details -> 'QuestionnaireResponse') as q("item" jsonb),
+             jsonb_to_recordset("item") as response("linkId" text, "answer" jsonb),
+             jsonb_to_recordset("answer") as answer("valueString" text, "valueDate" text)
+        where encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/'
+        and (individuals is null or individual.identifier = any(individuals))
+        and "linkId" != 'age'
+        group by encounter.encounter_id, individual.identifier
+    ),
+
+    uw_enrollments as (
+        select
+            encounter_id,
+            enrollment_responses.individual,
+            encountered::date as encountered,
+            jsonb_extract_path_text (details, '_provenance', 'redcap', 'url' ) as redcap_url,
+            jsonb_extract_path_text (details, '_provenance', 'redcap', 'project_id' ) as redcap_project_id,
+            jsonb_extract_path_text (details, '_provenance', 'redcap', 'record_id' ) as redcap_record_id,
+            jsonb_extract_path_text (details, '_provenance', 'redcap', 'event_name' ) as redcap_event_name,
+            jsonb_extract_path_text (details, '_provenance', 'redcap', 'repeat_instance' ) as redcap_repeat_instance,
+            latest_invite_date,
+            latest_collection_date,
+            coalesce(invitation_count, 0) as invitation_count,
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base::date as prior_test_positive_date_base,
+            on_campus_freq,
+            added_surveillance_groups,
+            alerts_off
+        from enrollment_responses
+        left join uw_individual_summaries on uw_individual_summaries.individual = enrollment_responses.individual
+    ),
+
+    -- Select encounters for testing based on positive daily attestations
+    positive_daily_attestations as (
+        select
+            __uw_encounters.redcap_url,
+            __uw_encounters.redcap_project_id,
+            __uw_encounters.redcap_record_id,
+            __uw_encounters.redcap_event_name,
+            __uw_encounters.redcap_repeat_instance,
+            __uw_encounters.encountered,
+            individual,
+            latest_invite_date,
+            latest_collection_date,
+            case
+                when daily_symptoms then 1
+
+                /* Why 2 days after attestation to exposures? We don't want
+                 * to offer testing too early after exposure and risk false
+                 * negatives. Per Trevor, we expect that a viral load high
+                 * enough to detect with PCR and be contagious is generally
+                 * centered on day 3 after exposure, though some will be
+                 * earlier and some later.  By offering testing at day 2, some
+                 * people will get tested that same day (day 2), most will
+                 * (hopefully) get tested the next day (day 3), and some others
+                 * by the day after that (day 4). This puts results being known
+                 * at days 3–5.
+                 * -trs, 19 Oct 2020
+
+                 * The `yes_now` option replaced `yes` in Winter Quarter 2021,
+                 * with the wording for `yes_now` being `Yes, I was exposed to COVID-19
+                 * in the last 48 hours`, but we kept both in the query so that the query
+                 * would work before and after the option change.
+                 */
+                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 1
+                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 1
+
+                /* The `yes_late` option takes care of the 48 hours. The option label is
+                 * `Yes, I was exposed to COVID-19 more than 48 hours ago`
+                 */
+                when daily_exposure_known_pos = 'yes_late' then 1
+                when daily_travel in ('yes_state', 'yes_country') then 1
+                else null -- The final SELECT at the end of the view drops records with a NULL priority
+            end as priority,
+            case
+                when daily_symptoms then 'symptomatic'
+                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 'exposure_to_known_positive'
+                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 'gathering_over_10'
+                when daily_exposure_known_pos = 'yes_late' then 'exposure_to_known_positive'
+                when daily_travel in ('yes_state', 'yes_country') then 'travel'
+                else null
+            end as priority_reason,
+
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base,
+            alerts_off
+        from shipping.__uw_encounter_summary as __uw_encounters
+        join uw_enrollments using (individual)
+        -- Filter to encounters within the last 7 days so we don't send invites for old attestations
+        where age(__uw_encounters.encountered) <= '7 days'
+        -- Filter to encounters for participants whose last invite was over 3 days before encounter
+        and (latest_invite_date is null or latest_invite_date < __uw_encounters.encountered - interval '3 days')
+        -- Filter to encounters for participants who have never had a sample collected or their last sample collection was over 3 days before encounter
+        and (latest_collection_date is null or latest_collection_date < __uw_encounters.encountered - interval '3 days')
+        -- Filter for instances that do no already have testing_trigger filled
+        and testing_trigger is null
+        -- Filter for postive daily attestations only
+        and screen_positive
+    ),
+
+    -- Select added_surveillance_groups if they are in the group for today
+    added_surveillance_groups as (
+        select
+            redcap_url,
+            redcap_project_id,
+            redcap_record_id,
+            redcap_event_name,
+            redcap_repeat_instance,
+            encountered,
+            individual,
+            latest_invite_date,
+            latest_collection_date,
+            2 as priority,
+            'surveillance' as priority_reason,
+
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base,
+            alerts_off
+        from uw_enrollments
+        -- Filter to added_surveillance_groups for today.
+        -- To_Char(current_date, 'day') returns a string padded to 9 characters, so trim it.
+        -- Example: where 'tuesday' = 'tuesday'
+        where added_surveillance_groups = trim(To_Char(current_date, 'day'))
+        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
+        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
+        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
+        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
+	  ),
+
+    -- Select enrollments for baseline testing
+    baseline as (
+        select
+            redcap_url,
+            redcap_project_id,
+            redcap_record_id,
+            redcap_event_name,
+            redcap_repeat_instance,
+            encountered,
+            individual,
+            latest_invite_date,
+            latest_collection_date,
+            4 as priority,
+            'baseline' as priority_reason,
+
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base,
+            alerts_off
+        from uw_enrollments
+        -- Filter to participants who enrolled after this date when
+        -- baseline test invitations were handled manually
+        where encountered > '2021-11-15'
+         -- Filter to enrollments have never had a sample collected
+        and latest_collection_date is null
+        -- Filter to enrollments that have been invited up to 2 times
+        and invitation_count < 2
+        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
+        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
+    ),
+
+    -- Select enrollments for surveillance testing
+    surveillance as (
+        select
+            redcap_url,
+            redcap_project_id,
+            redcap_record_id,
+            redcap_event_name,
+            redcap_repeat_instance,
+            encountered,
+            individual,
+            latest_invite_date,
+            latest_collection_date,
+            5 as priority,
+            'surveillance' as priority_reason,
+
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base,
+            alerts_off
+        from uw_enrollments
+        -- Filter to participants who come to campus
+        where (on_campus_freq != 'not_on_campus')
+        -- Filter to participants whose last invite was over 3 days before today
+        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
+        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
+        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
+    ),
+
+    /**
+    Select encounters for surge testing purposes.
+    Handled separately from daily attestation encounters because we want to
+    include all surge selected participants regardless of previous testing.
+    **/
+    surge_testing as (
+        select
+            __uw_encounters.redcap_url,
+            __uw_encounters.redcap_project_id,
+            __uw_encounters.redcap_record_id,
+            __uw_encounters.redcap_event_name,
+            __uw_encounters.redcap_repeat_instance,
+            __uw_encounters.encountered,
+            individual,
+            latest_invite_date,
+            latest_collection_date,
+            3 as priority,
+            'surge_testing' as priority_reason,
+
+            latest_positive_hcov19_collection_date,
+            latest_prior_test_positive_date,
+            prior_test_positive_date_base,
+            alerts_off
+        from shipping.__uw_encounter_summary as __uw_encounters
+        join uw_enrollments using (individual)
+        -- Filter for instances that have been selected with surge_selected_flag
+        where surge_selected_flag is true
+        -- Filter for instances that do no already have testing_trigger filled
+        and testing_trigger is null
+         -- Filter to encounters within the last 7 days so we don't send invites for old surges
+        and age(__uw_encounters.encountered) <= '7 days'
+    )
+
+    -- The final SELECT to UNION ALL results from each prioritization category and to filter
+    -- for clauses that are common across all prioritization categories.
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason
+    from
+    (
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
+    prior_test_positive_date_base, alerts_off
+    from positive_daily_attestations
+    where priority is not null
+
+    union all
+
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
+    prior_test_positive_date_base, alerts_off
+    from baseline
+
+    union all
+
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
+    prior_test_positive_date_base, alerts_off
+    from surveillance
+
+    union all
+
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
+    prior_test_positive_date_base, alerts_off
+    from surge_testing
+
+    union all
+
+    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
+    encountered, individual, latest_invite_date, latest_collection_date, priority,
+    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
+    prior_test_positive_date_base, alerts_off
+    from added_surveillance_groups
+    ) as a
+    where
+    -- Filter for participants who have not tested positive with us in the past 14 days
+    (latest_positive_hcov19_collection_date is null or latest_positive_hcov19_collection_date < current_date - interval '14 days')
+
+    -- Filter for participants who have not tested positive somewhere else (reported on daily attestation) in the past 14 days
+    and (latest_prior_test_positive_date is null or latest_prior_test_positive_date < current_date - interval '14 days')
+
+    -- Filter for participants who have not tested positive somewhere else (reported on enrollment) in the past 14 days
+    and (prior_test_positive_date_base is null or prior_test_positive_date_base < current_date - interval '14 days')
+
+    -- Filter for participants who will receive alerts from REDCap
+    -- Because those with this set to 'off' won't receive alerts, these invitations to test would be wasted because the
+    -- participants wouldn't know that they've been invited.
+    and (alerts_off is null or alerts_off <> 'off')
+$$
+language sql
+stable;
+
+comment on function shipping.uw_priority_queue_entries is
+  'Identifies the encounter instances of the given individuals, or all individuals if null, which indicate need for testing by UW reopening study (contains duplicate individuals)';
+
+
+create table shipping.__uw_priority_queue (
+    redcap_url text,
+    redcap_project_id text,
+    redcap_record_id text,
+    redcap_event_name text,
+    redcap_repeat_instance text,
+    encountered date,
+    individual text primary key,
+    latest_invite_date date,
+    latest_collection_date date,
+    priority integer not null,
+    priority_reason text not null
+);
+
+-- The order of shipping.uw_priority_queue_v1, by dates instead of their ages
+create index __uw_priority_queue_order_idx on shipping.__uw_priority_queue (
+    priority,
+    latest_invite_date nulls first,
+    latest_collection_date nulls first,
+    encountered,
+    individual
+);
+
+comment on table shipping.__uw_priority_queue is
+  'Deduplicated individuals that need to be tested by UW reopening study, maintained incrementally by shipping.refresh_uw_priority_queue()';
+
+create table shipping.__uw_priority_queue_changes (
+    change_id bigint primary key generated always as identity,
+    individual text not null,
+    changed timestamp with time zone not null default now()
+);
+
+comment on table shipping.__uw_priority_queue_changes is
+  'Queue of individuals whose entries in shipping.__uw_priority_queue are out of date, consumed by shipping.refresh_uw_priority_queue()';
+
+create table shipping.__uw_priority_queue_rescored (
+    rescored date not null
+);
+
+comment on table shipping.__uw_priority_queue_rescored is
+  'Date of the last full rescore of shipping.__uw_priority_queue, as a single row';
+
+
+create function shipping.refresh_uw_priority_queue(rescore_all boolean default false) returns integer as $$
+    declare
+        individuals text[];
+        rescored integer;
+    begin
+        -- Serializes refreshes without blocking readers of the queue
+        lock table shipping.__uw_priority_queue in share row exclusive mode;
+
+        if rescore_all or (select __uw_priority_queue_rescored.rescored from shipping.__uw_priority_queue_rescored) < current_date then
+            delete from shipping.__uw_priority_queue_changes;
+            delete from shipping.__uw_priority_queue;
+
+            insert into shipping.__uw_priority_queue
+                select distinct on (individual) *
+                  from shipping.uw_priority_queue_entries(null)
+                 -- As in shipping.uw_priority_queue_v1
+                 order by individual, priority asc nulls last, redcap_repeat_instance desc;
+
+            get diagnostics rescored = row_count;
+
+            update shipping.__uw_priority_queue_rescored set rescored = current_date;
+
+            return rescored;
+        end if;
+
+        with changes as (
+            delete from shipping.__uw_priority_queue_changes
+            returning individual
+        )
+        select array_agg(distinct individual) into individuals from changes;
+
+        if individuals is null then
+            return 0;
+        end if;
+
+        delete from shipping.__uw_priority_queue
+         where individual = any(individuals);
+
+        insert into shipping.__uw_priority_queue
+            select distinct on (individual) *
+              from shipping.uw_priority_queue_entries(individuals)
+             -- As in shipping.uw_priority_queue_v1
+             order by individual, priority asc nulls last, redcap_repeat_instance desc;
+
+        return cardinality(individuals);
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+comment on function shipping.refresh_uw_priority_queue is
+  'Rescores the individuals queued in shipping.__uw_priority_queue_changes, or everyone on the first refresh of the day or if rescore_all is true, and returns the number of individuals rescored';
+
+-- Execute is granted to "uw-priority-queue-processor" by
+-- roles/uw-priority-queue-processor/grants.
+revoke all
+  on function shipping.refresh_uw_priority_queue
+  from public;
+
+
+-- As for shipping.__uw_encounter_summary, triggers queue changes with
+-- transition tables and run as their owner.
+
+create function shipping.queue_uw_priority_queue_changes() returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct individual
+                  from new_summaries;
+        elsif tg_op = 'UPDATE' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select individual
+                  from new_summaries
+                 union
+                select individual
+                  from old_summaries;
+        elsif tg_op = 'DELETE' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct individual
+                  from old_summaries;
+        end if;
+        return null;
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+create function shipping.queue_uw_priority_queue_enrollment_changes() returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct individual.identifier
+                  from new_encounters
+                  join warehouse.individual using (individual_id)
+                 where new_encounters.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/';
+        elsif tg_op = 'UPDATE' then
+            -- Old rows catch enrollments which no longer match
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select individual.identifier
+                  from new_encounters
+                  join warehouse.individual using (individual_id)
+                 where new_encounters.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/'
+                 union
+                select individual.identifier
+                  from old_encounters
+                  join warehouse.individual using (individual_id)
+                 where old_encounters.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/';
+        elsif tg_op = 'DELETE' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct individual.identifier
+                  from old_encounters
+                  join warehouse.individual using (individual_id)
+                 where old_encounters.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/';
+        end if;
+        return null;
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+create function shipping.queue_uw_priority_queue_result_changes() returns trigger as $$
+    begin
+        if tg_op = 'INSERT' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct __uw_encounter_summary.individual
+                  from new_results
+                  join warehouse.sample using (sample_id)
+                  join shipping.__uw_encounter_summary using (encounter_id);
+        elsif tg_op = 'UPDATE' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select __uw_encounter_summary.individual
+                  from new_results
+                  join warehouse.sample using (sample_id)
+                  join shipping.__uw_encounter_summary using (encounter_id)
+                 union
+                select __uw_encounter_summary.individual
+                  from old_results
+                  join warehouse.sample using (sample_id)
+                  join shipping.__uw_encounter_summary using (encounter_id);
+        elsif tg_op = 'DELETE' then
+            insert into shipping.__uw_priority_queue_changes (individual)
+                select distinct __uw_encounter_summary.individual
+                  from old_results
+                  join warehouse.sample using (sample_id)
+                  join shipping.__uw_encounter_summary using (encounter_id);
+        end if;
+        return null;
+    end;
+$$
+language plpgsql
+security definer
+set search_path = pg_catalog, pg_temp; -- tests/search-path: ignore
+
+create trigger queue_uw_priority_queue_changes_on_insert after insert on shipping.__uw_encounter_summary
+referencing new table as new_summaries
+for each statement execute procedure shipping.queue_uw_priority_queue_changes();
+
+create trigger queue_uw_priority_queue_changes_on_update after update on shipping.__uw_encounter_summary
+referencing old table as old_summaries new table as new_summaries
+for each statement execute procedure shipping.queue_uw_priority_queue_changes();
+
+create trigger queue_uw_priority_queue_changes_on_delete after delete on shipping.__uw_encounter_summary
+referencing old table as old_summaries
+for each statement execute procedure shipping.queue_uw_priority_queue_changes();
+
+create trigger queue_uw_priority_queue_changes_on_insert after insert on warehouse.encounter
+referencing new table as new_encounters
+for each statement execute procedure shipping.queue_uw_priority_queue_enrollment_changes();
+
+create trigger queue_uw_priority_queue_changes_on_update after update on warehouse.encounter
+referencing old table as old_encounters new table as new_encounters
+for each statement execute procedure shipping.queue_uw_priority_queue_enrollment_changes();
+
+create trigger queue_uw_priority_queue_changes_on_delete after delete on warehouse.encounter
+referencing old table as old_encounters
+for each statement execute procedure shipping.queue_uw_priority_queue_enrollment_changes();
+
+create trigger queue_uw_priority_queue_changes_on_insert after insert on warehouse.presence_absence
+referencing new table as new_results
+for each statement execute procedure shipping.queue_uw_priority_queue_result_changes();
+
+create trigger queue_uw_priority_queue_changes_on_update after update on warehouse.presence_absence
+referencing old table as old_results new table as new_results
+for each statement execute procedure shipping.queue_uw_priority_queue_result_changes();
+
+create trigger queue_uw_priority_queue_changes_on_delete after delete on warehouse.presence_absence
+referencing old table as old_results
+for each statement execute procedure shipping.queue_uw_priority_queue_result_changes();
+
+insert into shipping.__uw_priority_queue_rescored values ('-infinity');
+
+select shipping.refresh_uw_priority_queue();
+
+commit;
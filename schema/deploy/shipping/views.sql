@@ -1,5 +1,7 @@
 -- Deploy seattleflu/id3c-customizations:shipping/views to pg
 -- requires: seattleflu/schema:shipping/schema
+-- requires: shipping/uw-encounter-summary
+-- requires: shipping/uw-priority-queue
 
 -- Hello!  All shipping views are defined here.  Rework this change with Sqitch
 -- to change a view definition or add new views.  This workflow helps keep
@@ -30,6 +32,7 @@ drop materialized view if exists shipping.__uw_encounters;
 drop view if exists shipping.uw_reopening_ehs_reporting_v1;
 drop view if exists shipping.uw_reopening_encounters_v1;
 drop view if exists shipping.uw_reopening_encounters_hct_data_pulls;
+drop view if exists shipping.uw_reopening_results_hct_data_pulls_v2;
 drop view if exists shipping.uw_reopening_enrollment_fhir_encounter_details_v1;
 
 drop view if exists shipping.scan_return_results_v1;
@@ -3739,6 +3742,42 @@ grant select
   on shipping.uw_reopening_results_hct_data_pulls
   to "incidence-modeler";
 
+create or replace view shipping.uw_reopening_results_hct_data_pulls_v2 with (security_invoker = true) as
+(
+  with encounters as
+      (
+      select encounter_id
+      , individual_id
+      from warehouse.encounter
+      where
+          encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%' or
+          encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%'
+      )
+
+  select
+      presence_absence.presence_absence_id,
+      encounters.individual_id as individual_id,
+      sample.identifier as sfs_sample_identifier,
+      target.identifier as target_identifier,
+      presence_absence.present
+  from
+      warehouse.sample join
+      warehouse.presence_absence using (sample_id) join
+      warehouse.target using (target_id) join
+      encounters using (encounter_id)
+);
+
+comment on view shipping.uw_reopening_results_hct_data_pulls_v2 is
+  'For the UW reopening project, a view providing relevant results data for chu lab data pulls, keyed by presence_absence_id';
+
+revoke all
+on shipping.uw_reopening_results_hct_data_pulls_v2
+from "incidence-modeler";
+
+grant select
+  on shipping.uw_reopening_results_hct_data_pulls_v2
+  to "incidence-modeler";
+
 create or replace view shipping.uw_reopening_encounters_hct_data_pulls with (security_invoker = true) as
 (
   with enrollments as
@@ -3869,340 +3908,11 @@ comment on view shipping.uw_reopening_ehs_reporting_v1 is
   to "ehs-results-exporter";
 
 
-create materialized view shipping.__uw_encounters as (
-  select
-    encounter.encounter_id
-    , individual.identifier as individual
-    , encounter.encountered::date as encountered
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'url' ) as redcap_url
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'project_id' ) as redcap_project_id
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'record_id' ) as redcap_record_id
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'event_name' ) as redcap_event_name
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'repeat_instance' ) as redcap_repeat_instance
-    , q_screen_positive.boolean_response as screen_positive
-    , q_daily_symptoms.boolean_response as daily_symptoms
-    , case when q_daily_exposure.encounter_id is null then null when q_daily_exposure.string_response[1] in ('yes', 'yes_vac') then true else false end as daily_exposure
-    , q_daily_exposure_known_pos.string_response[1] as daily_exposure_known_pos
-    , q_daily_travel.string_response[1] as daily_travel
-    , q_testing_trigger.boolean_response as testing_trigger
-    , q_surge_selected_flag.boolean_response as surge_selected_flag
-    , (select max(collected)::date from warehouse.sample where encounter_id = encounter.encounter_id group by encounter_id) as sample_collection_date
-    , q_prior_test_positive_date.date_response[1]::date as prior_test_positive_date
-	from warehouse.encounter
-	join warehouse.individual using (individual_id)
-	left join shipping.fhir_questionnaire_responses_v1 q_screen_positive on q_screen_positive.encounter_id = encounter.encounter_id and q_screen_positive.link_id = 'screen_positive'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_symptoms on q_daily_symptoms.encounter_id = encounter.encounter_id and q_daily_symptoms.link_id = 'daily_symptoms'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_exposure on q_daily_exposure.encounter_id = encounter.encounter_id and q_daily_exposure.link_id = 'daily_exposure'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_exposure_known_pos on q_daily_exposure_known_pos.encounter_id = encounter.encounter_id and q_daily_exposure_known_pos.link_id = 'daily_exposure_known_pos'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_travel on q_daily_travel.encounter_id = encounter.encounter_id and q_daily_travel.link_id = 'daily_travel'
-	left join shipping.fhir_questionnaire_responses_v1 q_testing_trigger on q_testing_trigger.encounter_id = encounter.encounter_id and q_testing_trigger.link_id = 'testing_trigger'
-	left join shipping.fhir_questionnaire_responses_v1 q_surge_selected_flag on q_surge_selected_flag.encounter_id = encounter.encounter_id and q_surge_selected_flag.link_id = 'surge_selected_flag'
-	left join shipping.fhir_questionnaire_responses_v1 q_prior_test_positive_date on q_prior_test_positive_date.encounter_id = encounter.encounter_id and q_prior_test_positive_date.link_id = 'prior_test_positive_date'
-	where
-            encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
-    or
-            encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%'
-)
-;
-
-create unique index __uw_encounters_unique_encounter_id on shipping.__uw_encounters (encounter_id);
-
-comment on materialized view shipping.__uw_encounters is
-  'Pull records from the encounter arm of the UW Reopening project. Include key questionnaire values.';
-
-
 create or replace view shipping.__uw_priority_queue_v1 with (security_invoker = true) as (
-    with uw_individual_summaries as (
-	    select
-		    individual,
-		    max(encountered) filter (where testing_trigger is true) as latest_invite_date,
-		    max(sample_collection_date) filter (where sample_collection_date is not null) as latest_collection_date,
-		    count(*) filter (where testing_trigger is true) as invitation_count,
-		    max(sample_collection_date) filter (where pa.present = true) as latest_positive_hcov19_collection_date,
-		    max(prior_test_positive_date) filter (where prior_test_positive_date is not null) as latest_prior_test_positive_date
-	    from shipping.__uw_encounters
-	    left join warehouse.sample using (encounter_id)
-	    left join shipping.hcov19_presence_absence_result_v1 pa using (sample_id)
-	    group by individual
-     ),
-
-    uw_enrollments as (
-        select
-            encounter.encounter_id,
-            individual.identifier as individual,
-            encounter.encountered::date as encountered,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'url' ) as redcap_url,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'project_id' ) as redcap_project_id,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'record_id' ) as redcap_record_id,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'event_name' ) as redcap_event_name,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'repeat_instance' ) as redcap_repeat_instance,
-            latest_invite_date,
-            latest_collection_date,
-            coalesce(invitation_count, 0) as invitation_count,
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base::date as prior_test_positive_date_base,
-            on_campus_freq,
-            added_surveillance_groups,
-            alerts_off
-        from warehouse.encounter
-        join warehouse.individual using (individual_id)
-        join shipping.uw_reopening_enrollment_fhir_encounter_details_v1 using (encounter_id)
-        left join uw_individual_summaries on uw_individual_summaries.individual = individual.identifier
-        where encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/'
-    ),
-
-    -- Select encounters for testing based on positive daily attestations
-    positive_daily_attestations as (
-        select
-            __uw_encounters.redcap_url,
-            __uw_encounters.redcap_project_id,
-            __uw_encounters.redcap_record_id,
-            __uw_encounters.redcap_event_name,
-            __uw_encounters.redcap_repeat_instance,
-            __uw_encounters.encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            case
-                when daily_symptoms then 1
-
-                /* Why 2 days after attestation to exposures? We don't want
-                 * to offer testing too early after exposure and risk false
-                 * negatives. Per Trevor, we expect that a viral load high
-                 * enough to detect with PCR and be contagious is generally
-                 * centered on day 3 after exposure, though some will be
-                 * earlier and some later.  By offering testing at day 2, some
-                 * people will get tested that same day (day 2), most will
-                 * (hopefully) get tested the next day (day 3), and some others
-                 * by the day after that (day 4). This puts results being known
-                 * at days 3–5.
-                 * -trs, 19 Oct 2020
-
-                 * The `yes_now` option replaced `yes` in Winter Quarter 2021,
-                 * with the wording for `yes_now` being `Yes, I was exposed to COVID-19
-                 * in the last 48 hours`, but we kept both in the query so that the query
-                 * would work before and after the option change.
-                 */
-                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 1
-                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 1
-
-                /* The `yes_late` option takes care of the 48 hours. The option label is
-                 * `Yes, I was exposed to COVID-19 more than 48 hours ago`
-                 */
-                when daily_exposure_known_pos = 'yes_late' then 1
-                when daily_travel in ('yes_state', 'yes_country') then 1
-                else null -- The final SELECT at the end of the view drops records with a NULL priority
-            end as priority,
-            case
-                when daily_symptoms then 'symptomatic'
-                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 'exposure_to_known_positive'
-                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 'gathering_over_10'
-                when daily_exposure_known_pos = 'yes_late' then 'exposure_to_known_positive'
-                when daily_travel in ('yes_state', 'yes_country') then 'travel'
-                else null
-            end as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from shipping.__uw_encounters
-        join uw_enrollments using (individual)
-        -- Filter to encounters within the last 7 days so we don't send invites for old attestations
-        where age(__uw_encounters.encountered) <= '7 days'
-        -- Filter to encounters for participants whose last invite was over 3 days before encounter
-        and (latest_invite_date is null or latest_invite_date < __uw_encounters.encountered - interval '3 days')
-        -- Filter to encounters for participants who have never had a sample collected or their last sample collection was over 3 days before encounter
-        and (latest_collection_date is null or latest_collection_date < __uw_encounters.encountered - interval '3 days')
-        -- Filter for instances that do no already have testing_trigger filled
-        and testing_trigger is null
-        -- Filter for postive daily attestations only
-        and screen_positive
-    ),
-
-    -- Select added_surveillance_groups if they are in the group for today
-    added_surveillance_groups as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            2 as priority,
-            'surveillance' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to added_surveillance_groups for today.
-        -- To_Char(current_date, 'day') returns a string padded to 9 characters, so trim it.
-        -- Example: where 'tuesday' = 'tuesday'
-        where added_surveillance_groups = trim(To_Char(current_date, 'day'))
-        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
-        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
-	  ),
-
-    -- Select enrollments for baseline testing
-    baseline as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            4 as priority,
-            'baseline' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to participants who enrolled after this date when
-        -- baseline test invitations were handled manually
-        where encountered > '2021-11-15'
-         -- Filter to enrollments have never had a sample collected
-        and latest_collection_date is null
-        -- Filter to enrollments that have been invited up to 2 times
-        and invitation_count < 2
-        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-    ),
-
-    -- Select enrollments for surveillance testing
-    surveillance as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            5 as priority,
-            'surveillance' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to participants who come to campus
-        where (on_campus_freq != 'not_on_campus')
-        -- Filter to participants whose last invite was over 3 days before today
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
-        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
-    ),
-
-    /**
-    Select encounters for surge testing purposes.
-    Handled separately from daily attestation encounters because we want to
-    include all surge selected participants regardless of previous testing.
-    **/
-    surge_testing as (
-        select
-            __uw_encounters.redcap_url,
-            __uw_encounters.redcap_project_id,
-            __uw_encounters.redcap_record_id,
-            __uw_encounters.redcap_event_name,
-            __uw_encounters.redcap_repeat_instance,
-            __uw_encounters.encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            3 as priority,
-            'surge_testing' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from shipping.__uw_encounters
-        join uw_enrollments using (individual)
-        -- Filter for instances that have been selected with surge_selected_flag
-        where surge_selected_flag is true
-        -- Filter for instances that do no already have testing_trigger filled
-        and testing_trigger is null
-         -- Filter to encounters within the last 7 days so we don't send invites for old surges
-        and age(__uw_encounters.encountered) <= '7 days'
-    )
-
-    -- The final SELECT to UNION ALL results from each prioritization category and to filter
-    -- for clauses that are common across all prioritization categories.
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason
-    from
-    (
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from positive_daily_attestations
-    where priority is not null
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from baseline
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from surveillance
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from surge_testing
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from added_surveillance_groups
-    ) as a
-    where
-    -- Filter for participants who have not tested positive with us in the past 14 days
-    (latest_positive_hcov19_collection_date is null or latest_positive_hcov19_collection_date < current_date - interval '14 days')
-
-    -- Filter for participants who have not tested positive somewhere else (reported on daily attestation) in the past 14 days
-    and (latest_prior_test_positive_date is null or latest_prior_test_positive_date < current_date - interval '14 days')
-
-    -- Filter for participants who have not tested positive somewhere else (reported on enrollment) in the past 14 days
-    and (prior_test_positive_date_base is null or prior_test_positive_date_base < current_date - interval '14 days')
-
-    -- Filter for participants who will receive alerts from REDCap
-    -- Because those with this set to 'off' won't receive alerts, these invitations to test would be wasted because the
-    -- participants wouldn't know that they've been invited.
-    and (alerts_off is null or alerts_off <> 'off')
+    -- Defined by a function so that shipping.refresh_uw_priority_queue() can
+    -- rescore only some individuals
+    select *
+    from shipping.uw_priority_queue_entries(null)
 )
 ;
 
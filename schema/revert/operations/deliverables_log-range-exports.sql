@@ -0,0 +1,10 @@
+-- Revert seattleflu/id3c-customizations:operations/deliverables_log-range-exports from pg
+
+begin;
+
+drop index operations.deliverables_log_process_name_sent_idx;
+
+alter table operations.deliverables_log
+    drop column qc_details;
+
+commit;
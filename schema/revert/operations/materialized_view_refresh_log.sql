@@ -0,0 +1,7 @@
+-- Revert seattleflu/id3c-customizations:operations/materialized_view_refresh_log from pg
+
+begin;
+
+drop table if exists operations.materialized_view_refresh_log;
+
+commit;
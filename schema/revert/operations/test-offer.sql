@@ -0,0 +1,7 @@
+-- Revert seattleflu/id3c-customizations:operations/test-offer from pg
+
+begin;
+
+drop table operations.test_offer;
+
+commit;
@@ -0,0 +1,10 @@
+-- Revert seattleflu/id3c-customizations:shipping/incremental-exports from pg
+
+begin;
+
+drop index shipping.latest_results_created_idx;
+
+alter table shipping.latest_results
+    drop column latest_result_id;
+
+commit;
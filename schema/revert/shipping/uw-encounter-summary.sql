@@ -0,0 +1,19 @@
+-- Revert seattleflu/id3c-customizations:shipping/uw-encounter-summary from pg
+
+begin;
+
+drop trigger queue_uw_encounter_changes_on_delete on warehouse.sample;
+drop trigger queue_uw_encounter_changes_on_update on warehouse.sample;
+drop trigger queue_uw_encounter_changes_on_insert on warehouse.sample;
+drop trigger queue_uw_encounter_changes_on_delete on warehouse.encounter;
+drop trigger queue_uw_encounter_changes_on_update on warehouse.encounter;
+drop trigger queue_uw_encounter_changes_on_insert on warehouse.encounter;
+
+drop function shipping.queue_uw_encounter_sample_changes;
+drop function shipping.queue_uw_encounter_changes;
+drop function shipping.uw_encounter_summaries;
+
+drop table shipping.__uw_encounter_summary_changes;
+drop table shipping.__uw_encounter_summary;
+
+commit;
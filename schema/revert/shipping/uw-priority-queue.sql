@@ -0,0 +1,27 @@
+-- Revert seattleflu/id3c-customizations:shipping/uw-priority-queue from pg
+
+begin;
+
+drop trigger queue_uw_priority_queue_changes_on_insert on warehouse.presence_absence;
+drop trigger queue_uw_priority_queue_changes_on_update on warehouse.presence_absence;
+drop trigger queue_uw_priority_queue_changes_on_delete on warehouse.presence_absence;
+
+drop trigger queue_uw_priority_queue_changes_on_insert on warehouse.encounter;
+drop trigger queue_uw_priority_queue_changes_on_update on warehouse.encounter;
+drop trigger queue_uw_priority_queue_changes_on_delete on warehouse.encounter;
+
+drop trigger queue_uw_priority_queue_changes_on_insert on shipping.__uw_encounter_summary;
+drop trigger queue_uw_priority_queue_changes_on_update on shipping.__uw_encounter_summary;
+drop trigger queue_uw_priority_queue_changes_on_delete on shipping.__uw_encounter_summary;
+
+drop function shipping.queue_uw_priority_queue_result_changes();
+drop function shipping.queue_uw_priority_queue_enrollment_changes();
+drop function shipping.queue_uw_priority_queue_changes();
+drop function shipping.refresh_uw_priority_queue(boolean);
+drop function shipping.uw_priority_queue_entries(text[]);
+
+drop table shipping.__uw_priority_queue_rescored;
+drop table shipping.__uw_priority_queue_changes;
+drop table shipping.__uw_priority_queue;
+
+commit;
@@ -1,5 +1,7 @@
 -- Deploy seattleflu/id3c-customizations:shipping/views to pg
 -- requires: seattleflu/schema:shipping/schema
+-- requires: shipping/uw-encounter-summary
+-- requires: shipping/uw-priority-queue
 
 -- Hello!  All shipping views are defined here.  Rework this change with Sqitch
 -- to change a view definition or add new views.  This workflow helps keep
@@ -30,6 +32,7 @@ drop materialized view if exists shipping.__uw_encounters;
 drop view if exists shipping.uw_reopening_ehs_reporting_v1;
 drop view if exists shipping.uw_reopening_encounters_v1;
 drop view if exists shipping.uw_reopening_encounters_hct_data_pulls;
+drop view if exists shipping.uw_reopening_results_hct_data_pulls_v2;
 drop view if exists shipping.uw_reopening_enrollment_fhir_encounter_details_v1;
 
 drop view if exists shipping.scan_return_results_v1;
@@ -71,7 +74,7 @@ drop view if exists shipping.sample_with_best_available_encounter_data_v1;
 
 
 /******************** VIEWS FOR INTERNAL USE ********************/
-create or replace view shipping.sample_with_best_available_encounter_data_v1 as
+create or replace view shipping.sample_with_best_available_encounter_data_v1 with (security_invoker = true) as
 
     with site_details as (
       select site_1.site_id,
@@ -209,7 +212,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.fhir_encounter_details_v1 as
+create or replace view shipping.fhir_encounter_details_v1 with (security_invoker = true) as
 
     with
         symptoms as (
@@ -297,7 +300,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.fhir_encounter_details_v2 as
+create or replace view shipping.fhir_encounter_details_v2 with (security_invoker = true) as
 
     with
         symptoms as (
@@ -1018,7 +1021,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.phskc_encounter_details_v1 as
+create or replace view shipping.phskc_encounter_details_v1 with (security_invoker = true) as
 
     with
         phskc_encounters as (
@@ -1089,7 +1092,7 @@ comment on view shipping.phskc_encounter_details_v1 is
 
 
 /******************** VIEWS FOR IDM MODELERS ********************/
-create or replace view shipping.incidence_model_observation_v1 as
+create or replace view shipping.incidence_model_observation_v1 with (security_invoker = true) as
 
     select encounter.identifier as encounter,
 
@@ -1187,7 +1190,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.incidence_model_observation_v2 as
+create or replace view shipping.incidence_model_observation_v2 with (security_invoker = true) as
 
     select encounter.identifier as encounter,
 
@@ -1282,7 +1285,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.incidence_model_observation_v3 as
+create or replace view shipping.incidence_model_observation_v3 with (security_invoker = true) as
 
     select encounter.identifier as encounter,
 
@@ -1357,7 +1360,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.incidence_model_observation_v4 as
+create or replace view shipping.incidence_model_observation_v4 with (security_invoker = true) as
 
     select encounter.identifier as encounter,
 
@@ -1443,7 +1446,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.observation_with_presence_absence_result_v1 as
+create or replace view shipping.observation_with_presence_absence_result_v1 with (security_invoker = true) as
 
     select target,
            present,
@@ -1458,7 +1461,7 @@ comment on view shipping.observation_with_presence_absence_result_v1 is
   'Joined view of shipping.incidence_model_observation_v2 and shipping.presence_absence_result_v1';
 
 
-create or replace view shipping.observation_with_presence_absence_result_v2 as
+create or replace view shipping.observation_with_presence_absence_result_v2 with (security_invoker = true) as
 
     select target,
            present,
@@ -1473,7 +1476,7 @@ comment on view shipping.observation_with_presence_absence_result_v2 is
   'Joined view of shipping.incidence_model_observation_v3 and shipping.presence_absence_result_v1';
 
 
-create or replace view shipping.hcov19_presence_absence_result_v1 as
+create or replace view shipping.hcov19_presence_absence_result_v1 with (security_invoker = true) as
 
     -- Collapse potentially multiple hCoV-19 results
     select distinct on (sample_id)
@@ -1535,7 +1538,7 @@ comment on view shipping.hcov19_presence_absence_result_v1 is
   'Custom view of hCoV-19 samples with non-clinical presence-absence results';
 
 
-create or replace view shipping.hcov19_observation_v1 as
+create or replace view shipping.hcov19_observation_v1 with (security_invoker = true) as
     -- TODO figure out if it's possible to refactor the nested query inside this
     -- CTE to query shipping.hcov19_presence_absence_result_v1. I could not
     -- figure out how to do it without dropping some rows.  -- kfay
@@ -1682,7 +1685,7 @@ comment on view shipping.hcov19_observation_v1 is
   'Custom view of hCoV-19 samples with presence-absence results and best available encounter data';
 
 
-create or replace view shipping.observation_with_presence_absence_result_v3 as
+create or replace view shipping.observation_with_presence_absence_result_v3 with (security_invoker = true) as
     with hcov19_pa as (
       select
         sample.identifier as sample,
@@ -1908,7 +1911,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.scan_follow_up_encounters_v1 as
+create or replace view shipping.scan_follow_up_encounters_v1 with (security_invoker = true) as
 
     with
         fu_illness as (
@@ -2416,7 +2419,7 @@ grant select
   to "incidence-modeler";
 
 
-create or replace view shipping.scan_encounters_with_best_available_vaccination_data_v1 as
+create or replace view shipping.scan_encounters_with_best_available_vaccination_data_v1 with (security_invoker = true) as
 
     with vac_1_most_frequent_valid_date as (
       select distinct on (individual)
@@ -2607,7 +2610,7 @@ create or replace view shipping.scan_encounters_with_best_available_vaccination_
 
 
 /******************** VIEWS FOR GENOMIC DATA ********************/
-create or replace view shipping.flu_assembly_jobs_v1 as
+create or replace view shipping.flu_assembly_jobs_v1 with (security_invoker = true) as
 
     select sample.identifier as sfs_uuid,
            sample.details ->> 'nwgc_id' as nwgc_id,
@@ -2641,7 +2644,7 @@ comment on view shipping.flu_assembly_jobs_v1 is
     'View of flu jobs that still need to be run through the assembly pipeline';
 
 
-create or replace view shipping.genome_submission_metadata_v1 as
+create or replace view shipping.genome_submission_metadata_v1 with (security_invoker = true) as
 
     select
         sample.identifier as sfs_sample_identifier,
@@ -2757,7 +2760,7 @@ grant select
   to "assembly-exporter";
 
 
-create or replace view shipping.genomic_sequences_for_augur_build_v1 as
+create or replace view shipping.genomic_sequences_for_augur_build_v1 with (security_invoker = true) as
 
     select distinct on (sample.identifier, organism.lineage, segment)
            sample.identifier as sample,
@@ -2784,7 +2787,7 @@ grant select
   to "augur-build-exporter";
 
 
-create or replace view shipping.metadata_for_augur_build_v2 as
+create or replace view shipping.metadata_for_augur_build_v2 with (security_invoker = true) as
 
     select sample as strain,
             cast(encountered as date) as date,
@@ -2820,7 +2823,7 @@ grant select
   to "augur-build-exporter";
 
 
-create or replace view shipping.metadata_for_augur_build_v3 as
+create or replace view shipping.metadata_for_augur_build_v3 with (security_invoker = true) as
 
     select sample.identifier as strain,
             coalesce(
@@ -2863,7 +2866,7 @@ grant select
 
 
 /******************** VIEWS FOR REPORTING RESULTS ********************/
-create or replace view shipping.reportable_condition_v1 as
+create or replace view shipping.reportable_condition_v1 with (security_invoker = true) as
 
     with reportable as (
         select array_agg(lineage) as lineages
@@ -2937,7 +2940,7 @@ grant select
    to "reportable-condition-notifier";
 
 
-create or replace view shipping.return_results_v1 as
+create or replace view shipping.return_results_v1 with (security_invoker = true) as
 
     select barcode,
            case
@@ -2973,7 +2976,7 @@ comment on view shipping.return_results_v1 is
     'View of barcodes and presence/absence results for return of results on website';
 
 
-create or replace view shipping.return_results_v2 as
+create or replace view shipping.return_results_v2 with (security_invoker = true) as
 
     select barcode,
            case
@@ -3007,7 +3010,7 @@ comment on view shipping.return_results_v2 is
     'Version 2 of view of barcodes and presence/absence results for return of results on website';
 
 
-create or replace view shipping.return_results_v3 as
+create or replace view shipping.return_results_v3 with (security_invoker = true) as
 
     with samples as (
       select
@@ -3094,7 +3097,7 @@ grant select
     to "return-results-exporter";
 
 
-create or replace view shipping.scan_return_results_v1 as
+create or replace view shipping.scan_return_results_v1 with (security_invoker = true) as
 
     with scan_samples as (
       select
@@ -3156,7 +3159,7 @@ comment on view shipping.scan_return_results_v1 is
 
 
 /******************** VIEWS FOR POWER BI DASHBOARDS ********************/
-create or replace view shipping.scan_demographics_v1 as
+create or replace view shipping.scan_demographics_v1 with (security_invoker = true) as
 
     select
         encountered_week,
@@ -3183,7 +3186,7 @@ grant select
     to "scan-dashboard-exporter";
 
 
-create or replace view shipping.scan_demographics_v2 as
+create or replace view shipping.scan_demographics_v2 with (security_invoker = true) as
 
     with hcov19_presence_absence as (
         select
@@ -3248,7 +3251,7 @@ grant select
     to "scan-dashboard-exporter";
 
 
-create or replace view shipping.scan_hcov19_result_counts_v1 as
+create or replace view shipping.scan_hcov19_result_counts_v1 with (security_invoker = true) as
 
     with scan_hcov19_results as (
       select
@@ -3303,7 +3306,7 @@ grant select
     to "scan-dashboard-exporter";
 
 
-create or replace view shipping.scan_hcov19_result_counts_v2 as
+create or replace view shipping.scan_hcov19_result_counts_v2 with (security_invoker = true) as
 
     with scan_hcov19_results as (
       select
@@ -3362,7 +3365,7 @@ grant select
     to "scan-dashboard-exporter";
 
 
-create or replace view shipping.scan_enrollments_v1 as
+create or replace view shipping.scan_enrollments_v1 with (security_invoker = true) as
 
     with location_names as (
         select
@@ -3403,7 +3406,7 @@ grant select
     to "scan-dashboard-exporter";
 
 
-create or replace view shipping.scan_redcap_enrollments_v1 as
+create or replace view shipping.scan_redcap_enrollments_v1 with (security_invoker = true) as
 
     select
         illness_questionnaire_date,
@@ -3429,7 +3432,7 @@ grant select
 /******************** VIEWS FOR UW REOPENING ********************/
 
 -- Not linebreaking this wide text in order to make reading and reviewing easier.
-create or replace view shipping.uw_reopening_enrollment_fhir_encounter_details_v1 as
+create or replace view shipping.uw_reopening_enrollment_fhir_encounter_details_v1 with (security_invoker = true) as
 
     select
         encounter_id,
@@ -3537,7 +3540,7 @@ grant select
    to "incidence-modeler";
 
 
-create or replace view shipping.uw_reopening_encounters_v1 as
+create or replace view shipping.uw_reopening_encounters_v1 with (security_invoker = true) as
 (
   with enrollments as
   (
@@ -3696,7 +3699,7 @@ grant select
   to "incidence-modeler";
 
 
-create or replace view shipping.uw_reopening_results_hct_data_pulls as
+create or replace view shipping.uw_reopening_results_hct_data_pulls with (security_invoker = true) as
 (
   with encounters as
       (
@@ -3739,7 +3742,7 @@ grant select
   on shipping.uw_reopening_results_hct_data_pulls
   to "incidence-modeler";
 
-create or replace view shipping.uw_reopening_encounters_hct_data_pulls as
+create or replace view shipping.uw_reopening_encounters_hct_data_pulls with (security_invoker = true) as
 (
   with enrollments as
   (
@@ -3801,7 +3804,7 @@ grant select
   to "incidence-modeler";
 
 
-create or replace view shipping.uw_reopening_ehs_reporting_v1 as
+create or replace view shipping.uw_reopening_ehs_reporting_v1 with (security_invoker = true) as
 (
   with encounters as
   (
@@ -3869,340 +3872,11 @@ comment on view shipping.uw_reopening_ehs_reporting_v1 is
   to "ehs-results-exporter";
 
 
-create materialized view shipping.__uw_encounters as (
-  select
-    encounter.encounter_id
-    , individual.identifier as individual
-    , encounter.encountered::date as encountered
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'url' ) as redcap_url
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'project_id' ) as redcap_project_id
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'record_id' ) as redcap_record_id
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'event_name' ) as redcap_event_name
-    , jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'repeat_instance' ) as redcap_repeat_instance
-    , q_screen_positive.boolean_response as screen_positive
-    , q_daily_symptoms.boolean_response as daily_symptoms
-    , case when q_daily_exposure.encounter_id is null then null when q_daily_exposure.string_response[1] in ('yes', 'yes_vac') then true else false end as daily_exposure
-    , q_daily_exposure_known_pos.string_response[1] as daily_exposure_known_pos
-    , q_daily_travel.string_response[1] as daily_travel
-    , q_testing_trigger.boolean_response as testing_trigger
-    , q_surge_selected_flag.boolean_response as surge_selected_flag
-    , (select max(collected)::date from warehouse.sample where encounter_id = encounter.encounter_id group by encounter_id) as sample_collection_date
-    , q_prior_test_positive_date.date_response[1]::date as prior_test_positive_date
-	from warehouse.encounter
-	join warehouse.individual using (individual_id)
-	left join shipping.fhir_questionnaire_responses_v1 q_screen_positive on q_screen_positive.encounter_id = encounter.encounter_id and q_screen_positive.link_id = 'screen_positive'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_symptoms on q_daily_symptoms.encounter_id = encounter.encounter_id and q_daily_symptoms.link_id = 'daily_symptoms'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_exposure on q_daily_exposure.encounter_id = encounter.encounter_id and q_daily_exposure.link_id = 'daily_exposure'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_exposure_known_pos on q_daily_exposure_known_pos.encounter_id = encounter.encounter_id and q_daily_exposure_known_pos.link_id = 'daily_exposure_known_pos'
-	left join shipping.fhir_questionnaire_responses_v1 q_daily_travel on q_daily_travel.encounter_id = encounter.encounter_id and q_daily_travel.link_id = 'daily_travel'
-	left join shipping.fhir_questionnaire_responses_v1 q_testing_trigger on q_testing_trigger.encounter_id = encounter.encounter_id and q_testing_trigger.link_id = 'testing_trigger'
-	left join shipping.fhir_questionnaire_responses_v1 q_surge_selected_flag on q_surge_selected_flag.encounter_id = encounter.encounter_id and q_surge_selected_flag.link_id = 'surge_selected_flag'
-	left join shipping.fhir_questionnaire_responses_v1 q_prior_test_positive_date on q_prior_test_positive_date.encounter_id = encounter.encounter_id and q_prior_test_positive_date.link_id = 'prior_test_positive_date'
-	where
-            encounter.identifier like 'https://hct.redcap.rit.uw.edu/45/%/encounter_arm_1/%'
-    or
-            encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/encounter_arm_1/%'
-)
-;
-
-create unique index __uw_encounters_unique_encounter_id on shipping.__uw_encounters (encounter_id);
-
-comment on materialized view shipping.__uw_encounters is
-  'Pull records from the encounter arm of the UW Reopening project. Include key questionnaire values.';
-
-
-create or replace view shipping.__uw_priority_queue_v1 as (
-    with uw_individual_summaries as (
-	    select
-		    individual,
-		    max(encountered) filter (where testing_trigger is true) as latest_invite_date,
-		    max(sample_collection_date) filter (where sample_collection_date is not null) as latest_collection_date,
-		    count(*) filter (where testing_trigger is true) as invitation_count,
-		    max(sample_collection_date) filter (where pa.present = true) as latest_positive_hcov19_collection_date,
-		    max(prior_test_positive_date) filter (where prior_test_positive_date is not null) as latest_prior_test_positive_date
-	    from shipping.__uw_encounters
-	    left join warehouse.sample using (encounter_id)
-	    left join shipping.hcov19_presence_absence_result_v1 pa using (sample_id)
-	    group by individual
-     ),
-
-    uw_enrollments as (
-        select
-            encounter.encounter_id,
-            individual.identifier as individual,
-            encounter.encountered::date as encountered,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'url' ) as redcap_url,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'project_id' ) as redcap_project_id,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'record_id' ) as redcap_record_id,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'event_name' ) as redcap_event_name,
-            jsonb_extract_path_text (encounter.details, '_provenance', 'redcap', 'repeat_instance' ) as redcap_repeat_instance,
-            latest_invite_date,
-            latest_collection_date,
-            coalesce(invitation_count, 0) as invitation_count,
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base::date as prior_test_positive_date_base,
-            on_campus_freq,
-            added_surveillance_groups,
-            alerts_off
-        from warehouse.encounter
-        join warehouse.individual using (individual_id)
-        join shipping.uw_reopening_enrollment_fhir_encounter_details_v1 using (encounter_id)
-        left join uw_individual_summaries on uw_individual_summaries.individual = individual.identifier
-        where encounter.identifier like 'https://hct.redcap.rit.uw.edu/148/%/enrollment_arm_1/'
-    ),
-
-    -- Select encounters for testing based on positive daily attestations
-    positive_daily_attestations as (
-        select
-            __uw_encounters.redcap_url,
-            __uw_encounters.redcap_project_id,
-            __uw_encounters.redcap_record_id,
-            __uw_encounters.redcap_event_name,
-            __uw_encounters.redcap_repeat_instance,
-            __uw_encounters.encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            case
-                when daily_symptoms then 1
-
-                /* Why 2 days after attestation to exposures? We don't want
-                 * to offer testing too early after exposure and risk false
-                 * negatives. Per Trevor, we expect that a viral load high
-                 * enough to detect with PCR and be contagious is generally
-                 * centered on day 3 after exposure, though some will be
-                 * earlier and some later.  By offering testing at day 2, some
-                 * people will get tested that same day (day 2), most will
-                 * (hopefully) get tested the next day (day 3), and some others
-                 * by the day after that (day 4). This puts results being known
-                 * at days 3–5.
-                 * -trs, 19 Oct 2020
-
-                 * The `yes_now` option replaced `yes` in Winter Quarter 2021,
-                 * with the wording for `yes_now` being `Yes, I was exposed to COVID-19
-                 * in the last 48 hours`, but we kept both in the query so that the query
-                 * would work before and after the option change.
-                 */
-                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 1
-                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 1
-
-                /* The `yes_late` option takes care of the 48 hours. The option label is
-                 * `Yes, I was exposed to COVID-19 more than 48 hours ago`
-                 */
-                when daily_exposure_known_pos = 'yes_late' then 1
-                when daily_travel in ('yes_state', 'yes_country') then 1
-                else null -- The final SELECT at the end of the view drops records with a NULL priority
-            end as priority,
-            case
-                when daily_symptoms then 'symptomatic'
-                when daily_exposure_known_pos in ('yes', 'yes_now') and age(__uw_encounters.encountered) >= '2 days' then 'exposure_to_known_positive'
-                when daily_exposure and age(__uw_encounters.encountered) >= '2 days' then 'gathering_over_10'
-                when daily_exposure_known_pos = 'yes_late' then 'exposure_to_known_positive'
-                when daily_travel in ('yes_state', 'yes_country') then 'travel'
-                else null
-            end as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from shipping.__uw_encounters
-        join uw_enrollments using (individual)
-        -- Filter to encounters within the last 7 days so we don't send invites for old attestations
-        where age(__uw_encounters.encountered) <= '7 days'
-        -- Filter to encounters for participants whose last invite was over 3 days before encounter
-        and (latest_invite_date is null or latest_invite_date < __uw_encounters.encountered - interval '3 days')
-        -- Filter to encounters for participants who have never had a sample collected or their last sample collection was over 3 days before encounter
-        and (latest_collection_date is null or latest_collection_date < __uw_encounters.encountered - interval '3 days')
-        -- Filter for instances that do no already have testing_trigger filled
-        and testing_trigger is null
-        -- Filter for postive daily attestations only
-        and screen_positive
-    ),
-
-    -- Select added_surveillance_groups if they are in the group for today
-    added_surveillance_groups as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            2 as priority,
-            'surveillance' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to added_surveillance_groups for today.
-        -- To_Char(current_date, 'day') returns a string padded to 9 characters, so trim it.
-        -- Example: where 'tuesday' = 'tuesday'
-        where added_surveillance_groups = trim(To_Char(current_date, 'day'))
-        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
-        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
-	  ),
-
-    -- Select enrollments for baseline testing
-    baseline as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            4 as priority,
-            'baseline' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to participants who enrolled after this date when
-        -- baseline test invitations were handled manually
-        where encountered > '2021-11-15'
-         -- Filter to enrollments have never had a sample collected
-        and latest_collection_date is null
-        -- Filter to enrollments that have been invited up to 2 times
-        and invitation_count < 2
-        -- Filter for participants who haven't ever been invited or haven't been invited in 3 days
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-    ),
-
-    -- Select enrollments for surveillance testing
-    surveillance as (
-        select
-            redcap_url,
-            redcap_project_id,
-            redcap_record_id,
-            redcap_event_name,
-            redcap_repeat_instance,
-            encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            5 as priority,
-            'surveillance' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from uw_enrollments
-        -- Filter to participants who come to campus
-        where (on_campus_freq != 'not_on_campus')
-        -- Filter to participants whose last invite was over 3 days before today
-        and (latest_invite_date is null or latest_invite_date < current_date - interval '3 days')
-        -- Filter to participants who have never had a sample collected or whose last sample collection was over 3 days before today
-        and (latest_collection_date is null or latest_collection_date < current_date - interval '3 days')
-    ),
-
-    /**
-    Select encounters for surge testing purposes.
-    Handled separately from daily attestation encounters because we want to
-    include all surge selected participants regardless of previous testing.
-    **/
-    surge_testing as (
-        select
-            __uw_encounters.redcap_url,
-            __uw_encounters.redcap_project_id,
-            __uw_encounters.redcap_record_id,
-            __uw_encounters.redcap_event_name,
-            __uw_encounters.redcap_repeat_instance,
-            __uw_encounters.encountered,
-            individual,
-            latest_invite_date,
-            latest_collection_date,
-            3 as priority,
-            'surge_testing' as priority_reason,
-
-            latest_positive_hcov19_collection_date,
-            latest_prior_test_positive_date,
-            prior_test_positive_date_base,
-            alerts_off
-        from shipping.__uw_encounters
-        join uw_enrollments using (individual)
-        -- Filter for instances that have been selected with surge_selected_flag
-        where surge_selected_flag is true
-        -- Filter for instances that do no already have testing_trigger filled
-        and testing_trigger is null
-         -- Filter to encounters within the last 7 days so we don't send invites for old surges
-        and age(__uw_encounters.encountered) <= '7 days'
-    )
-
-    -- The final SELECT to UNION ALL results from each prioritization category and to filter
-    -- for clauses that are common across all prioritization categories.
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason
-    from
-    (
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from positive_daily_attestations
-    where priority is not null
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from baseline
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from surveillance
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from surge_testing
-
-    union all
-
-    select redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance,
-    encountered, individual, latest_invite_date, latest_collection_date, priority,
-    priority_reason, latest_positive_hcov19_collection_date, latest_prior_test_positive_date,
-    prior_test_positive_date_base, alerts_off
-    from added_surveillance_groups
-    ) as a
-    where
-    -- Filter for participants who have not tested positive with us in the past 14 days
-    (latest_positive_hcov19_collection_date is null or latest_positive_hcov19_collection_date < current_date - interval '14 days')
-
-    -- Filter for participants who have not tested positive somewhere else (reported on daily attestation) in the past 14 days
-    and (latest_prior_test_positive_date is null or latest_prior_test_positive_date < current_date - interval '14 days')
-
-    -- Filter for participants who have not tested positive somewhere else (reported on enrollment) in the past 14 days
-    and (prior_test_positive_date_base is null or prior_test_positive_date_base < current_date - interval '14 days')
-
-    -- Filter for participants who will receive alerts from REDCap
-    -- Because those with this set to 'off' won't receive alerts, these invitations to test would be wasted because the
-    -- participants wouldn't know that they've been invited.
-    and (alerts_off is null or alerts_off <> 'off')
+create or replace view shipping.__uw_priority_queue_v1 with (security_invoker = true) as (
+    -- Defined by a function so that shipping.refresh_uw_priority_queue() can
+    -- rescore only some individuals
+    select *
+    from shipping.uw_priority_queue_entries(null)
 )
 ;
 
@@ -4210,7 +3884,7 @@ comment on view shipping.__uw_priority_queue_v1 is
   'Identify all encounter instances which indicate need for testing by UW reopening study (contains duplicate individuals)';
 
 
-create or replace view shipping.uw_priority_queue_v1 as (
+create or replace view shipping.uw_priority_queue_v1 with (security_invoker = true) as (
     with distinct_individuals as (
         select distinct on (individual)
             redcap_url,
@@ -4253,7 +3927,7 @@ grant select
 
 
 
-create or replace view shipping.linelist_data_for_wa_doh_v1 as (
+create or replace view shipping.linelist_data_for_wa_doh_v1 with (security_invoker = true) as (
     select distinct on (sample_id)
           -- The naming scheme of these columns is an artefact of how we
           -- originally submitted data to WaDoH from REDCap reports. Now they
@@ -4320,7 +3994,7 @@ grant select
 
 
 
-create or replace view shipping.linelist_data_for_wa_doh_v2 as (
+create or replace view shipping.linelist_data_for_wa_doh_v2 with (security_invoker = true) as (
     select distinct on (sample_id)
           -- The naming scheme of these columns is an artefact of how we
           -- originally submitted data to WaDoH from REDCap reports. Now they
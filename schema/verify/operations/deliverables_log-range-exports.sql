@@ -0,0 +1,15 @@
+-- Verify seattleflu/id3c-customizations:operations/deliverables_log-range-exports on pg
+
+begin;
+
+select qc_details
+  from operations.deliverables_log
+ where false;
+
+do $$
+begin
+    assert to_regclass('operations.deliverables_log_process_name_sent_idx') is not null;
+end
+$$;
+
+rollback;
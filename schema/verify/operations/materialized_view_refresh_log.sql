@@ -0,0 +1,8 @@
+-- Verify seattleflu/id3c-customizations:operations/materialized_view_refresh_log on pg
+
+begin;
+
+select pg_catalog.has_table_privilege('operations.materialized_view_refresh_log', 'select');
+select pg_catalog.has_table_privilege('operations.materialized_view_refresh_log', 'insert');
+
+rollback;
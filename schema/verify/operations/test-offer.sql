@@ -0,0 +1,9 @@
+-- Verify seattleflu/id3c-customizations:operations/test-offer on pg
+
+begin;
+
+select test_offer_id, individual, redcap_url, redcap_project_id, redcap_record_id, redcap_event_name, redcap_repeat_instance, priority, priority_reason, offered
+  from operations.test_offer
+ where false;
+
+rollback;
@@ -4,5 +4,8 @@ begin;
 
 select 1/pg_catalog.has_database_privilege('uw-priority-queue-processor', :'DBNAME', 'connect')::int;
 select 1/pg_catalog.has_schema_privilege('uw-priority-queue-processor', 'shipping', 'usage')::int;
+select 1/pg_catalog.has_table_privilege('uw-priority-queue-processor', 'shipping.__uw_priority_queue', 'select')::int;
+select 1/pg_catalog.has_function_privilege('uw-priority-queue-processor', 'shipping.refresh_uw_priority_queue(boolean)', 'execute')::int;
+select 1/pg_catalog.has_table_privilege('uw-priority-queue-processor', 'operations.test_offer', 'insert')::int;
 
 rollback;
@@ -0,0 +1,9 @@
+-- Verify seattleflu/id3c-customizations:shipping/incremental-exports on pg
+
+begin;
+
+select latest_result_id, created
+  from shipping.latest_results
+ where false;
+
+rollback;
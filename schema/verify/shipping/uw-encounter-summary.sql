@@ -0,0 +1,17 @@
+-- Verify seattleflu/id3c-customizations:shipping/uw-encounter-summary on pg
+
+begin;
+
+select encounter_id, individual, encountered, screen_positive, sample_collection_date
+  from shipping.__uw_encounter_summary
+ where false;
+
+select change_id, encounter_id, changed
+  from shipping.__uw_encounter_summary_changes
+ where false;
+
+select 1/(count(*) = 6)::int
+  from pg_trigger
+ where tgname like 'queue_uw_encounter_changes_on_%';
+
+rollback;
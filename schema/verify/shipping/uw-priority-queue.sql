@@ -0,0 +1,23 @@
+-- Verify seattleflu/id3c-customizations:shipping/uw-priority-queue on pg
+
+begin;
+
+select individual, priority, priority_reason, latest_invite_date, latest_collection_date, encountered
+  from shipping.__uw_priority_queue
+ where false;
+
+select change_id, individual, changed
+  from shipping.__uw_priority_queue_changes
+ where false;
+
+select 1/(count(*) = 1)::int
+  from shipping.__uw_priority_queue_rescored;
+
+select individual, priority, priority_reason
+  from shipping.uw_priority_queue_entries(array[]::text[]);
+
+select 1/(count(*) = 9)::int
+  from pg_trigger
+ where tgname like 'queue_uw_priority_queue_changes_on_%';
+
+rollback;
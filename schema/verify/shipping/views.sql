@@ -184,6 +184,11 @@ select 1/(count(*) = 1)::int
  where array[table_schema, table_name]::text[]
      = pg_catalog.parse_ident('shipping.uw_reopening_results_hct_data_pulls');
 
+select 1/(count(*) = 1)::int
+  from information_schema.views
+ where array[table_schema, table_name]::text[]
+     = pg_catalog.parse_ident('shipping.uw_reopening_results_hct_data_pulls_v2');
+
 select 1/(count(*) = 1)::int
   from information_schema.views
  where array[table_schema, table_name]::text[]
@@ -199,7 +204,9 @@ select 1/(count(*) = 1)::int
  where array[table_schema, table_name]::text[]
      = pg_catalog.parse_ident('shipping.hcov19_presence_absence_result_v1');
 
-select 1/(count(*) = 1)::int
+-- Verify that the materialized view has been replaced by
+-- shipping.__uw_encounter_summary
+select 1/(count(*) = 0)::int
   from pg_matviews
  where array[schemaname, matviewname]::text[]
      = pg_catalog.parse_ident('shipping.__uw_encounters');
@@ -69,11 +69,18 @@ setup(
     extras_require = {
         "dev": [
             "mypy",
+            "pyarrow",
             "pytest >=6.2.5,!=7.0.0",
             "sqlparse",
             "types-requests",
             "types-python-dateutil",
         ],
+        "zstd": [
+            "zstandard",
+        ],
+        "arrow": [
+            "pyarrow",
+        ],
         "locations": [
             "pandas ==1.5.3",
             "snakemake",